@@ -6,15 +6,17 @@ that you're using Git, Nginx and your using Debian or Ubuntu.
 
 """
 
-import json, os
+import glob, hashlib, json, os, re, string, tarfile, tempfile, time
 from contextlib import nested
-from datetime import datetime
+from functools import wraps
+from StringIO import StringIO
 
-from fabric.api import (cd, env, execute, hide, lcd, local, prefix, prompt,
-                        put, puts, roles, run, settings, sudo, task,
-                        with_settings)
+from fabric.api import (abort, cd, env, execute, get, hide, local,
+                        prefix, prompt, put, puts, roles, run, settings, sudo,
+                        task, with_settings)
 from fabric.colors import cyan, green, red
 from fabric.contrib.files import append, exists
+from fabric.task_utils import merge
 
 
 # GLOBALS
@@ -26,12 +28,56 @@ env.local_branch = 'master'
 env.remote_ref = 'origin/master'
 
 env.project_path = '/home/{project_name}/{project_name}'.format(**env)
+# A symlink to the virtualenv of the current requirements, built beside it as
+# '<venv_path>-<hash of the requirement files>' (see requirements()).
 env.venv_path = '/home/{project_name}/.virtualenvs/{project_name}'.format(**env)
+# Number of virtualenvs kept on each host, the live one included.
+env.venvs_kept = 3
+# Where wheels are built (on the first web host) and shipped to, one
+# directory per requirements hash. A copy is kept locally in var/wheelhouse.
+env.wheelhouse_path = '{project_path}/var/wheelhouse'.format(**env)
+
+# Where provision() keeps the chef files of each host between runs.
+env.chef_path = '/var/cache/chef-{project_name}'.format(**env)
 
 env.restart_command = 'supervisorctl restart {project_name}'.format(**env)
 env.restart_sudo = True
 
 env.compass_config = '{project_path}/{project_name}/static/config.rb'.format(**env)
+env.static_revision_file = '{project_path}/var/static.rev'.format(**env)
+
+env.gunicorn_pidfile = '{project_path}/var/gunicorn.pid'.format(**env)
+# nginx talks to gunicorn through this socket (see render_configs).
+env.gunicorn_socket = '{project_path}/var/gunicorn.sock'.format(**env)
+env.gunicorn_bind = 'unix:{gunicorn_socket}'.format(**env)
+# Idle connections nginx keeps open to gunicorn.
+env.upstream_keepalive = 16
+# Readiness check answered by wsgi.py (see {{ project_name }}.apps.core.health).
+env.health_path = '/_health/ready'
+# Addresses nginx answers the health checks for (the load balancers, the
+# hosts themselves); others get a 403.
+env.health_allow = ('127.0.0.1', '10.0.0.0/8', '172.16.0.0/12',
+                    '192.168.0.0/16')
+
+# How restart() restarts gunicorn: 'hard', 'reload' or 'upgrade' (see its
+# docstring), and how long it waits for the new workers to be ready.
+env.restart_mode = 'upgrade'
+env.restart_timeout = 60
+# Fraction of the web hosts a deploy restarts at the same time.
+env.restart_batch_fraction = 0.25
+
+# Maximum number of hosts a parallel deploy works on at the same time (unless
+# overridden with ``fab -z``).
+env.deploy_pool_size = 10
+
+# Number of deploys ``deploy_stats`` reports on by default. Each deploy
+# leaves a timing record in var/deploys/.
+env.deploy_stats_count = 10
+
+# Whether a deploy fails the hosts where ``manage.py perfcheck`` finds errors
+# in the settings of the environment, before restarting them (it only reports
+# them otherwise).
+env.perfcheck_fatal = False
 
 # env.forward_agent = True
 
@@ -50,6 +96,10 @@ def prod():
     }
     env.system_users = {env.site_url: env.project_name}
     env.environment = 'prod'
+    env.server_names = env.site_url
+    # Seconds anonymous GETs are cached by nginx, 0 to disable.
+    env.microcache = 2
+    env.perfcheck_fatal = True
     env.project_settings = '{project_name}.settings.{environment}'\
                            .format(**env)
     env.supervisord = '{project_path}/server/{environment}/supervisord.conf'\
@@ -65,6 +115,8 @@ def dev():
     }
     env.system_users = {env.site_url: env.project_name}
     env.environment = 'dev'
+    env.server_names = 'dev.{{ project_name }}.com {{ project_name }}.talpor.com localhost'
+    env.microcache = 1
     env.project_settings = '{project_name}.settings.{environment}'\
                            .format(**env)
     env.supervisord = '{project_path}/server/{environment}/supervisord.conf'\
@@ -80,6 +132,8 @@ def vgr():
     }
     env.system_users = {env.site_url: env.project_name}
     env.environment = 'dev'
+    env.server_names = 'dev.{{ project_name }}.com {{ project_name }}.talpor.com localhost'
+    env.microcache = 1
     env.project_settings = '{project_name}.settings.{environment}'\
                            .format(**env)
     env.supervisord = '{project_path}/server/{environment}/supervisord.conf'\
@@ -106,50 +160,78 @@ def bootstrap():
     sudo('apt-get -q -y update')
     sudo('apt-get -q -y upgrade')
     sudo('apt-get -q -y install ssl-cert ruby ruby-dev libopenssl-ruby '
-         'build-essential rubygems ruby-bundler')
+         'build-essential rubygems ruby-bundler memcached')
     sudo('gem install chef --no-ri --no-rdoc')
 
 @task
-@roles('web', 'db')
-def provision():
-    project_root = os.path.dirname(env.real_fabfile)
-    chef_root = os.path.join(project_root, 'bootstrap')
-    chef_name = 'chef-{0}'.format(datetime.utcnow().strftime('%Y-%m-%d-%H-%M-%S'))
-    chef_archive = '{0}.tar.gz'.format(chef_name)
-    local('cp -r {0} /tmp/{1}'.format(chef_root, chef_name))
-
-    with open(os.path.join(chef_root, 'nodes', '%s.json' % env.environment)) as f:
-        data = json.load(f)
-    project = data.setdefault('project', {})
-    project['environment'] = env.environment
-    with open('/tmp/{0}/node.json'.format(chef_name), 'w') as f:
-        json.dump(data, f)
-
-    solo_rb = ('file_cache_path "/tmp/chef-solo"',
-               'cookbook_path "/tmp/{0}/cookbooks"'.format(chef_name))
-    with lcd('/tmp'):
-        for line in solo_rb:
-            local("echo '{0}' >> {1}/solo.rb".format(line, chef_name))
-        local('tar czf {0} {1}'.format(chef_archive, chef_name))
-
-    # run chef
-    put('/tmp/{0}'.format(chef_archive), '/tmp/{0}'.format(chef_archive))
-    local('rm -rf /tmp/{0}*'.format(chef_name))
-    with cd('/tmp'):
-        sudo('tar xf {0}'.format(chef_archive))
-    with cd('/tmp/{0}'.format(chef_name)):
-        with settings(warn_only=True):
-            print(cyan('Running Chef Solo...', bold=True))
-            sudo('chef-solo -c solo.rb -j node.json')
-    sudo('rm -rf /tmp/{0}*'.format(chef_name))
-
-    print(cyan('Copying ssh key and doing initial deploy...', bold=True))
-    upload_public_key()
-    execute(initial_deploy)
-    print(cyan('Restarting nginx...', bold=True))
-    sudo('service nginx restart')
+def provision(action='check', parallel='yes'):
+    """Provision the hosts with chef-solo, then deploy.
+
+    Each host keeps a copy of the ``bootstrap`` tree in ``env.chef_path``
+    along with the hash of every file and of the node JSON of its last
+    successful run. Only the files that changed since are uploaded, and
+    chef-solo isn't run at all when nothing changed, unless
+    ``action='force'``. Hosts are provisioned at the same time unless
+    ``parallel=no``.
+    """
+    key_path = _prompt_public_key()
+    bundle = _chef_bundle()
+    failed = {}
+    with settings(parallel=_truthy(parallel),
+                  pool_size=env.pool_size or env.deploy_pool_size):
+        _step(_provision_host, failed, bundle, key_path, action=action)
+    hosts = [host for host in _task_hosts(_provision_host)
+             if host not in failed]
+    if hosts:
+        print(cyan('Doing initial deploy...', bold=True))
+        execute(initial_deploy, hosts=hosts)
+    _report_failures(failed)
     check()
 
+@roles('web', 'db')
+def _provision_host(bundle, key_path, action='check'):
+    """Sync the changed chef files to the current host and run chef-solo.
+
+    nginx is restarted only when chef-solo ran. A failed run aborts, so that
+    the host is reported and left out of the initial deploy.
+    """
+    with hide('running', 'stdout'):
+        last = sudo('cat {chef_path}/manifest.json'.format(**env),
+                    warn_only=True, quiet=True)
+    try:
+        last = json.loads(last) if last.succeeded else {}
+    except ValueError:
+        last = {}
+    if last.get('digest') == bundle['digest'] and action != 'force':
+        puts('Nothing changed since the last provision, skipping chef-solo.')
+        changed = False
+    else:
+        _sync_chef_files(bundle['files'], last.get('files', {}))
+        put(StringIO(bundle['node']), '{chef_path}/node.json'.format(**env),
+            use_sudo=True)
+        put(StringIO('file_cache_path "/tmp/chef-solo"\n'
+                     'cookbook_path "{chef_path}/cookbooks"\n'.format(**env)),
+            '{chef_path}/solo.rb'.format(**env), use_sudo=True)
+        print(cyan('Running Chef Solo...', bold=True))
+        with cd(env.chef_path):
+            result = sudo('chef-solo -c solo.rb -j node.json', warn_only=True)
+        if result.succeeded:
+            put(StringIO(json.dumps({'digest': bundle['digest'],
+                                     'files': bundle['files']})),
+                '{chef_path}/manifest.json'.format(**env), use_sudo=True)
+        else:
+            # Not recorded: the next provision runs chef-solo again. The
+            # host is left out of the initial deploy.
+            print(red('chef-solo failed on {host_string}.'.format(**env)))
+            abort('chef-solo failed.')
+        changed = True
+
+    print(cyan('Copying ssh key...', bold=True))
+    upload_public_key(key_path)
+    if changed:
+        print(cyan('Restarting nginx...', bold=True))
+        sudo('service nginx restart')
+
 @task
 @with_settings(user=env.project_name)
 def initial_deploy(action=''):
@@ -185,10 +267,13 @@ def initial_deploy(action=''):
     print(cyan('Deploying...', bold=True))
     deploy(action='force')
 
-def upload_public_key():
+def _prompt_public_key():
     path = prompt('Path to your public key? [~/.ssh/id_rsa.pub]') or \
            '~/.ssh/id_rsa.pub'
-    path = os.path.expanduser(path)
+    return os.path.expanduser(path)
+
+def upload_public_key(path=None):
+    path = path or _prompt_public_key()
     if os.path.exists(path):
         key = ' '.join(open(path).read().strip().split(' ')[:2])
         sudo('mkdir -p /home/{project_name}/.ssh'.format(**env))
@@ -209,26 +294,29 @@ def upload_public_key():
 
 @task
 @roles('web', 'db')
-def cmd(cmd='', path=None):
-    """Run a command in the site directory.  Usable from other
-    commands or the CLI.
+def cmd(cmd='', path=None, venv=None):
+    """Run a command in the site directory, within the live virtualenv (or
+    ``venv``).  Usable from other commands or the CLI.
     """
     if not cmd:
         cmd = prompt('Command to run:')
+    if venv:
+        activate = 'source {0}/bin/activate'.format(venv)
+    else:
+        activate = 'workon {project_name}'.format(**env)
     if cmd:
-        with nested(cd(path or env.project_path),
-                    prefix('workon {project_name}'.format(**env))):
+        with nested(cd(path or env.project_path), prefix(activate)):
             return run(cmd)
 
 @task
 @roles('web', 'db')
-def manage_py(mcmd):
+def manage_py(mcmd, venv=None):
     """Returns a string for a manage.py command execution."""
     if not mcmd:
         mcmd = prompt('./manage.py: ')
     if mcmd:
         return cmd('python manage.py ' + mcmd +
-                   ' --settings={project_settings}'.format(**env))
+                   ' --settings={project_settings}'.format(**env), venv=venv)
 
 @task
 @roles('web', 'db')
@@ -243,27 +331,53 @@ def supervisorctl(scmd):
 # PROJECT MAINTENANCE
 # -----------------------------------------------------------------------------
 @task
-@roles('web', 'db')
-def deploy(verbosity='normal', action='check'):
+def deploy(verbosity='normal', action='check', parallel=None, pool_size=None):
     """Full server deploy.
 
     Updates the repository (server-side), synchronizes the database, collects
     static files and then restarts the web service.
+
+    The settings of the environment are checked by ``update`` on every host,
+    with the new code (see ``perfcheck``): in production, settings that would
+    slow the site down fail the host before it is restarted.
+
+    Each step runs once per host, even when a host belongs to several roles.
+    Use ``parallel=yes`` (or ``fab -P``) to run every step on all of its hosts
+    at the same time, at most ``pool_size`` hosts at once. A host that fails a
+    step is reported and left out of the remaining steps, the other hosts
+    carry on.
+
+    The time each step took on each host, and the number of remote commands
+    it ran, are recorded in ``var/deploys/``, see ``deploy_stats``.
     """
     if verbosity == 'noisy':
         hide_args = []
     else:
         hide_args = ['running', 'stdout']
 
-    with hide(*hide_args):
+    if parallel is None:
+        parallel = env.parallel
+    pool_size = int(pool_size or env.pool_size or env.deploy_pool_size)
+
+    failed = {}
+    env.deploy_steps = []
+    started = time.time()
+    with nested(hide(*hide_args),
+                settings(parallel=_truthy(parallel), pool_size=pool_size)):
+        puts('Building wheels...')
+        # Without wheels the hosts build their requirements themselves: a
+        # failure here doesn't leave the build host out of the deploy.
+        _step(wheelhouse, {}, hosts=_task_hosts(wheelhouse)[:1])
         puts('Updating repository...')
-        execute(update, action=action)
+        _step(update, failed, action=action)
         puts('Collecting static files...')
-        execute(collectstatic)
+        _step(collectstatic, failed, action=action)
         puts('Synchronizing database...')
-        execute(syncdb)
+        _step(syncdb, failed)
         puts('Restarting web server...')
-        execute(restart)
+        _rolling_step(restart, failed, env.restart_batch_fraction)
+    _save_deploy_record(started, failed)
+    _report_failures(failed)
 
 @task
 @roles('web', 'db')
@@ -274,6 +388,13 @@ def update(action='check'):
     requirements will be updated. Use ``action='force'`` to force updating
     requirements. Anything else other than ``'check'`` will avoid updating
     requirements at all.
+
+    The bytecode of the project and the virtualenv is then compiled, so that
+    the restarted workers don't have to, and the installed apps are imported
+    once: a host whose code doesn't import fails here, before its restart.
+    Both use the virtualenv of the new requirements, which ``restart`` only
+    switches to, and so does ``perfcheck``, run last: failing it fails the
+    host when ``env.perfcheck_fatal`` is set.
     """
     with cd(env.project_path):
         remote, dest_branch = env.remote_ref.split('/', 1)
@@ -297,15 +418,21 @@ def update(action='check'):
             stylesheets_changed = False
 
         run('git merge {remote_ref}'.format(**env))
-        run('find -name "*.pyc" -delete')
         # run('git clean -df') # it deletes var.
 
-    # Not using execute() because we don't want to run multiple times for
-    # each role (since this task gets run per role).
+    # Not using execute() because this task already runs once per host, we
+    # only want to touch the host we are on.
     if action == 'force' or reqs_changed:
         requirements()
     if action == 'force' or stylesheets_changed:
         compass()
+    manage_py('precompile', venv=_pending_virtualenv())
+    if not perfcheck():
+        if env.perfcheck_fatal:
+            abort('The {environment} settings failed the performance check, '
+                  'see above.'.format(**env))
+        print(red('The {environment} settings failed the performance check, '
+                  'restarting anyway.'.format(**env)))
 
 @task
 @roles('web', 'db')
@@ -317,47 +444,655 @@ def compass():
 
 @task
 @roles('web')
-def collectstatic():
+def collectstatic(action='check'):
     """Collect static files from apps and other locations in a single location.
+
+    Only the files added, changed or removed since the last collection are
+    processed (see the ``updatestatic`` command). Unless ``action='force'``,
+    nothing is done when no static file nor requirement changed since the
+    revision that was last collected.
     """
-    manage_py('collectstatic --link --noinput -v0')
+    with nested(cd(env.project_path), hide('running', 'stdout')):
+        revision = run('git rev-parse HEAD').strip()
+        if action != 'force' and not _static_changed(revision):
+            puts('No static file changed, skipping.')
+            return
+    manage_py('updatestatic --link --noinput -v0', venv=_pending_virtualenv())
+    run('echo {0} > {1}'.format(revision, env.static_revision_file))
 
 @task
 @roles('db')
 def syncdb(sync=True, migrate=True):
     """Synchronize the database."""
-    manage_py('syncdb --migrate --noinput')
+    manage_py('syncdb --migrate --noinput', venv=_pending_virtualenv())
+
+@task
+@roles('db')
+def clearsessions(batch_size=1000, pause=0.1):
+    """Delete the expired sessions, a batch at a time.
+
+    Meant to run regularly (e.g. daily from cron). Each batch of
+    ``batch_size`` sessions is a short transaction of its own, ``pause``
+    seconds apart, so that the table is never locked for long.
+    """
+    manage_py('prunesessions --batch-size={0} --pause={1}'
+              .format(int(batch_size), float(pause)))
 
 @task
 @roles('web')
-def restart(hard=False):
-    """Restart the web service."""
+def restart(hard=False, mode=None):
+    """Restart the web service.
+
+    ``mode`` (``env.restart_mode`` by default) is one of:
+
+    * ``hard``: ``supervisorctl restart all``, every worker is killed at once.
+    * ``reload``: send ``HUP`` to the gunicorn master, it reloads its
+      configuration and replaces the workers gracefully. The application is
+      preloaded so its code is *not* reloaded.
+    * ``upgrade``: send ``USR2`` to the gunicorn master, which re-executes
+      itself with the new code next to the old one. The old master is told to
+      ``QUIT`` (finishing its in-flight requests) once the new one is ready.
+
+    ``env.venv_path`` is switched to the virtualenv built by ``update`` first,
+    so that only the new processes use it.
+
+    Unless restarted with everything else, the job workers are restarted
+    (``stopsignal=TERM``: they finish their current jobs first) to pick up
+    the new code.
+    """
+    mode = mode or env.restart_mode
+    if mode not in ('hard', 'reload', 'upgrade'):
+        abort('Unknown restart mode: {0}'.format(mode))
+
+    _switch_virtualenv()
     with hide('running', 'stdout'):
         result = supervisorctl('status')
     if 'no such file' in result:
         cmd('supervisord -c {supervisord}'.format(**env))
-    else:
+    elif mode == 'hard':
         supervisorctl('restart all'.format(**env))
+    elif mode == 'reload':
+        run('kill -HUP $(cat {gunicorn_pidfile})'.format(**env))
+        if not _gunicorn_ready():
+            abort('gunicorn was not ready after a reload.')
+    else:
+        _upgrade_gunicorn()
+    if mode != 'hard' and 'no such file' not in result:
+        # supervisor 3.0 has no ``signal`` command.
+        with settings(warn_only=True):
+            jobs = supervisorctl('restart jobs')
+        if 'jobs: started' not in jobs:
+            abort('The job workers did not restart: {0}'.format(jobs))
     if hard:
         sudo('service nginx restart')
     check()
 
+@task
+@roles('web')
+def wheelhouse():
+    """Build wheels of the requirements of ``env.remote_ref``, once.
+
+    Run on a single host (where the wheels are built, so that they match the
+    servers), they are then kept in the local ``var/wheelhouse`` and shipped
+    to the other hosts by ``requirements``. Nothing is built when the wheels
+    of these requirement files are already there.
+    """
+    with nested(cd(env.project_path), hide('running', 'stdout')):
+        remote = env.remote_ref.split('/', 1)[0]
+        run('git fetch {0}'.format(remote))
+        tmp = run('mktemp -d').strip()
+        try:
+            run('git archive {remote_ref} requirements | tar -x -C {0}'
+                .format(tmp, **env))
+            digest = _requirements_hash(tmp)
+            local_dir = _local_wheelhouse(digest)
+            if os.path.isdir(local_dir):
+                return
+            wheel_dir = '{0}/{1}'.format(env.wheelhouse_path, digest)
+            if not exists(wheel_dir):
+                cmd('pip install --quiet wheel')
+                cmd('pip wheel --wheel-dir={0}.tmp -r '
+                    '{1}/requirements/{environment}.pip'
+                    .format(wheel_dir, tmp, **env))
+                run('mv {0}.tmp {0}'.format(wheel_dir))
+        finally:
+            run('rm -rf {0}'.format(tmp))
+    local('mkdir -p {0}.tmp'.format(local_dir))
+    get(wheel_dir + '/*.whl', local_dir + '.tmp')
+    local('mv {0}.tmp {0}'.format(local_dir))
+
 @task
 @roles('web', 'db')
 def requirements():
-    """Update the requirements."""
-    cmd('pip install -r {project_path}/requirements/{environment}.pip'\
-        .format(**env))
+    """Update the requirements.
+
+    Virtualenvs are keyed by the hash of the requirement files: an unchanged
+    set of requirements reuses its virtualenv at once. A new set gets a new
+    virtualenv, installed from the wheelhouse when there is one (see
+    ``wheelhouse``), beside the live one which keeps running meanwhile.
+    ``restart`` switches ``env.venv_path`` to it: the running workers, which
+    may still import modules lazily, never see the new one.
+    """
+    with hide('running', 'stdout'):
+        digest = _requirements_hash(env.project_path)
+        venv = '{venv_path}-{0}'.format(digest, **env)
+        if not exists(venv + '/.complete'):
+            _build_virtualenv(venv, digest)
+    puts('Built the virtualenv {0}.'.format(venv))
+
+
+@task
+def deploy_stats(count=None):
+    """Show how long the last ``count`` deploys took, step by step.
+
+    For each step: its time in every deploy, oldest first, its mean and its
+    slowest host. Times are those of the slowest host of the step.
+    """
+    count = int(count or env.deploy_stats_count)
+    paths = sorted(glob.glob(_local_var('deploys', '*.json')))[-count:]
+    if not paths:
+        abort('No deploy recorded in {0}.'.format(_local_var('deploys')))
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.append(json.load(f))
+
+    steps = []
+    for record in records:
+        for step in record['steps']:
+            if step['step'] not in steps:
+                steps.append(step['step'])
+    print(cyan('Last {0} deploys, in seconds:'.format(len(records)),
+               bold=True))
+    print('{0:<15} {1}   {2:>7} {3:>7}  {4}'.format(
+        'step', ' '.join('{0:>6}'.format(i + 1) for i in range(len(records))),
+        'mean', 'trend', 'slowest host (mean)'))
+    slowest_step, slowest_mean = None, 0
+    for name in steps:
+        times, hosts = [], {}
+        for record in records:
+            step = dict((s['step'], s) for s in record['steps']).get(name)
+            times.append(step and step['seconds'])
+            for host, timing in (step or {}).get('hosts', {}).items():
+                hosts.setdefault(host, []).append(timing['seconds'])
+        known = [t for t in times if t is not None]
+        mean = sum(known) / len(known)
+        if mean > slowest_mean:
+            slowest_step, slowest_mean = name, mean
+        # The last deploy against the mean of the ones before it.
+        trend = ''
+        if len(known) > 1 and times[-1] is not None:
+            before = sum(known[:-1]) / (len(known) - 1)
+            if before:
+                trend = '{0:+.0%}'.format(times[-1] / before - 1)
+        host_means = [(sum(t) / len(t), host) for host, t in hosts.items()]
+        slowest_host = '{1} ({0:.1f})'.format(*max(host_means)) \
+            if host_means else ''
+        print('{0:<15} {1}   {2:>7.1f} {3:>7}  {4}'.format(
+            name, ' '.join('{0:>6}'.format('-' if t is None else
+                                           '{0:.1f}'.format(t))
+                           for t in times),
+            mean, trend, slowest_host))
+    totals = [record['seconds'] for record in records]
+    print('{0:<15} {1}   {2:>7.1f}'.format(
+        'total', ' '.join('{0:>6.1f}'.format(t) for t in totals),
+        sum(totals) / len(totals)))
+    failed = sum(1 for record in records if record['failed'])
+    if failed:
+        print(red('{0} of these deploys failed on some host.'.format(failed)))
+    print(cyan('Slowest step: {0} ({1:.1f}s on average).'.format(
+        slowest_step, slowest_mean)))
+
+
+@task
+def render_configs():
+    """Render the nginx and gunicorn configurations of the environment.
+
+    ``server/templates/*.tmpl`` are rendered with the settings of the
+    environment (``fab prod render_configs``) into ``server/<environment>/``,
+    where the servers read them; commit the result. ``@{name}`` is replaced
+    by ``env.name``.
+    """
+    root = os.path.dirname(env.real_fabfile)
+    context = dict(env)
+    context.update(
+        header='# Rendered from server/templates by `fab {0} render_configs`,'
+               ' edit the template\n# instead.'.format(env.environment),
+        proxy_cache=('{project_name}_microcache'.format(**env)
+                     if env.microcache else 'off'),
+        health_allow='\n'.join('            allow                   {0};'
+                               .format(address)
+                               for address in env.health_allow))
+    for template in sorted(glob.glob(os.path.join(root, 'server', 'templates',
+                                                  '*.tmpl'))):
+        with open(template) as f:
+            rendered = _ConfigTemplate(f.read()).substitute(context)
+        directory = os.path.join(root, 'server', env.environment)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        target = os.path.join(directory,
+                              os.path.basename(template)[:-len('.tmpl')])
+        with open(target, 'w') as f:
+            f.write(rendered)
+        puts('Rendered {0}.'.format(os.path.relpath(target, root)))
+
+@task
+@roles('web', 'db')
+def perfcheck(strict='no'):
+    """Check the settings of the environment for performance problems.
+
+    Runs ``manage.py perfcheck`` on the host, in the checked out code and the
+    virtualenv ``restart`` is going to switch to, against the environment's
+    settings module: DEBUG on, uncached templates, no shared cache, a
+    connection per request... Returns whether the settings passed;
+    ``strict=yes`` fails them on warnings too.
+    """
+    command = 'perfcheck'
+    if _truthy(strict):
+        command += ' --strict'
+    with settings(hide('running'), warn_only=True):
+        return manage_py(command, venv=_pending_virtualenv()).succeeded
+
+@task
+def loadtest(url=None, requests=2000, concurrency=20):
+    """Measure the throughput of a page with and without the microcache.
+
+    Runs ``ab`` (apache2-utils) from here against ``url`` (the site's home
+    page by default) twice: as an anonymous visitor, whose GETs nginx may
+    answer from its microcache, then with a session cookie, which always
+    reaches gunicorn.
+    """
+    url = url or 'http://{site_url}/'.format(**env)
+    results = []
+    for label, cookie in (('anonymous', ''),
+                          ('with a session', ' -C sessionid=loadtest')):
+        with settings(hide('running'), warn_only=True):
+            output = local('ab -k -q -n {0} -c {1}{2} {3}'.format(
+                int(requests), int(concurrency), cookie, url), capture=True)
+        match = re.search(r'Requests per second:\s+([\d.]+)', output)
+        if output.failed or not match:
+            abort('ab failed:\n{0}'.format(output.stderr or output))
+        failed = re.search(r'Failed requests:\s+(\d+)', output).group(1)
+        results.append(float(match.group(1)))
+        puts('{0:<16} {1:>9.1f} req/s ({2} failed)'.format(
+            label, results[-1], failed))
+    puts('The microcache serves {0:.1f}x the requests.'.format(
+        results[0] / results[1]))
 
 
 # HELPERS
 # -----------------------------------------------------------------------------
 
+class _ConfigTemplate(string.Template):
+    # nginx variables start with $.
+    delimiter = '@'
+
+
+class StepFailed(Exception):
+    """Raised by ``abort()`` while a deploy step runs on a single host."""
+
+
+def _counted(operation):
+    """Count the remote commands run, for the deploy records."""
+    @wraps(operation)
+    def counted(*args, **kwargs):
+        env.remote_commands = env.get('remote_commands', 0) + 1
+        return operation(*args, **kwargs)
+    return counted
+
+run, sudo = _counted(run), _counted(sudo)
+
+
+def _truthy(value):
+    """Interpret a task argument given on the command line as a boolean."""
+    return str(value).lower() in ('1', 'y', 'yes', 'true', 'on')
+
+def _task_hosts(task):
+    """Return the deduplicated hosts ``task`` should run on.
+
+    When called from a task which is already running on a host, only that host
+    is used.
+    """
+    if env.host_string:
+        return [env.host_string]
+    return merge([], task.roles, [], env.roledefs)
+
+def _step(task, failed, *args, **kwargs):
+    """Run ``task`` once on every host of its roles.
+
+    Hosts are deduplicated across roles and hosts already in ``failed`` are
+    skipped. Errors are recorded in ``failed`` (``host -> (step,
+    error)``) instead of aborting the hosts that are still running. A
+    ``hosts`` keyword argument restricts the step to those hosts.
+    """
+    hosts = kwargs.pop('hosts', None) or _task_hosts(task)
+    hosts = [host for host in hosts if host not in failed]
+    if not hosts:
+        return
+
+    def guarded(*args, **kwargs):
+        # Parallel hosts run in processes of their own, each with its own
+        # env: the timing goes back with the result.
+        env.remote_commands = 0
+        start = time.time()
+        error = None
+        try:
+            with settings(abort_exception=StepFailed):
+                task(*args, **kwargs)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        return {'seconds': round(time.time() - start, 3),
+                'commands': env.remote_commands, 'error': error}
+    guarded.__name__ = getattr(task, 'name', task.__name__)
+
+    kwargs['hosts'] = hosts
+    start = time.time()
+    results = execute(guarded, *args, **kwargs)
+    for host, result in results.items():
+        if result['error'] is not None:
+            failed[host] = (guarded.__name__, result['error'])
+            print(red('[{0}] {1} failed: {2}'.format(host, guarded.__name__,
+                                                     result['error'])))
+    _record_step(guarded.__name__, time.time() - start, results)
+
+def _record_step(name, seconds, results):
+    """Add the timings of a step to the record of the running deploy.
+
+    The batches of a rolling step add up to a single step.
+    """
+    steps = env.get('deploy_steps')
+    if steps is None:
+        return
+    if not steps or steps[-1]['step'] != name:
+        steps.append({'step': name, 'seconds': 0, 'hosts': {}})
+    steps[-1]['seconds'] = round(steps[-1]['seconds'] + seconds, 3)
+    steps[-1]['hosts'].update(results)
+
+def _save_deploy_record(started, failed):
+    """Write the timings of the deploy to ``var/deploys/``."""
+    directory = _local_var('deploys')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    record = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+        'environment': env.environment,
+        'seconds': round(time.time() - started, 3),
+        'steps': env.deploy_steps,
+        'failed': dict((host, list(error)) for host, error in failed.items()),
+    }
+    path = os.path.join(directory, '{0}-{1}.json'.format(
+        time.strftime('%Y%m%dT%H%M%S', time.gmtime(started)),
+        env.environment))
+    with open(path, 'w') as f:
+        json.dump(record, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+    env.deploy_steps = None
+
+
+def _chef_bundle():
+    """Hash the files of the ``bootstrap`` tree and render the node JSON.
+
+    Returns ``{'files': {path: hash}, 'node': json, 'digest': hash}``, the
+    digest covering both.
+    """
+    chef_root = os.path.join(os.path.dirname(env.real_fabfile), 'bootstrap')
+    files = {}
+    for directory, _, filenames in os.walk(chef_root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, chef_root)] = \
+                    hashlib.sha1(f.read()).hexdigest()
+    with open(os.path.join(chef_root, 'nodes',
+                           '%s.json' % env.environment)) as f:
+        data = json.load(f)
+    data.setdefault('project', {})['environment'] = env.environment
+    node = json.dumps(data, sort_keys=True)
+    digest = hashlib.sha1(json.dumps(files, sort_keys=True) + node)
+    return {'files': files, 'node': node, 'digest': digest.hexdigest()}
+
+def _sync_chef_files(files, last_files):
+    """Upload the files which differ from ``last_files`` in a single archive
+    and delete those which are gone."""
+    chef_root = os.path.join(os.path.dirname(env.real_fabfile), 'bootstrap')
+    changed = sorted(path for path, digest in files.items()
+                     if last_files.get(path) != digest)
+    removed = sorted(path for path in last_files if path not in files)
+    sudo('mkdir -p {chef_path}'.format(**env))
+    if changed:
+        puts('Uploading {0} changed chef files.'.format(len(changed)))
+        handle, archive = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(handle)
+        try:
+            with tarfile.open(archive, 'w:gz') as tar:
+                for path in changed:
+                    tar.add(os.path.join(chef_root, path), path)
+            remote = '/tmp/{0}'.format(os.path.basename(archive))
+            put(archive, remote)
+        finally:
+            os.remove(archive)
+        sudo('tar xzf {0} -C {chef_path} && rm {0}'.format(remote, **env))
+    if removed:
+        with cd(env.chef_path):
+            sudo('rm -f ' + ' '.join("'%s'" % path for path in removed))
+
+def _requirements_hash(path):
+    """Hash the requirement files of the project checked out in ``path``."""
+    return run('cat {0}/requirements/*.pip | sha1sum | cut -c1-12'
+               .format(path)).strip()
+
+def _local_var(*paths):
+    """Return a path in the ``var`` directory next to the fabfile."""
+    return os.path.join(os.path.dirname(env.real_fabfile), 'var', *paths)
+
+def _local_wheelhouse(digest):
+    return _local_var('wheelhouse', digest)
+
+def _build_virtualenv(venv, digest):
+    """Create the virtualenv ``venv`` and install the requirements in it."""
+    run('rm -rf {0}'.format(venv))
+    run('virtualenv {0}'.format(venv))
+    # What was added to the live virtualenv by hand (see initial_deploy).
+    if exists('{venv_path}/bin/postactivate'.format(**env)):
+        run('cp {venv_path}/bin/postactivate {0}/bin/'.format(venv, **env))
+    if exists('{venv_path}/gems'.format(**env)):
+        run('cp -a {venv_path}/gems {0}/'.format(venv, **env))
+
+    wheel_dir = '{0}/{1}'.format(env.wheelhouse_path, digest)
+    local_dir = _local_wheelhouse(digest)
+    if not exists(wheel_dir) and os.path.isdir(local_dir):
+        run('mkdir -p {0}.tmp'.format(wheel_dir))
+        put(os.path.join(local_dir, '*.whl'), wheel_dir + '.tmp')
+        run('mv {0}.tmp {0}'.format(wheel_dir))
+    if exists(wheel_dir):
+        source = '--no-index --find-links={0}'.format(wheel_dir)
+    else:
+        puts('No wheels for these requirements, building them here.')
+        source = ''
+    with cd(env.project_path):
+        run('{0}/bin/pip install {1} -r requirements/{environment}.pip'
+            .format(venv, source, **env))
+    run('touch {0}/.complete'.format(venv))
+
+def _pending_virtualenv():
+    """Return the virtualenv of the checked out requirements, or the live one
+    if it wasn't built."""
+    with hide('running', 'stdout'):
+        venv = '{venv_path}-{0}'.format(
+            _requirements_hash(env.project_path), **env)
+        if exists(venv + '/.complete'):
+            return venv
+    return env.venv_path
+
+def _switch_virtualenv():
+    """Point ``env.venv_path`` at the virtualenv of the checked out
+    requirements, atomically, and drop the least recently used ones."""
+    venv = _pending_virtualenv()
+    if venv == env.venv_path:
+        return
+    with hide('running', 'stdout'):
+        current = run('readlink {venv_path}'.format(**env), warn_only=True)
+        if current.strip() == venv:
+            return
+        if exists(env.venv_path) and current.failed:
+            # A virtualenv from before they were keyed, moved out of the way
+            # once.
+            run('mv {venv_path} {venv_path}-legacy'.format(**env))
+        # rename() replaces the link in one step, unlike ln -sf.
+        run('ln -sfn {0} {venv_path}.new && mv -Tf {venv_path}.new '
+            '{venv_path}'.format(venv, **env))
+        # Keep the most recently used virtualenvs, for rollbacks.
+        run('touch {0}'.format(venv))
+        run('ls -dt {venv_path}-???????????? | tail -n +{0} | '
+            'xargs --no-run-if-empty rm -rf'
+            .format(int(env.venvs_kept) + 1, **env))
+    puts('Now using the virtualenv {0}.'.format(venv))
+
+def _static_changed(revision):
+    """Tell whether static files may have changed since the last collection.
+
+    Static files live in ``static`` directories; a requirement change may
+    bring new static files from third party apps.
+    """
+    last = run('cat {static_revision_file}'.format(**env), warn_only=True)
+    if last.failed or not last.strip():
+        return True
+    if last.strip() == revision:
+        return False
+    changed_files = run('git diff --name-only {0} {1}'.format(last.strip(),
+                        revision), warn_only=True)
+    if changed_files.failed:
+        return True
+    return any('static/' in path or path.startswith('requirements/')
+               for path in changed_files.splitlines())
+
+def _rolling_step(task, failed, fraction, *args, **kwargs):
+    """Run ``task`` over its hosts in batches of ``fraction`` of them.
+
+    A batch only starts once the previous one finished. If a host of a batch
+    fails the remaining batches are not run, so that most of the fleet keeps
+    serving.
+    """
+    hosts = [host for host in _task_hosts(task) if host not in failed]
+    size = max(1, int(len(hosts) * float(fraction)))
+    for i in range(0, len(hosts), size):
+        batch = hosts[i:i + size]
+        _step(task, failed, hosts=batch, *args, **kwargs)
+        if any(host in failed for host in batch):
+            for host in hosts[i + size:]:
+                failed[host] = (task.name, 'skipped, a previous batch failed')
+            return
+
+def _upgrade_gunicorn():
+    """Re-execute the gunicorn master with ``USR2`` and retire the old one."""
+    with hide('running', 'stdout'):
+        old_pid = run('cat {gunicorn_pidfile}'.format(**env)).strip()
+        run('kill -USR2 {0}'.format(old_pid))
+        # Wait for the new master to write its pid and fork its workers.
+        result = run(
+            'for i in $(seq {restart_timeout}); do '
+            'pid=$(cat {gunicorn_pidfile} 2>/dev/null); '
+            'if [ -n "$pid" ] && [ "$pid" != "{old_pid}" ] && '
+            'pgrep -P "$pid" > /dev/null; then echo "$pid"; exit 0; fi; '
+            'sleep 1; done; exit 1'.format(old_pid=old_pid, **env),
+            warn_only=True)
+    new_pid = result.strip()
+    # The workers of both masters share the socket: only an answer from one
+    # of the new master's workers tells that the new code is ready.
+    if result.failed:
+        problem = 'did not start'
+    elif not _gunicorn_ready(master=new_pid):
+        problem = 'was not ready'
+    elif not _runs_live_virtualenv(new_pid):
+        problem = "doesn't run the interpreter of {venv_path}".format(**env)
+    else:
+        problem = None
+    if problem:
+        # Leave the traffic to the old master.
+        if result.succeeded:
+            run('kill -QUIT {0}'.format(new_pid))
+        _restore_gunicorn_pidfile(old_pid)
+        abort('The new gunicorn master {0}, kept the old one.'.format(problem))
+    run('kill -QUIT {0}'.format(old_pid))
+
+def _runs_live_virtualenv(pid):
+    """Tell whether process ``pid`` runs the python of ``env.venv_path``.
+
+    virtualenv copies the interpreter into each virtualenv: a master
+    re-executed from the previous one (see ``pre_exec`` in gunicorn.conf.py)
+    would import its packages.
+    """
+    with hide('running', 'stdout'):
+        return run('[ "$(readlink -f /proc/{0}/exe)" = '
+                   '"$(readlink -f {venv_path}/bin/python)" ]'
+                   .format(int(pid), **env), warn_only=True).succeeded
+
+def _restore_gunicorn_pidfile(old_pid):
+    """Give the pidfile back to the old master after a failed upgrade.
+
+    On ``USR2`` it renamed its pidfile to ``<pidfile>.oldbin``, and the new
+    master only removes the pidfile holding its own pid: without this,
+    neither the next restart nor ``server/pidfollow.py`` would find it.
+    """
+    run('if [ "$(cat {gunicorn_pidfile}.oldbin 2>/dev/null)" = "{0}" ]; then '
+        'mv -f {gunicorn_pidfile}.oldbin {gunicorn_pidfile}; '
+        'else echo {0} > {gunicorn_pidfile}; fi'.format(old_pid, **env))
+
+def _gunicorn_url(path):
+    """Return curl's arguments to request ``path`` from gunicorn."""
+    if env.gunicorn_bind.startswith('unix:'):
+        return '--unix-socket {0} http://localhost{1}'.format(
+            env.gunicorn_bind[len('unix:'):], path)
+    return 'http://{0}{1}'.format(env.gunicorn_bind, path)
+
+def _gunicorn_ready(master=None):
+    """Poll gunicorn's readiness check on the current host until it passes.
+
+    The check (see ``{{ project_name }}.apps.core.health``) answers before any
+    Django middleware, once the database and caches answer. With ``master``,
+    only an answer from a worker of that master counts. Returns ``False`` if
+    it didn't pass within ``env.restart_timeout`` seconds.
+    """
+    check = 'curl --silent --fail --max-time 5 {0}'.format(
+        _gunicorn_url(env.health_path))
+    if master:
+        check += ' | grep -q \'"master": {0}[,}}]\''.format(int(master))
+    else:
+        check += ' --output /dev/null'
+    with hide('running', 'stdout'):
+        result = run(
+            'for i in $(seq {0}); do {1} && exit 0; sleep 1; '
+            'done; exit 1'.format(env.restart_timeout, check),
+            warn_only=True)
+    return result.succeeded
+
+def _report_failures(failed):
+    """Print the hosts that failed a deploy and abort if there is any."""
+    if not failed:
+        return
+    print(red('Deploy failed on {0} host(s):'.format(len(failed)), bold=True))
+    for host, (step, error) in sorted(failed.items()):
+        print(red('    {0}: {1} ({2})'.format(host, step, error)))
+    abort('Deploy did not complete on every host.')
+
 def check():
-    """Check that the home page of the site returns an HTTP 200."""
+    """Check that the site is ready: it answers, and so do its database and
+    caches.
+
+    nginx only answers the health checks for ``env.health_allow``, so they
+    are requested from the web hosts themselves (the current one within a
+    task).
+    """
     print(cyan('Checking site status...', bold=True))
-    if not '200 OK' in local('curl --silent -I "{site_url}"'.format(**env),
-                             capture=True):
+    hosts = [env.host_string] if env.host_string else env.roledefs['web']
+    failed = False
+    for host in hosts:
+        with nested(settings(host_string=host, warn_only=True),
+                    hide('running', 'stdout')):
+            result = run('curl --silent --fail --max-time 10 '
+                         '"http://127.0.0.1{health_path}"'.format(**env))
+        failed = failed or result.failed
+    if failed:
         _sad()
     else:
         _happy()
@@ -0,0 +1,124 @@
+"""
+Structured access logs, and the latency histograms ``manage.py analyzelogs``
+builds from them.
+
+gunicorn writes one JSON object per request with :class:`JSONLogger`
+(``logger_class`` in ``gunicorn.conf.py``)::
+
+    {"bytes": 5120, "duration_us": 48210, "method": "GET", "path": "/",
+     "pid": 1234, "remote": "127.0.0.1", "status": 200, "ts": 1381234567.123,
+     "view": "home"}
+
+``view`` is the URL pattern the request resolved to, left in the WSGI
+environ by :class:`~{{ project_name }}.apps.core.middleware.MetricsMiddleware`.
+nginx logs the same fields with its ``{{ project_name }}_json`` format, with
+``request_time`` in seconds and without ``view``.
+
+This module doesn't need Django, gunicorn loads it before the application.
+"""
+import json
+import math
+import os
+import re
+import time
+
+try:
+    from gunicorn.glogging import Logger
+except ImportError:  # gunicorn is only installed on the servers
+    Logger = object
+
+# Key of the WSGI environ holding the name of the view.
+VIEW_KEY = '{{ project_name }}.view'
+
+# Latencies are counted in buckets growing by 5%, from 10us to ~17min: the
+# percentiles are off by 5% at most, whatever the number of requests.
+BUCKET_GROWTH = 1.05
+MIN_LATENCY = 10
+BUCKETS = int(math.ceil(math.log(1e9 / MIN_LATENCY, BUCKET_GROWTH))) + 1
+
+_ids = re.compile(r'/(?:\d+|[0-9a-f]{32}|[0-9a-f-]{36})(?=/|$)')
+
+
+class JSONLogger(Logger):
+    """gunicorn logger writing the access log as JSON, see the module."""
+
+    def access(self, resp, req, environ, request_time):
+        if not self.cfg.accesslog and not self.cfg.logconfig:
+            return
+        duration = ((request_time.days * 86400 + request_time.seconds)
+                    * 1000000 + request_time.microseconds)
+        record = {
+            'ts': round(time.time(), 3),
+            'remote': environ.get('REMOTE_ADDR', '-'),
+            'method': environ['REQUEST_METHOD'],
+            'path': environ['RAW_URI'],
+            'status': int(resp.status.split(None, 1)[0]),
+            'bytes': getattr(resp, 'sent', resp.response_length) or 0,
+            'duration_us': duration,
+            'view': environ.get(VIEW_KEY, '-'),
+            'pid': os.getpid(),
+        }
+        try:
+            self.access_log.info(json.dumps(record, sort_keys=True))
+        except Exception:
+            self.exception("Can't write the access log.")
+
+
+def parse(line):
+    """Return ``(ts, route, duration_us, status)`` of a log line.
+
+    The route is the view when known, otherwise the method and path with ids
+    replaced. Returns ``None`` for lines that aren't JSON access records.
+    """
+    try:
+        record = json.loads(line)
+        ts = float(record['ts'])
+        if 'duration_us' in record:
+            duration = int(record['duration_us'])
+        else:
+            duration = int(float(record['request_time']) * 1000000)
+        status = int(record['status'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    route = record.get('view', '-')
+    if route == '-':
+        path = record.get('path', '').split('?', 1)[0]
+        route = '%s %s' % (record.get('method', '-'), _ids.sub('/:id', path))
+    return ts, route, duration, status
+
+
+class Histogram(object):
+    """Latency histogram of fixed size, see ``BUCKET_GROWTH``."""
+
+    __slots__ = ('counts', 'count', 'errors', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.errors = 0
+        self.max = 0
+
+    def add(self, duration, status):
+        if duration < MIN_LATENCY:
+            index = 0
+        else:
+            index = min(int(math.log(float(duration) / MIN_LATENCY,
+                                     BUCKET_GROWTH)) + 1, BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        if status >= 500:
+            self.errors += 1
+        if duration > self.max:
+            self.max = duration
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding ``fraction``, in us."""
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(MIN_LATENCY * BUCKET_GROWTH ** index, self.max)
+        return self.max
@@ -0,0 +1,58 @@
+"""
+Admin URLs that only discover the admin modules when first needed.
+
+``admin.autodiscover()`` imports the ``admin`` module of every installed app,
+which is a good part of the cost of loading the URLconf. With
+``ADMIN_LAZY_AUTODISCOVER`` on, ``urls.py`` includes :func:`lazy_admin_urls`
+instead: the discovery happens on the first request under ``/admin/`` (or the
+first reversal of a URL, which needs every pattern).
+"""
+import threading
+
+from django.contrib import admin
+
+
+class LazyAdminURLConf(object):
+    """Stands for a URLconf module whose ``urlpatterns`` are built on access.
+
+    ``include()`` gets ``urlpatterns`` right away, and only looks into lists
+    and tuples: the patterns are a sequence of their own, built the first
+    time they are iterated or indexed (by the resolver).
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.urlpatterns = LazyPatterns(self)
+        self._urlpatterns = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._urlpatterns is None:
+            with self._lock:
+                if self._urlpatterns is None:
+                    admin.autodiscover()
+                    self._urlpatterns = self.site.get_urls()
+        return self._urlpatterns
+
+
+class LazyPatterns(object):
+
+    def __init__(self, urlconf):
+        self.urlconf = urlconf
+
+    def __iter__(self):
+        return iter(self.urlconf.load())
+
+    def __reversed__(self):
+        return reversed(self.urlconf.load())
+
+    def __len__(self):
+        return len(self.urlconf.load())
+
+    def __getitem__(self, index):
+        return self.urlconf.load()[index]
+
+
+def lazy_admin_urls(site=admin.site):
+    """Use like ``admin.site.urls``: ``(r'^admin/', include(lazy_admin_urls()))``."""
+    return LazyAdminURLConf(site), 'admin', site.name
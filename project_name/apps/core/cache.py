@@ -0,0 +1,204 @@
+"""
+Two-tier cache backend.
+
+A small in-process LRU with a short TTL sits in front of a shared cache
+(memcached, file based...) configured as another entry of ``CACHES``. Reads
+are answered from the process when possible, misses go to the shared cache
+and fill the local tier; writes go to both.
+
+The local tier belongs to the process, not to the backend instance: every
+``get_cache()`` of the same shared cache reads the same LRU.
+
+Other processes may keep serving a value from their local tier for up to
+``LOCAL_TIMEOUT`` seconds after it was changed or deleted, so only cache what
+can be that stale.
+
+Hits and misses of each tier are counted in the request metrics
+(``cache_hits_total`` and ``cache_misses_total``, see
+:mod:`{{ project_name }}.apps.core.metrics`).
+
+Example::
+
+    CACHES = {
+        'default': {
+            'BACKEND': '{{ project_name }}.apps.core.cache.TieredCache',
+            'OPTIONS': {
+                'SHARED_CACHE': 'shared',
+                'MAX_ENTRIES': 1000,  # local tier size
+                'LOCAL_TIMEOUT': 5,
+            },
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        },
+    }
+
+"""
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.core.cache.backends.base import BaseCache
+
+from {{ project_name }}.apps.core.metrics import registry
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalTier(object):
+    """The in-process LRU in front of a shared cache."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+def local_tier(shared_alias, max_entries):
+    """Return the local tier of ``shared_alias`` in this process."""
+    with _tiers_lock:
+        tier = _tiers.get(shared_alias)
+        if tier is None:
+            tier = _tiers[shared_alias] = LocalTier(max_entries)
+        return tier
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super(TieredCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_CACHE', 'shared')
+        self._local_timeout = int(options.get('LOCAL_TIMEOUT', 5))
+        # Looked up now, while CACHES has it (tests override CACHES). When
+        # this backend is the one django.core.cache builds on import,
+        # get_cache() is already defined.
+        from django.core.cache import get_cache
+        self.shared = get_cache(self._shared_alias)
+        tier = local_tier(self._shared_alias, self._max_entries)
+        self._local = tier.entries
+        self._lock = tier.lock
+
+    # Local tier ---------------------------------------------------------------
+
+    def _local_key(self, key, version):
+        # Use the shared cache's key so its KEY_PREFIX/VERSION apply to both.
+        key = self.shared.make_key(key, version=version)
+        self.shared.validate_key(key)
+        return key
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            self._local[key] = entry  # most recently used
+            return entry
+
+    def _local_set(self, key, value, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time.time() + min(timeout, self._local_timeout)
+        entry = (expires, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = entry
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+
+    # Cache API ----------------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        entry = self._local_get(local_key)
+        if entry is not None:
+            registry.count('cache_hits_total', 'local')
+            return pickle.loads(entry[1])
+        registry.count('cache_misses_total', 'local')
+
+        value = self.shared.get(key, version=version)
+        if value is None:
+            registry.count('cache_misses_total', 'shared')
+            return default
+        registry.count('cache_hits_total', 'shared')
+        self._local_set(local_key, value, None)
+        return value
+
+    def set(self, key, value, timeout=None, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._local_set(self._local_key(key, version), value, timeout)
+
+    def add(self, key, value, timeout=None, version=None):
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._local_set(self._local_key(key, version), value, timeout)
+        return added
+
+    def delete(self, key, version=None):
+        self._local_delete(self._local_key(key, version))
+        self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            entry = self._local_get(self._local_key(key, version))
+            if entry is not None:
+                found[key] = pickle.loads(entry[1])
+            else:
+                missing.append(key)
+        registry.count('cache_hits_total', 'local', len(found))
+        registry.count('cache_misses_total', 'local', len(missing))
+        if missing:
+            shared_found = self.shared.get_many(missing, version=version)
+            registry.count('cache_hits_total', 'shared', len(shared_found))
+            registry.count('cache_misses_total', 'shared',
+                           len(missing) - len(shared_found))
+            for key, value in shared_found.items():
+                self._local_set(self._local_key(key, version), value, None)
+            found.update(shared_found)
+        return found
+
+    def set_many(self, data, timeout=None, version=None):
+        self.shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            self._local_set(self._local_key(key, version), value, timeout)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self._local_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # Counters must be exact: never answer them from the local tier.
+        self._local_delete(self._local_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        if self._local_get(self._local_key(key, version)) is not None:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        # Not every backend has close() (e.g. LocMemCache in Django 1.5).
+        close = getattr(self.shared, 'close', None)
+        if close is not None:
+            close(**kwargs)
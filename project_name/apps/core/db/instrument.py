@@ -0,0 +1,69 @@
+"""
+Lightweight hooks around database queries.
+
+:func:`install` wraps the cursors of a connection so that every query is
+reported to the registered observers as ``observer(alias, sql, duration)``.
+Unlike Django's debug cursor nothing is kept in memory, so it can stay on in
+production.
+"""
+import time
+
+_observers = []
+
+
+def add_observer(observer):
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_observer(observer):
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+class InstrumentedCursor(object):
+
+    def __init__(self, cursor, alias):
+        self.cursor = cursor
+        self.alias = alias
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self._notify(sql, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self._notify(sql, time.time() - start)
+
+    def _notify(self, sql, duration):
+        for observer in _observers:
+            observer(self.alias, sql, duration)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def install(connection):
+    """Instrument the cursors of ``connection`` (a Django connection wrapper).
+
+    Connection wrappers are per thread; installing twice is a no-op.
+    """
+    if getattr(connection, 'instrumented', False):
+        return
+    make_cursor = connection.cursor
+
+    def cursor(*args, **kwargs):
+        return InstrumentedCursor(make_cursor(*args, **kwargs),
+                                  connection.alias)
+
+    connection.cursor = cursor
+    connection.instrumented = True
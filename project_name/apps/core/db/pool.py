@@ -0,0 +1,237 @@
+"""
+Process-wide pool of raw database connections.
+
+Connections are handed out to the per-thread Django connection wrappers and
+come back to the pool at the end of each request instead of being closed.
+They are recycled after ``MAX_AGE`` seconds or ``MAX_USES`` requests, and
+checked with a round trip before being reused when they sat idle longer than
+``CHECK_INTERVAL`` seconds.
+
+A pool notices when it is used from a forked process and forgets (without
+closing) the connections of its parent, which are still in use over there.
+gunicorn's ``pre_fork``/``post_fork`` hooks call :func:`close_connections` and
+:func:`reset_after_fork` so that workers never even inherit them.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_SIZE': 4,          # connections per process
+    'MAX_AGE': 600,         # seconds
+    'MAX_USES': 1000,       # requests
+    'TIMEOUT': 10,          # seconds to wait for a free connection
+    'CHECK_INTERVAL': 30,   # idle seconds after which to check a connection
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Connections inherited from a parent process. They must not be closed here
+# (closing tells the server to end the session the parent is still using),
+# nor garbage collected, which closes them too.
+_abandoned = []
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the pool's ``TIMEOUT``."""
+
+
+class PooledConnection(object):
+    __slots__ = ('raw', 'created', 'uses', 'released')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created = self.released = time.time()
+        self.uses = 0
+
+
+class ConnectionPool(object):
+
+    def __init__(self, max_size, max_age, max_uses, timeout, check_interval,
+                 is_usable=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.is_usable = is_usable or (lambda raw: True)
+        self._cond = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+        self._idle = []
+        self._open = 0
+        self._counters = {'created': 0, 'reused': 0, 'recycled': 0,
+                          'failed_checks': 0, 'waits': 0, 'wait_time': 0.0}
+
+    def acquire(self):
+        """Return an idle :class:`PooledConnection`, or ``None``.
+
+        ``None`` means a slot was reserved for a new connection: the caller
+        must connect and hand the connection to :meth:`register`, or call
+        :meth:`cancel` if it couldn't.
+        """
+        with self._cond:
+            self._check_pid()
+            started = None
+            while True:
+                while self._idle:
+                    pooled = self._idle.pop()  # most recently used first
+                    if self._expired(pooled):
+                        self._discard(pooled)
+                        self._counters['recycled'] += 1
+                    elif (time.time() - pooled.released > self.check_interval
+                            and not self.is_usable(pooled.raw)):
+                        self._discard(pooled)
+                        self._counters['failed_checks'] += 1
+                    else:
+                        pooled.uses += 1
+                        self._counters['reused'] += 1
+                        self._record_wait(started)
+                        return pooled
+                if self._open < self.max_size:
+                    self._open += 1
+                    self._record_wait(started)
+                    return None
+                if started is None:
+                    started = time.time()
+                    self._counters['waits'] += 1
+                remaining = self.timeout - (time.time() - started)
+                if remaining <= 0:
+                    self._record_wait(started)
+                    raise PoolTimeout(
+                        "No database connection available after %ss (%d open)"
+                        % (self.timeout, self._open))
+                self._cond.wait(remaining)
+
+    def register(self, raw):
+        """Wrap a connection created for a slot reserved by :meth:`acquire`."""
+        with self._cond:
+            self._counters['created'] += 1
+        pooled = PooledConnection(raw)
+        pooled.uses = 1
+        return pooled
+
+    def cancel(self):
+        """Give back a slot reserved by :meth:`acquire` which wasn't used."""
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def release(self, pooled, discard=False):
+        """Put a connection back into the pool, or close it."""
+        with self._cond:
+            if self._check_pid():
+                # Handed out by our parent process, let it be.
+                _abandoned.append(pooled.raw)
+                return
+            pooled.released = time.time()
+            if discard or self._expired(pooled):
+                self._discard(pooled)
+                self._counters['recycled'] += 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def close_idle(self):
+        """Close every idle connection."""
+        with self._cond:
+            self._check_pid()
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def reset_after_fork(self):
+        with self._cond:
+            self._check_pid()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(open=self._open, idle=len(self._idle),
+                         in_use=self._open - len(self._idle),
+                         max_size=self.max_size)
+        return stats
+
+    def _record_wait(self, started):
+        if started is not None:
+            self._counters['wait_time'] += time.time() - started
+
+    def _expired(self, pooled):
+        return (time.time() - pooled.created > self.max_age or
+                pooled.uses >= self.max_uses)
+
+    def _discard(self, pooled):
+        self._open -= 1
+        try:
+            pooled.raw.close()
+        except Exception:
+            logger.warning("Error while closing a pooled connection.",
+                           exc_info=True)
+
+    def _check_pid(self):
+        """Forget the parent's connections if we're in a forked process.
+
+        Returns ``True`` if that was the case.
+        """
+        if self._pid == os.getpid():
+            return False
+        _abandoned.extend(pooled.raw for pooled in self._idle)
+        self._idle = []
+        self._open = 0
+        self._pid = os.getpid()
+        return True
+
+
+def get_pool(key, options, is_usable=None):
+    """Return the pool for ``key``, creating it with ``options`` if needed."""
+    with _pools_lock:
+        if key not in _pools:
+            config = dict(DEFAULTS, **options)
+            _pools[key] = ConnectionPool(
+                int(config['MAX_SIZE']), float(config['MAX_AGE']),
+                int(config['MAX_USES']), float(config['TIMEOUT']),
+                float(config['CHECK_INTERVAL']), is_usable)
+        return _pools[key]
+
+
+def pool_stats():
+    """Return the statistics of every pool, keyed by database alias."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for key, pool in pools:
+        stats.setdefault(key[0], []).append(pool.stats())
+    return dict((alias, _merge_stats(entries))
+                for alias, entries in stats.items())
+
+
+def _merge_stats(entries):
+    merged = {}
+    for entry in entries:
+        for name, value in entry.items():
+            merged[name] = merged.get(name, 0) + value
+    return merged
+
+
+def close_connections():
+    """Close every database connection of this process, pooled or not.
+
+    Meant for a process about to fork (e.g. gunicorn's ``pre_fork``).
+    """
+    from django.db import connections
+    for connection in connections.all():
+        connection.close()
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+
+def reset_after_fork():
+    """Forget the connections inherited from the parent process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.reset_after_fork()
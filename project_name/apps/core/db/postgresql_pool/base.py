@@ -0,0 +1,91 @@
+"""
+PostgreSQL backend keeping connections open across requests.
+
+Use it as the ``ENGINE`` of a database and tune the pool with a ``POOL``
+entry (see ``DEFAULTS`` in :mod:`{{ project_name }}.apps.core.db.pool`)::
+
+    DATABASES = {
+        'default': {
+            'ENGINE': '{{ project_name }}.apps.core.db.postgresql_pool',
+            'NAME': '{{ project_name }}',
+            'POOL': {'MAX_SIZE': 4, 'MAX_AGE': 600, 'MAX_USES': 1000},
+        }
+    }
+
+"""
+from django.db.backends.postgresql_psycopg2 import base
+
+from {{ project_name }}.apps.core.db.pool import get_pool
+
+Database = base.Database
+DatabaseError = base.DatabaseError
+IntegrityError = base.IntegrityError
+
+TRANSACTION_STATUS_IDLE = Database.extensions.TRANSACTION_STATUS_IDLE
+TRANSACTION_STATUS_UNKNOWN = Database.extensions.TRANSACTION_STATUS_UNKNOWN
+
+
+def is_usable(raw):
+    """Check a connection with a round trip to the server."""
+    try:
+        raw.cursor().execute('SELECT 1')
+        raw.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.pooled_connection = None
+
+    @property
+    def pool(self):
+        settings_dict = self.settings_dict
+        # NAME is part of the key: the test runner switches it to the test
+        # database on the fly.
+        key = (self.alias, settings_dict['NAME'], settings_dict['USER'],
+               settings_dict['HOST'], settings_dict['PORT'])
+        return get_pool(key, settings_dict.get('POOL', {}), is_usable)
+
+    def _cursor(self):
+        if self.connection is None:
+            pool = self.pool
+            pooled = pool.acquire()
+            if pooled is None:
+                try:
+                    cursor = super(DatabaseWrapper, self)._cursor()
+                except Exception:
+                    pool.cancel()
+                    raise
+                self.pooled_connection = pool.register(self.connection)
+                return cursor
+            self.pooled_connection = pooled
+            self.connection = pooled.raw
+            # Another wrapper may have left it in another isolation level.
+            self.connection.set_isolation_level(self.isolation_level)
+        return super(DatabaseWrapper, self)._cursor()
+
+    def close(self):
+        self.validate_thread_sharing()
+        if self.connection is None:
+            return
+        raw, pooled = self.connection, self.pooled_connection
+        self.connection = self.pooled_connection = None
+        if pooled is None:
+            raw.close()
+            return
+
+        discard = raw.closed
+        if not discard:
+            status = raw.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    raw.rollback()
+                except Database.Error:
+                    discard = True
+        self.pool.release(pooled, discard=discard)
@@ -0,0 +1,183 @@
+"""
+Reads spread over read replicas, writes on the primary.
+
+:class:`ReplicaRouter` (in ``DATABASE_ROUTERS``) sends the writes to the
+``default`` database and the reads to one of the ``DATABASE_REPLICAS``
+aliases, except:
+
+* within a transaction of the primary (``commit_on_success`` & co), where
+  everything goes to the primary;
+* for ``DATABASE_PIN_SECONDS`` after the thread, or the client, wrote
+  something, so that users see their own writes whatever the replication
+  lag. :class:`ReplicaPinMiddleware` carries the pin from a request to the
+  next ones of the same client in a cookie (the session would have to be
+  loaded on every request);
+* when every replica is behind the primary by more than
+  ``DATABASE_REPLICA_MAX_LAG`` seconds, or unreachable. Each process checks
+  the lag of the replicas every ``DATABASE_REPLICA_CHECK_INTERVAL`` seconds
+  and leaves those that lag out until they caught up.
+
+The queries and writes run on each alias, and the times a replica was left
+out, are counted in the request metrics (``/_metrics/``, see
+:mod:`{{ project_name }}.apps.core.metrics`).
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from {{ project_name }}.apps.core.db import instrument
+from {{ project_name }}.apps.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+PIN_COOKIE = 'dbpin'
+
+# Seconds the replica is behind the primary; 0 when it replayed everything
+# it received, NULL (0) on a server that isn't a replica. PostgreSQL 9.x.
+LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location()
+        THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class _State(threading.local):
+    # Reads go to the primary until then.
+    pinned_until = 0.0
+    # Whether the thread wrote during the current request.
+    wrote = False
+
+_state = _State()
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+
+def replica_lag(alias):
+    """Return how many seconds ``alias`` is behind the primary."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    cursor = connection.cursor()
+    cursor.execute(LAG_SQL)
+    return float(cursor.fetchone()[0] or 0)
+
+
+def healthy_replicas():
+    """Return the replicas to read from, checking their lag when it's due."""
+    interval = getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 5)
+    max_lag = getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)
+    replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+    now = time.time()
+    due = []
+    with _replicas_lock:
+        for alias in replicas:
+            replica = _replicas.setdefault(alias, {'checked': 0,
+                                                   'healthy': True})
+            if now - replica['checked'] >= interval:
+                # Claimed here: other threads keep the last result meanwhile.
+                replica['checked'] = now
+                due.append(alias)
+    for alias in due:
+        try:
+            lag = replica_lag(alias)
+        except Exception as e:
+            healthy, reason = False, '%s: %s' % (type(e).__name__, e)
+        else:
+            healthy, reason = lag <= max_lag, '%.1fs behind' % lag
+        replica = _replicas[alias]
+        if healthy != replica['healthy']:
+            if healthy:
+                logger.info("Reading from replica %s again (%s).", alias,
+                            reason)
+            else:
+                logger.warning("Not reading from replica %s (%s).", alias,
+                               reason)
+                registry.count('db_replica_dropped_total', alias)
+        replica['healthy'] = healthy
+    return [alias for alias in replicas
+            if _replicas[alias]['healthy']]
+
+
+def pin(seconds=None):
+    """Read from the primary for ``seconds`` (``DATABASE_PIN_SECONDS``)."""
+    if seconds is None:
+        seconds = getattr(settings, 'DATABASE_PIN_SECONDS', 10)
+    _state.pinned_until = max(_state.pinned_until, time.time() + seconds)
+    _state.wrote = True
+
+
+def _count_query(alias, sql, duration):
+    registry.count('db_alias_queries_total', alias)
+    if sql.lstrip()[:6].upper() != 'SELECT':
+        registry.count('db_alias_writes_total', alias)
+
+
+class ReplicaRouter(object):
+    """Route reads to the replicas, see the module."""
+
+    def __init__(self):
+        self.replicas = tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+        instrument.add_observer(_count_query)
+
+    def db_for_read(self, model, **hints):
+        if (not self.replicas or time.time() < _state.pinned_until or
+                transaction.is_managed(using=PRIMARY)):
+            return PRIMARY
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # Without replicas every read sees the writes: no pin, no cookie.
+        if self.replicas:
+            pin()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        databases = (PRIMARY,) + self.replicas
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db in self.replicas:
+            return False
+        return None
+
+
+class ReplicaPinMiddleware(object):
+    """Carry the read-your-writes pin of a client across its requests.
+
+    Put it before the middleware that may write (e.g. the sessions'), so that
+    their writes pin the client too.
+    """
+
+    def process_request(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0.0
+        # The client can't pin itself for longer than a write would.
+        _state.pinned_until = min(pinned_until, time.time() + getattr(
+            settings, 'DATABASE_PIN_SECONDS', 10))
+        _state.wrote = False
+
+    def process_response(self, request, response):
+        if _state.wrote:
+            seconds = max(_state.pinned_until - time.time(), 0)
+            response.set_cookie(PIN_COOKIE, '%.3f' % _state.pinned_until,
+                                max_age=int(seconds) + 1, httponly=True)
+        _state.pinned_until = 0.0
+        _state.wrote = False
+        return response
+
+
+# At bottom to avoid circular import: django.db loads DATABASE_ROUTERS.
+from django.db import connections, transaction
@@ -0,0 +1,135 @@
+"""
+Health checks answered in front of Django, at the WSGI level.
+
+``wsgi.py`` wraps the Django application with :class:`HealthCheck`, which
+answers two URLs itself, without any middleware, session or URL resolving:
+
+``/_health/live``
+    Liveness: the process answers requests. Costs next to nothing.
+``/_health/ready``
+    Readiness: every database and cache answers too. Each one is checked in
+    a thread of its own; the ones that didn't answer within ``timeout``
+    seconds count as failed. Answers ``503`` when a check failed, with the
+    result of each check and the pid of the worker's master (the deploy
+    tells the old and new gunicorn masters apart with it) as JSON.
+"""
+import json
+import os
+import threading
+import time
+
+LIVE_PATH = '/_health/live'
+READY_PATH = '/_health/ready'
+
+
+def check_database(alias):
+    from django.db import connections
+    connection = connections[alias]
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    finally:
+        # Connections are per thread: don't leave this one open.
+        connection.close()
+
+
+_caches = {}
+
+
+def check_cache(alias):
+    # get_cache() builds a new backend, and client, on every call.
+    cache = _caches.get(alias)
+    if cache is None:
+        from django.core.cache import get_cache
+        cache = _caches.setdefault(alias, get_cache(alias))
+    key = '_health_%d' % threading.current_thread().ident
+    cache.set(key, 1, 10)
+    if cache.get(key) != 1:
+        raise ValueError("The value just set wasn't found.")
+
+
+def readiness_checks():
+    """Return ``{name: (function, alias)}`` for every database and cache.
+
+    Read replicas are left out: the database router stops reading from those
+    that are down (see :mod:`{{ project_name }}.apps.core.db.router`).
+    """
+    from django.conf import settings
+    replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+    checks = {}
+    for alias in settings.DATABASES:
+        if alias in replicas:
+            continue
+        checks['database:' + alias] = (check_database, alias)
+    for alias in settings.CACHES:
+        checks['cache:' + alias] = (check_cache, alias)
+    return checks
+
+
+def run_checks(checks, timeout):
+    """Run ``checks`` concurrently, give up on them after ``timeout`` seconds.
+
+    Returns ``(ok, results)``, ``results`` having an entry per check.
+    """
+    results = {}
+    threads = []
+
+    def run(name, function, alias):
+        start = time.time()
+        try:
+            function(alias)
+        except Exception as e:
+            results[name] = {'ok': False, 'error': '%s: %s' % (
+                type(e).__name__, e)}
+        else:
+            results[name] = {'ok': True}
+        results[name]['ms'] = round((time.time() - start) * 1000, 1)
+
+    for name, (function, alias) in checks.items():
+        thread = threading.Thread(target=run, args=(name, function, alias))
+        # Don't keep the process alive for a check that hangs.
+        thread.daemon = True
+        thread.start()
+        threads.append((name, thread))
+    deadline = time.time() + timeout
+    final = {}
+    for name, thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+        if thread.is_alive():
+            final[name] = {'ok': False, 'error': 'Timed out.',
+                           'ms': round(timeout * 1000, 1)}
+        else:
+            final[name] = results[name]
+    return all(result['ok'] for result in final.values()), final
+
+
+class HealthCheck(object):
+    """WSGI middleware answering the health checks, see the module."""
+
+    def __init__(self, application, timeout=2.0):
+        self.application = application
+        self.timeout = timeout
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == LIVE_PATH:
+            return self.respond(start_response, '200 OK', 'text/plain',
+                                b'ok\n')
+        if path == READY_PATH:
+            ok, results = run_checks(readiness_checks(), self.timeout)
+            # The master tells the deploy which server answered, see
+            # _upgrade_gunicorn() in the fabfile.
+            body = json.dumps({'ok': ok, 'checks': results,
+                               'master': os.getppid()}, sort_keys=True)
+            return self.respond(
+                start_response,
+                '200 OK' if ok else '503 Service Unavailable',
+                'application/json', body.encode('utf-8') + b'\n')
+        return self.application(environ, start_response)
+
+    def respond(self, start_response, status, content_type, body):
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body))),
+                                ('Cache-Control', 'no-cache')])
+        return [body]
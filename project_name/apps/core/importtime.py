@@ -0,0 +1,165 @@
+"""
+Import-time profiling for interpreters without ``python -X importtime``.
+
+:class:`ImportTimer` wraps ``__import__`` and records how long every import
+that loaded something took, as a tree. It only makes sense in a fresh
+interpreter, which is what ``manage.py importtime`` runs::
+
+    python -m {{ project_name }}.apps.core.importtime [--min-ms=N] [target ...]
+
+A target is ``wsgi`` (what a gunicorn worker loads before answering its first
+request), ``manage`` (what every management command loads) or a module name.
+"""
+import sys
+import time
+from contextlib import contextmanager
+from optparse import OptionParser
+
+try:
+    import __builtin__ as builtins
+except ImportError:  # Python 3
+    import builtins
+
+DEFAULT_LEVEL = -1 if sys.version_info[0] < 3 else 0
+
+
+class Node(object):
+    __slots__ = ('name', 'elapsed', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0.0
+        self.children = []
+
+    @property
+    def self_time(self):
+        return self.elapsed - sum(child.elapsed for child in self.children)
+
+
+class ImportTimer(object):
+
+    def __init__(self):
+        self.root = Node('')
+        self._stack = [self.root]
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        builtins.__import__ = self._import
+
+    @contextmanager
+    def phase(self, name):
+        """Record what is imported in the block under a node of its own."""
+        node = Node(name)
+        self._stack[-1].children.append(node)
+        self._stack.append(node)
+        start = time.time()
+        try:
+            yield
+        finally:
+            node.elapsed = time.time() - start
+            self._stack.pop()
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(),
+                      level=DEFAULT_LEVEL):
+        loaded = len(sys.modules)
+        node = Node('.' * level + name if level > 0 else name)
+        self._stack.append(node)
+        start = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            node.elapsed = time.time() - start
+            self._stack.pop()
+            # Most imports find the module in sys.modules: leave them out.
+            if len(sys.modules) != loaded:
+                self._stack[-1].children.append(node)
+
+
+def format_tree(node, min_ms=1.0, depth=0):
+    """Yield a line for ``node``'s children, and theirs, above ``min_ms``."""
+    for child in node.children:
+        if child.elapsed * 1000 < min_ms:
+            continue
+        yield '%9.1f %9.1f  %s%s' % (child.elapsed * 1000,
+                                     child.self_time * 1000,
+                                     '  ' * depth, child.name)
+        for line in format_tree(child, min_ms, depth + 1):
+            yield line
+
+
+def heaviest(node, count):
+    """Return the ``count`` ``(self_time, name)`` pairs that cost the most."""
+    totals = {}
+    stack = list(node.children)
+    while stack:
+        child = stack.pop()
+        totals[child.name] = totals.get(child.name, 0) + child.self_time
+        stack.extend(child.children)
+    return sorted(((elapsed, name) for name, elapsed in totals.items()),
+                  reverse=True)[:count]
+
+
+def load_wsgi():
+    """Load what a worker needs before answering its first request."""
+    from django.conf import settings
+    from django.core.urlresolvers import get_resolver
+    from django.utils.importlib import import_module
+    path = settings.WSGI_APPLICATION or '{{ project_name }}.wsgi.application'
+    module, name = path.rsplit('.', 1)
+    application = getattr(import_module(module), name)
+    # Unwrap WSGI middleware such as core.health.HealthCheck.
+    while hasattr(application, 'application'):
+        application = application.application
+    application.load_middleware()
+    get_resolver(None).url_patterns
+
+
+def load_manage():
+    """Load what every management command loads."""
+    from django.core.management import get_commands
+    from django.db.models.loading import get_models
+    get_commands()
+    get_models()
+
+
+TARGETS = {
+    'wsgi': load_wsgi,
+    'manage': load_manage,
+}
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [wsgi|manage|module ...]')
+    parser.add_option('--min-ms', type='float', default=1.0,
+                      help="Hide imports faster than this (default: 1).")
+    parser.add_option('--top', type='int', default=15,
+                      help="Number of heaviest modules to list (default: 15).")
+    options, targets = parser.parse_args(argv)
+
+    timer = ImportTimer()
+    timer.install()
+    try:
+        for target in targets or ['wsgi']:
+            with timer.phase(target):
+                if target in TARGETS:
+                    TARGETS[target]()
+                else:
+                    __import__(target)
+    finally:
+        timer.uninstall()
+
+    print('%9s %9s  %s' % ('total ms', 'self ms', 'import'))
+    for line in format_tree(timer.root, options.min_ms):
+        print(line)
+    print('')
+    print('Heaviest modules (self time):')
+    for elapsed, name in heaviest(timer.root, options.top):
+        print('%9.1f  %s' % (elapsed * 1000, name))
+
+
+if __name__ == '__main__':
+    main()
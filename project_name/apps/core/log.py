@@ -0,0 +1,209 @@
+"""
+Error emails that never hold up a request.
+
+:class:`QueuedAdminEmailHandler` replaces Django's ``AdminEmailHandler``,
+which talks to the SMTP server from the failing worker: during an incident,
+hundreds of errors a second would tie every worker up sending mail. Instead
+the handler puts records on a bounded queue (dropping them when it is full)
+and a thread of its own mails them:
+
+* Records with the same logger, message and traceback are counted rather
+  than formatted again.
+* Everything logged within ``window`` seconds of a first record goes out as
+  one digest email.
+* At most ``max_per_minute`` emails are sent a minute; past that, records
+  keep being counted for the next digest.
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from django.conf import settings
+from django.core import mail
+from django.utils.log import AdminEmailHandler
+from django.views.debug import get_exception_reporter_filter
+
+
+def fingerprint(record):
+    """Identify the records that only differ by their arguments or time."""
+    parts = [record.name, str(record.levelno), str(record.msg)]
+    if record.exc_info and record.exc_info[0] is not None:
+        parts.append(record.exc_info[0].__name__)
+        for filename, lineno, function, _ in traceback.extract_tb(
+                record.exc_info[2]):
+            parts.append('%s:%s:%s' % (filename, lineno, function))
+    return hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class QueuedAdminEmailHandler(AdminEmailHandler):
+    """Mail records to the admins from a background thread, see the module."""
+
+    def __init__(self, window=10, max_per_minute=5, queue_size=1000):
+        # Digests are plain text: no HTML report.
+        super(QueuedAdminEmailHandler, self).__init__(include_html=False)
+        self.window = window
+        self.max_per_minute = max_per_minute
+        self.queue_size = queue_size
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        """Start the thread, again in a forked process (it wasn't copied)."""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._dropped = 0
+            # emit() counts from the request threads, the digest resets.
+            self._dropped_lock = threading.Lock()
+            # Fingerprints of the pending digest, read by emit() to skip
+            # formatting records that are only counted.
+            self._pending = {}
+            # Subject and body of the records of the last digest, for those
+            # emit() didn't format as they were pending at the time.
+            self._recent = {}
+            self._sent = []
+            self._thread = threading.Thread(target=self._run,
+                                            name='error-mail')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start()
+            key = fingerprint(record)
+            if key in self._pending:
+                entry = (key, None, None, time.time())
+            else:
+                subject, message = self.render(record)
+                entry = (key, subject, message, time.time())
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def render(self, record):
+        """Return the subject and body of a record, like
+        ``AdminEmailHandler`` does.
+
+        Done by the caller: the request isn't safe to use from another
+        thread, and is gone by the time the email is written.
+        """
+        try:
+            request = record.request
+            subject = '%s (%s IP): %s' % (
+                record.levelname,
+                ('internal' if request.META.get('REMOTE_ADDR') in
+                 settings.INTERNAL_IPS else 'EXTERNAL'),
+                record.getMessage())
+            request_repr = get_exception_reporter_filter(
+                request).get_request_repr(request)
+        except Exception:
+            subject = '%s: %s' % (record.levelname, record.getMessage())
+            request_repr = "Request repr() unavailable."
+        if record.exc_info:
+            stack_trace = ''.join(traceback.format_exception(
+                *record.exc_info))
+        else:
+            stack_trace = 'No stack trace available'
+        return (self.format_subject(subject),
+                '%s\n\n%s' % (stack_trace, request_repr))
+
+    def _run(self):
+        digest_started = None
+        while True:
+            if digest_started is None:
+                timeout = None
+            else:
+                timeout = max(digest_started + self.window - time.time(), 0)
+            try:
+                entry = self._queue.get(True, timeout)
+            except queue.Empty:
+                entry = False
+            if entry is None:
+                # close(): mail what we have and stop.
+                self._send_digest(force=True)
+                return
+            if entry:
+                key, subject, message, when = entry
+                pending = self._pending.get(key)
+                if pending is None and subject is None:
+                    subject, message = self._recent.get(
+                        key, ('(Repeated error)', ''))
+                if pending is None:
+                    self._pending[key] = [1, subject, message, when, when]
+                else:
+                    pending[0] += 1
+                    pending[4] = when
+                if digest_started is None:
+                    digest_started = time.time()
+            if (digest_started is not None and
+                    time.time() - digest_started >= self.window):
+                if self._send_digest():
+                    digest_started = None
+                else:
+                    # Over the rate limit: try again in a while.
+                    digest_started = time.time()
+
+    def _send_digest(self, force=False):
+        """Mail the pending records. Returns ``False`` when rate limited."""
+        if not self._pending:
+            return True
+        now = time.time()
+        self._sent = [sent for sent in self._sent if now - sent < 60]
+        if len(self._sent) >= self.max_per_minute and not force:
+            return False
+        self._sent.append(now)
+        self._recent = dict((key, (p[1], p[2]))
+                            for key, p in self._pending.items())
+        pending = sorted(self._pending.values(), key=lambda p: -p[0])
+        self._pending = {}
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        total = sum(p[0] for p in pending)
+        if total == 1 and not dropped:
+            subject, message = pending[0][1], pending[0][2]
+        else:
+            subject = self.format_subject(
+                '%d errors (%d distinct): %s' % (total, len(pending),
+                                                 pending[0][1]))
+            sections = []
+            if dropped:
+                sections.append('%d more records were dropped, the queue '
+                                'was full.' % dropped)
+            for count, first_subject, message, first, last in pending:
+                sections.append('%d x %s\nFirst at %s, last at %s.\n\n%s' % (
+                    count, first_subject,
+                    time.strftime('%H:%M:%S', time.localtime(first)),
+                    time.strftime('%H:%M:%S', time.localtime(last)),
+                    message))
+            message = ('\n\n' + '=' * 70 + '\n\n').join(sections)
+        try:
+            mail.mail_admins(subject, message, fail_silently=True)
+        except Exception:
+            # Logging it here could loop back to this handler.
+            traceback.print_exc()
+        return True
+
+    def close(self):
+        """Send what is pending, waiting a few seconds at most."""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+            self._thread.join(5)
+        super(QueuedAdminEmailHandler, self).close()
@@ -0,0 +1,138 @@
+"""
+Latency percentiles and throughput from the JSON access logs.
+
+Reads the gunicorn access logs of ``server/*/logs`` (``--nginx`` for the
+nginx ones; rotated and gzipped files too) a line at a time, and reports
+p50/p95/p99 latency and requests per second per time window and per route.
+Memory doesn't grow with the size of the logs: the files are read merged in
+time order, so each window is reported and dropped as soon as it's over, and
+each route only holds a fixed-size histogram (see
+:mod:`{{ project_name }}.apps.core.accesslog`).
+"""
+import glob
+import gzip
+import heapq
+import os
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from {{ project_name }}.apps.core.accesslog import Histogram, parse
+
+
+def default_logs(nginx=False):
+    name = 'nginx_access.log*' if nginx else 'gunicorn-access.log*'
+    return sorted(glob.glob(os.path.join(
+        os.path.dirname(settings.PROJECT_DIR), 'server', '*', 'logs', name)))
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for line in f:
+            yield line
+
+
+class Command(BaseCommand):
+    args = '[log file ...]'
+    help = ("Report latency percentiles and throughput per route and per "
+            "time window from the JSON access logs.")
+    option_list = BaseCommand.option_list + (
+        make_option('--nginx', action='store_true', default=False,
+            help="Read the nginx logs rather than the gunicorn ones."),
+        make_option('--window', type='int', default=300,
+            help="Length of the time windows in seconds (default: 300)."),
+        make_option('--top', type='int', default=20,
+            help="Number of routes shown, the busiest ones (default: 20)."),
+        make_option('--route',
+            help="Only count the requests to this route."),
+    )
+
+    def handle(self, *paths, **options):
+        paths = paths or default_logs(options['nginx'])
+        if not paths:
+            raise CommandError("No access log found, give their paths.")
+        window = options['window']
+        routes = {}
+        windows = {}
+        # Windows before this one were reported.
+        reported = 0
+        late = 0
+        self.skipped = 0
+        self.windows_shown = False
+        first = last = None
+        records = heapq.merge(*[self.records(path) for path in paths])
+        for ts, route, duration, status in records:
+            if options['route'] and route != options['route']:
+                continue
+            if route not in routes:
+                routes[route] = Histogram()
+            routes[route].add(duration, status)
+            first = ts if first is None else min(first, ts)
+            last = ts if last is None else max(last, ts)
+            start = int(ts // window * window)
+            if start < reported:
+                late += 1
+                continue
+            if start not in windows:
+                windows[start] = Histogram()
+            windows[start].add(duration, status)
+            # Requests are logged when they end, a little out of order: a
+            # window is over once the next one is too.
+            for done in sorted(windows):
+                if done >= start - window:
+                    break
+                self.write_window(done, windows.pop(done), window)
+                reported = done + window
+        if not routes:
+            raise CommandError("No access record found (%d other lines)."
+                               % self.skipped)
+        for done in sorted(windows):
+            self.write_window(done, windows.pop(done), window)
+        if late and int(options['verbosity']) > 0:
+            self.stdout.write("(%d records came after their window was "
+                              "reported, only counted per route)" % late)
+
+        span = max(last - first, 1)
+        self.stdout.write('')
+        self.stdout.write(self.header('route'))
+        busiest = sorted(routes.items(), key=lambda item: -item[1].count)
+        for route, histogram in busiest[:options['top']]:
+            self.stdout.write(self.row(route[:40], histogram, span))
+        if len(busiest) > options['top']:
+            self.stdout.write("(%d more routes)" % (len(busiest) -
+                                                    options['top']))
+        if self.skipped and int(options['verbosity']) > 0:
+            self.stdout.write("\n%d lines weren't JSON access records." %
+                              self.skipped)
+
+    def records(self, path):
+        """Yield the access records of ``path``, counting the other lines."""
+        for line in read_lines(path):
+            parsed = parse(line)
+            if parsed is None:
+                self.skipped += 1
+            else:
+                yield parsed
+
+    def write_window(self, start, histogram, seconds):
+        if not self.windows_shown:
+            self.stdout.write(self.header('window'))
+            self.windows_shown = True
+        label = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))
+        self.stdout.write(self.row(label, histogram, seconds))
+
+    def header(self, name):
+        return '%-40s %9s %8s %9s %9s %9s %9s %6s' % (
+            name, 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'max ms', '5xx')
+
+    def row(self, label, histogram, seconds):
+        return '%-40s %9d %8.2f %9.1f %9.1f %9.1f %9.1f %6d' % (
+            label, histogram.count, histogram.count / float(seconds),
+            histogram.percentile(0.5) / 1000.0,
+            histogram.percentile(0.95) / 1000.0,
+            histogram.percentile(0.99) / 1000.0,
+            histogram.max / 1000.0, histogram.errors)
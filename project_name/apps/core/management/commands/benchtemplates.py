@@ -0,0 +1,68 @@
+"""
+Compare template render times with and without the cached template loader.
+
+Each template is rendered ``--iterations`` times the way a request would: it
+is looked up by name (which also resolves the templates it extends or
+includes) and rendered with an almost empty context.
+"""
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Context, loader
+from django.template.loader import find_template_loader, get_template
+
+DEFAULT_TEMPLATES = ('base.html', '404.html', '500.html', 'admin/login.html',
+                     'admin/base_site.html', 'admin/404.html')
+
+
+def uncached_loaders():
+    """Return the configured loaders, unwrapping any cached loader."""
+    names = []
+    for name in settings.TEMPLATE_LOADERS:
+        if isinstance(name, (list, tuple)) and name[0].endswith('cached.Loader'):
+            names.extend(name[1])
+        else:
+            names.append(name)
+    return [find_template_loader(name) for name in names]
+
+
+class Command(BaseCommand):
+    args = '[template ...]'
+    help = ("Benchmark the render time of templates with the uncached and the "
+            "cached template loaders.")
+    option_list = BaseCommand.option_list + (
+        make_option('-n', '--iterations', type='int', default=200,
+            help="Number of renders per template and loader (default: 200)."),
+    )
+
+    def handle(self, *names, **options):
+        iterations = options['iterations']
+        names = names or DEFAULT_TEMPLATES
+        uncached = tuple(uncached_loaders())
+        cached = (find_template_loader(
+            ('django.template.loaders.cached.Loader',
+             [loader_.__module__ + '.Loader' for loader_ in uncached])),)
+
+        self.stdout.write('%-30s %14s %14s %8s' % ('template', 'uncached (us)',
+                                                   'cached (us)', 'speedup'))
+        saved_loaders = loader.template_source_loaders
+        try:
+            for name in names:
+                loader.template_source_loaders = uncached
+                before = self.render_time(name, iterations)
+                loader.template_source_loaders = cached
+                get_template(name)  # the first render fills the cache
+                after = self.render_time(name, iterations)
+                self.stdout.write('%-30s %14.1f %14.1f %7.1fx' % (
+                    name, before, after, before / after))
+        finally:
+            loader.template_source_loaders = saved_loaders
+
+    def render_time(self, name, iterations):
+        """Return the mean time in microseconds to load and render ``name``."""
+        start = time.time()
+        for _ in range(iterations):
+            get_template(name).render(Context({'csrf_token': 'NOTPROVIDED'}))
+        return (time.time() - start) * 1e6 / iterations
@@ -0,0 +1,226 @@
+"""
+Benchmark the WSGI application in-process, without any network.
+
+Synthetic WSGI requests are fed straight to ``{{ project_name }}.wsgi``'s
+``application`` against a throw-away test database. Each scenario reports
+requests per second, p50/p99 latency and memory per request. Results are
+written to ``VAR_ROOT/bench/latest.json`` and compared against
+``VAR_ROOT/bench/baseline.json``: the command fails when a scenario got slower
+than the tolerance allows or answers with another status code.
+"""
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from io import BytesIO
+from optparse import make_option
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.importlib import import_module
+
+
+class Scenario(object):
+
+    def __init__(self, name, path, cookies=None):
+        self.name = name
+        self.path = path
+        self.cookies = cookies or {}
+
+    def environ(self):
+        if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*':
+            host = settings.ALLOWED_HOSTS[0].lstrip('.')
+        else:
+            host = 'localhost'
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': self.path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': host,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join(
+                '%s=%s' % item for item in self.cookies.items())
+        return environ
+
+    def request(self, application):
+        """Run one request, return its status code."""
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        result = application(self.environ(), start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(statuses[0].split()[0])
+
+
+class Command(BaseCommand):
+    help = "Benchmark the WSGI application in-process."
+    option_list = BaseCommand.option_list + (
+        make_option('-n', '--requests', type='int', default=500,
+            help="Requests per scenario (default: 500)."),
+        make_option('--warmup', type='int', default=20,
+            help="Untimed requests per scenario first (default: 20)."),
+        make_option('--tolerance', type='float', default=0.2,
+            help="Allowed slowdown against the baseline (default: 0.2)."),
+        make_option('--save-baseline', action='store_true', default=False,
+            help="Store the results as the new baseline."),
+    )
+
+    def handle(self, **options):
+        from {{ project_name }}.wsgi import application
+
+        directory = os.path.join(settings.VAR_ROOT, 'bench')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            scenarios = self.scenarios()
+            results = {}
+            for scenario in scenarios:
+                results[scenario.name] = self.run(
+                    application, scenario, options['requests'],
+                    options['warmup'])
+                self.report(scenario.name, results[scenario.name])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        document = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+            'time': time.time(),
+            'scenarios': results,
+        }
+        with open(os.path.join(directory, 'latest.json'), 'w') as f:
+            json.dump(document, f, indent=2)
+        baseline_path = os.path.join(directory, 'baseline.json')
+        if options['save_baseline']:
+            with open(baseline_path, 'w') as f:
+                json.dump(document, f, indent=2)
+            self.stdout.write("Saved as the baseline.")
+        elif os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            self.compare(baseline['scenarios'], results, options['tolerance'])
+        else:
+            self.stdout.write("No baseline to compare with, use "
+                              "--save-baseline to record one.")
+
+    def scenarios(self):
+        from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY
+        from django.contrib.auth.models import User
+
+        user = User.objects.create_superuser('bench', 'bench@example.com',
+                                             'bench')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user.pk
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session.save()
+        logged_in = {settings.SESSION_COOKIE_NAME: session.session_key}
+
+        scenarios = [
+            Scenario('admin_login', '/admin/'),
+            Scenario('not_found', '/this-page-does-not-exist/'),
+            Scenario('admin_changelist', '/admin/auth/user/', logged_in),
+        ]
+        if settings.DEBUG and settings.MEDIA_ROOT:
+            if not os.path.exists(settings.MEDIA_ROOT):
+                os.makedirs(settings.MEDIA_ROOT)
+            with open(os.path.join(settings.MEDIA_ROOT, 'bench.txt'), 'w') as f:
+                f.write('x' * 4096)
+            scenarios.append(Scenario('media', settings.MEDIA_URL + 'bench.txt'))
+        return scenarios
+
+    def run(self, application, scenario, requests, warmup):
+        status = scenario.request(application)
+        for _ in range(warmup):
+            scenario.request(application)
+
+        gc.collect()
+        objects_before = len(gc.get_objects())
+        if tracemalloc is not None:
+            tracemalloc.start()
+        timings = []
+        started = time.time()
+        for _ in range(requests):
+            start = time.time()
+            scenario.request(application)
+            timings.append(time.time() - start)
+        elapsed = time.time() - started
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        gc.collect()
+        retained = len(gc.get_objects()) - objects_before
+
+        timings.sort()
+        return {
+            'status': status,
+            'requests_per_second': requests / elapsed,
+            'p50_ms': timings[len(timings) // 2] * 1000,
+            'p99_ms': timings[int(len(timings) * 0.99)] * 1000,
+            # Peak traced memory is only available on Python 3.
+            'peak_kib': peak / 1024.0 if tracemalloc is not None else None,
+            'retained_objects_per_request': retained / float(requests),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            '%-18s %3d %9.1f req/s  p50 %7.2f ms  p99 %7.2f ms  '
+            'retained %6.2f obj/req%s' % (
+                name, result['status'], result['requests_per_second'],
+                result['p50_ms'], result['p99_ms'],
+                result['retained_objects_per_request'],
+                '' if result['peak_kib'] is None
+                else '  peak %.0f KiB' % result['peak_kib']))
+
+    def compare(self, baseline, results, tolerance):
+        regressions = []
+        for name, before in sorted(baseline.items()):
+            after = results.get(name)
+            if after is None:
+                continue
+            if after['status'] != before['status']:
+                regressions.append('%s: status %d, was %d' % (
+                    name, after['status'], before['status']))
+            if after['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+                regressions.append('%s: p50 %.2f ms, was %.2f ms' % (
+                    name, after['p50_ms'], before['p50_ms']))
+            if (after['requests_per_second'] <
+                    before['requests_per_second'] / (1 + tolerance)):
+                regressions.append('%s: %.1f req/s, was %.1f req/s' % (
+                    name, after['requests_per_second'],
+                    before['requests_per_second']))
+        if regressions:
+            raise CommandError("Performance regressed against the baseline:\n"
+                               + '\n'.join('  ' + r for r in regressions))
+        self.stdout.write("No regression against the baseline.")
@@ -0,0 +1,38 @@
+"""
+Print how long startup spends importing what, as a tree.
+
+The imports are timed in a fresh interpreter, see
+:mod:`{{ project_name }}.apps.core.importtime`.
+"""
+import os
+import subprocess
+import sys
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    args = '[wsgi|manage|module ...]'
+    help = ("Print an import-time tree of a worker's startup (wsgi, the "
+            "default), of a management command's (manage) or of modules.")
+    option_list = BaseCommand.option_list + (
+        make_option('--min-ms', default='1',
+            help="Hide imports faster than this (default: 1)."),
+        make_option('--top', default='15',
+            help="Number of heaviest modules to list (default: 15)."),
+    )
+
+    def handle(self, *targets, **options):
+        command = [sys.executable, '-m',
+                   '{{ project_name }}.apps.core.importtime',
+                   '--min-ms', options['min_ms'], '--top', options['top']]
+        process = subprocess.Popen(
+            command + list(targets), stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(settings.PROJECT_DIR))
+        output = process.communicate()[0]
+        self.stdout.write(output.decode('utf-8'), ending='')
+        if process.returncode:
+            raise CommandError("Profiling the imports failed.")
@@ -0,0 +1,154 @@
+"""
+Flag settings that slow a production site down.
+
+Each check looks at the loaded settings (pick them with ``--settings``) and
+reports errors, which a production site mustn't ship, and warnings. The
+command fails when it found errors (or warnings too, with ``--strict``):
+``fab prod deploy`` runs it on each host before restarting it, and stops
+there, see ``perfcheck`` in the fabfile.
+"""
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from {{ project_name }}.apps.core import sessions
+
+ERROR, WARNING = 'error', 'warning'
+
+POOLED_ENGINES = ('{{ project_name }}.apps.core.db.postgresql_pool',)
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+DEBUG_APPS = ('debug_toolbar', 'django_extensions', 'devserver', 'silk')
+
+
+def check_debug():
+    if settings.DEBUG:
+        yield ERROR, ("DEBUG is on: every SQL query of a request is kept in "
+                      "connection.queries, which grows for as long as the "
+                      "worker lives.")
+    if settings.TEMPLATE_DEBUG:
+        yield WARNING, ("TEMPLATE_DEBUG is on: templates are compiled with "
+                        "the source position of every node.")
+
+
+def check_templates():
+    for loader in settings.TEMPLATE_LOADERS:
+        name = loader[0] if isinstance(loader, (list, tuple)) else loader
+        if name == 'django.template.loaders.cached.Loader':
+            return
+    yield ERROR, ("TEMPLATE_LOADERS has no cached loader: templates are read "
+                  "and parsed from disk on every render.")
+
+
+def check_caches():
+    caches = settings.CACHES
+    if 'default' not in caches:
+        yield ERROR, "CACHES has no 'default' cache."
+        return
+    for alias, cache in sorted(caches.items()):
+        backend = cache['BACKEND']
+        if backend == 'django.core.cache.backends.dummy.DummyCache':
+            yield ERROR, "The %r cache is a DummyCache, it caches nothing." % (
+                alias)
+        elif backend in LOCAL_CACHES:
+            yield WARNING, ("The %r cache is a LocMemCache: each worker has "
+                            "its own, emptied on every restart." % alias)
+        shared = cache.get('OPTIONS', {}).get('SHARED_CACHE')
+        if shared and shared not in caches:
+            yield ERROR, ("The %r cache reads through %r, which isn't in "
+                          "CACHES." % (alias, shared))
+    engine = settings.SESSION_ENGINE
+    if engine == '{{ project_name }}.apps.core.sessions':
+        alias = getattr(settings, 'SESSION_STORE_CACHE', 'sessions')
+        backend = caches.get(alias, {}).get('BACKEND')
+        if backend is None or backend in sessions.LOCAL_CACHES:
+            yield ERROR, ("The sessions cache (%r) isn't shared by the hosts: "
+                          "they would read each other's sessions stale." %
+                          alias)
+    elif engine in ('django.contrib.sessions.backends.db',
+                  'django.contrib.sessions.backends.file'):
+        yield WARNING, ("SESSION_ENGINE is %s: every request with a session "
+                        "reads it from %s." % (
+                            engine, 'the database' if engine.endswith('db')
+                            else 'disk'))
+
+
+def check_databases():
+    for alias, database in sorted(settings.DATABASES.items()):
+        engine = database.get('ENGINE', '')
+        if engine.endswith('sqlite3'):
+            yield ERROR, ("The %r database is SQLite: writes from the "
+                          "workers are serialized." % alias)
+        elif (engine not in POOLED_ENGINES and
+              not database.get('CONN_MAX_AGE')):
+            yield ERROR, ("The %r database connects on every request: use "
+                          "the pooled backend (%s) or set CONN_MAX_AGE." % (
+                              alias, POOLED_ENGINES[0]))
+    replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+    for alias in replicas:
+        if alias not in settings.DATABASES:
+            yield ERROR, ("The replica %r isn't in DATABASES." % alias)
+    if replicas and (getattr(settings, 'DATABASE_PIN_SECONDS', 10) <=
+                     getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)):
+        yield WARNING, ("DATABASE_PIN_SECONDS isn't longer than "
+                        "DATABASE_REPLICA_MAX_LAG: clients may not see "
+                        "their own writes.")
+
+
+def check_apps():
+    for name in settings.INSTALLED_APPS:
+        if name.split('.')[0] in DEBUG_APPS:
+            yield ERROR, "%s is installed: it is a development tool." % name
+    for name in settings.MIDDLEWARE_CLASSES:
+        if name.split('.')[0] in DEBUG_APPS:
+            yield ERROR, "%s is in MIDDLEWARE_CLASSES." % name
+    if getattr(settings, 'JOBS_EAGER', False):
+        yield WARNING, ("JOBS_EAGER is on: background jobs run within the "
+                        "requests that queue them.")
+
+
+def check_static():
+    if settings.STATICFILES_STORAGE == \
+            'django.contrib.staticfiles.storage.StaticFilesStorage':
+        yield WARNING, ("STATICFILES_STORAGE doesn't hash the names of the "
+                        "files: browsers can't cache them for long.")
+
+
+def check_logging():
+    loggers = getattr(settings, 'LOGGING', {}).get('loggers', {})
+    for name in ('django.db', 'django.db.backends'):
+        level = loggers.get(name, {}).get('level')
+        if level == 'DEBUG':
+            yield WARNING, ("The %s logger is at DEBUG: every SQL query is "
+                            "formatted and logged." % name)
+
+
+CHECKS = (check_debug, check_templates, check_caches, check_databases,
+          check_apps, check_static, check_logging)
+
+
+class Command(NoArgsCommand):
+    help = ("Check the settings for configuration that hurts performance in "
+            "production. Fails when there are errors.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--strict', action='store_true', default=False,
+            help="Fail on warnings too."),
+    )
+
+    def handle_noargs(self, **options):
+        findings = []
+        for check in CHECKS:
+            findings.extend(check())
+        errors = [message for level, message in findings if level == ERROR]
+        warnings = [message for level, message in findings
+                    if level == WARNING]
+        if int(options['verbosity']) > 0:
+            self.stdout.write("Checking %s." % settings.SETTINGS_MODULE)
+            for level, message in findings:
+                self.stdout.write('%-8s %s' % (level.upper(), message))
+            self.stdout.write("%d errors, %d warnings." % (len(errors),
+                                                           len(warnings)))
+        if errors or (warnings and options['strict']):
+            raise CommandError("%s isn't fit for production." %
+                               settings.SETTINGS_MODULE)
@@ -0,0 +1,184 @@
+"""
+Compile the bytecode of the project and its virtualenv ahead of a restart.
+
+Otherwise every freshly started worker compiles (and tries to write) the
+bytecode of each module it imports, right when traffic comes back.
+
+Files are compiled in parallel. A file whose bytecode matches its
+modification time is skipped; one that was touched but whose content hash is
+still the one recorded in ``PRECOMPILE_MANIFEST`` only gets the timestamp of
+its bytecode updated. Bytecode left behind by deleted modules of the project
+is removed, so that they can't be imported any more.
+
+A project file that doesn't compile fails the command. So does an app of
+``INSTALLED_APPS`` (or its models) that doesn't import: better here than in
+the workers.
+"""
+import hashlib
+import imp
+import json
+import os
+import py_compile
+import struct
+import sys
+from distutils.sysconfig import get_python_lib
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db.models.loading import get_apps
+from django.utils.importlib import import_module
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:  # Python 2
+    def cache_from_source(path):
+        return path + 'c'
+
+# Where the modification time of the source is in a bytecode file header.
+MTIME_OFFSET = 8 if sys.version_info >= (3, 7) else 4
+MAGIC = imp.get_magic()
+
+SKIPPED, TOUCHED, COMPILED, FAILED = 'skipped', 'touched', 'compiled', 'failed'
+
+
+def source_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def precompile(args):
+    """Bring the bytecode of ``path`` up to date.
+
+    Returns ``(path, outcome, hash or error)``; run in the pool's processes.
+    """
+    path, known_hash = args
+    cfile = cache_from_source(path)
+    mtime = int(os.stat(path).st_mtime) & 0xFFFFFFFF
+    try:
+        with open(cfile, 'rb') as f:
+            header = f.read(MTIME_OFFSET + 4)
+    except IOError:
+        header = b''
+    if len(header) == MTIME_OFFSET + 4 and header.startswith(MAGIC):
+        if struct.unpack('<I', header[MTIME_OFFSET:])[0] == mtime:
+            return path, SKIPPED, known_hash or source_hash(path)
+        digest = source_hash(path)
+        if digest == known_hash:
+            # Touched, not changed (e.g. by a checkout): the bytecode is
+            # good, only its timestamp isn't.
+            with open(cfile, 'r+b') as f:
+                f.seek(MTIME_OFFSET)
+                f.write(struct.pack('<I', mtime))
+            return path, TOUCHED, digest
+    else:
+        digest = source_hash(path)
+    try:
+        py_compile.compile(path, cfile, doraise=True)
+    except (py_compile.PyCompileError, IOError, OSError) as e:
+        return path, FAILED, str(e).strip()
+    return path, COMPILED, digest
+
+
+def find_files(roots, clean=()):
+    """Return the ``.py`` files under ``roots``, and the orphan ``.pyc``
+    removed from those that are in ``clean``.
+    """
+    sources, orphans = [], []
+    for root in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            names = set(filenames)
+            for name in filenames:
+                path = os.path.join(directory, name)
+                if name.endswith('.py'):
+                    sources.append(path)
+                elif (name.endswith('.pyc') and name[:-1] not in names and
+                      root in clean):
+                    orphans.append(path)
+    for path in orphans:
+        os.remove(path)
+    return sources, orphans
+
+
+class Command(NoArgsCommand):
+    help = ("Compile the bytecode of the project and the virtualenv, then "
+            "check that every installed app imports.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', default=cpu_count(),
+            help="Compiling processes (default: one per CPU)."),
+        make_option('--no-verify', action='store_false', dest='verify',
+            default=True,
+            help="Don't import the installed apps afterwards."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options['verbosity'])
+        # Some packages of the virtualenv only ship bytecode: don't clean it.
+        roots = [settings.PROJECT_DIR, get_python_lib()]
+        manifest_path = settings.PRECOMPILE_MANIFEST
+        try:
+            with open(manifest_path) as f:
+                hashes = json.load(f)
+        except (IOError, ValueError):
+            hashes = {}
+
+        sources, orphans = find_files(roots, clean=[settings.PROJECT_DIR])
+        pool = Pool(max(options['processes'], 1))
+        try:
+            results = pool.map(precompile,
+                               [(path, hashes.get(path)) for path in sources],
+                               chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+
+        counts = dict((outcome, 0) for outcome in
+                      (SKIPPED, TOUCHED, COMPILED, FAILED))
+        hashes = {}
+        errors = []
+        for path, outcome, value in results:
+            counts[outcome] += 1
+            if outcome == FAILED:
+                # Third party packages may hold files meant for another
+                # Python version: only the project's must compile.
+                if path.startswith(settings.PROJECT_DIR + os.sep):
+                    errors.append(value)
+                elif verbosity > 1:
+                    self.stderr.write("Can't compile %s: %s" % (path, value))
+            elif value:
+                hashes[path] = value
+        with open(manifest_path, 'w') as f:
+            json.dump(hashes, f)
+        if verbosity > 0:
+            self.stdout.write(
+                "%(compiled)d compiled, %(touched)d touched, %(skipped)d "
+                "unchanged, %(failed)d failed, " % counts +
+                "%d orphan bytecode files removed." % len(orphans))
+        if errors:
+            raise CommandError("Project files failed to compile:\n" +
+                               '\n'.join(errors))
+
+        if options['verify']:
+            self.verify(verbosity)
+
+    def verify(self, verbosity):
+        errors = []
+        for app in settings.INSTALLED_APPS:
+            try:
+                import_module(app)
+            except Exception as e:
+                errors.append('%s: %s: %s' % (app, type(e).__name__, e))
+        if not errors:
+            try:
+                # Imports the models module of every app.
+                get_apps()
+            except Exception as e:
+                errors.append('models: %s: %s' % (type(e).__name__, e))
+        if errors:
+            raise CommandError("Installed apps failed to import:\n" +
+                               '\n'.join(errors))
+        if verbosity > 0:
+            self.stdout.write("%d installed apps imported."
+                              % len(settings.INSTALLED_APPS))
@@ -0,0 +1,35 @@
+"""
+Delete the expired sessions in small batches.
+
+Unlike ``clearsessions``, which deletes them all with a single statement (and
+holds its locks until the whole table was scanned), each batch is a short
+transaction of its own.
+"""
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.management.base import NoArgsCommand
+from django.utils.importlib import import_module
+
+from {{ project_name }}.apps.core.sessions import clear_expired
+
+
+class Command(NoArgsCommand):
+    help = "Delete the expired sessions, a bounded batch at a time."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+            help="Sessions deleted per transaction (default: 1000)."),
+        make_option('--pause', type='float', default=0.1,
+            help="Seconds to wait between batches (default: 0.1)."),
+    )
+
+    def handle_noargs(self, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        if not issubclass(engine.SessionStore, DBStore):
+            # Sessions aren't in the database (cache, files, cookies...).
+            engine.SessionStore.clear_expired()
+            return
+        deleted = clear_expired(options['batch_size'], options['pause'])
+        if int(options['verbosity']) > 0:
+            self.stdout.write("Deleted %d expired sessions." % deleted)
@@ -0,0 +1,165 @@
+"""
+Incremental version of ``collectstatic``.
+
+A manifest in ``STATICFILES_MANIFEST`` remembers the source, modification
+time, size and content hash of every collected file. On the next run only the
+files that were added, changed or removed since are linked, copied or deleted;
+the unchanged ones cost a single ``stat`` call.
+
+Only those files are post-processed, along with the CSS files (which may refer
+to them) when the storage rewrites references like
+:class:`{{ project_name }}.apps.core.storage.ManifestStaticFilesStorage` does.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.management.commands import collectstatic
+from django.contrib.staticfiles.utils import matches_patterns
+from django.core.management.base import CommandError
+from django.utils.datastructures import SortedDict
+
+MANIFEST_VERSION = 2
+
+
+def file_hash(path, chunk_size=64 * 1024):
+    """Return the md5 hex digest of the file at ``path``."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(collectstatic.Command):
+    help = ("Collect static files in a single location, only processing the "
+            "files changed since the last run.")
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.manifest_path = getattr(settings, 'STATICFILES_MANIFEST',
+            os.path.join(settings.VAR_ROOT, 'staticfiles.json'))
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if (manifest.get('version') != MANIFEST_VERSION or
+                manifest.get('link') != self.symlink or
+                manifest.get('storage') != self.storage_name):
+            # Collected in another mode, everything has to be redone.
+            return {}
+        return manifest.get('files', {})
+
+    def save_manifest(self, files):
+        if self.dry_run:
+            return
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'link': self.symlink,
+                       'storage': self.storage_name, 'files': files}, f)
+        os.rename(tmp_path, self.manifest_path)
+
+    @property
+    def storage_name(self):
+        storage_class = type(getattr(self.storage, '_wrapped', self.storage))
+        return '%s.%s' % (storage_class.__module__, storage_class.__name__)
+
+    def target_exists(self, prefixed_path):
+        if self.local:
+            return os.path.lexists(self.storage.path(prefixed_path))
+        return self.storage.exists(prefixed_path)
+
+    def delete_target(self, prefixed_path):
+        if self.local:
+            # The storage won't delete dangling symlinks.
+            os.remove(self.storage.path(prefixed_path))
+        else:
+            self.storage.delete(prefixed_path)
+
+    def collect(self):
+        if self.symlink and not self.local:
+            raise CommandError("Can't symlink to a remote destination.")
+        if self.clear:
+            self.clear_dir('')
+            manifest = {}
+        else:
+            manifest = self.load_manifest()
+        handler = self.link_file if self.symlink else self.copy_file
+
+        found_files = SortedDict()
+        modified_files = SortedDict()
+        entries = {}
+        for finder in finders.get_finders():
+            for path, storage in finder.list(self.ignore_patterns):
+                if getattr(storage, 'prefix', None):
+                    prefixed_path = os.path.join(storage.prefix, path)
+                else:
+                    prefixed_path = path
+                if prefixed_path in found_files:
+                    continue
+                found_files[prefixed_path] = (storage, path)
+
+                source_path = storage.path(path)
+                stat = os.stat(source_path)
+                entry = [source_path, int(stat.st_mtime), stat.st_size]
+                previous = manifest.get(prefixed_path)
+                if previous and self.target_exists(prefixed_path):
+                    if previous[:3] == entry:
+                        entries[prefixed_path] = previous
+                        self.unmodified_files.append(prefixed_path)
+                        continue
+                    digest = file_hash(source_path)
+                    if previous[0] == source_path and previous[3] == digest:
+                        # Touched but not changed.
+                        entries[prefixed_path] = entry + [digest]
+                        self.unmodified_files.append(prefixed_path)
+                        continue
+                else:
+                    digest = file_hash(source_path)
+                entries[prefixed_path] = entry + [digest]
+
+                if self.target_exists(prefixed_path) and not self.dry_run:
+                    self.delete_target(prefixed_path)
+                handler(path, prefixed_path, storage)
+                modified_files[prefixed_path] = (storage, path)
+
+        for prefixed_path in set(manifest) - set(found_files):
+            if self.dry_run:
+                self.log("Pretending to delete '%s'" % prefixed_path, level=1)
+            elif self.target_exists(prefixed_path):
+                self.log("Deleting '%s'" % prefixed_path, level=1)
+                self.delete_target(prefixed_path)
+                # Precompressed copies too. Hashed copies are kept: pages
+                # served by the previous release may still refer to them.
+                for suffix in ('.gz', '.br'):
+                    if self.target_exists(prefixed_path + suffix):
+                        self.delete_target(prefixed_path + suffix)
+
+        if self.post_process and hasattr(self.storage, 'post_process'):
+            patterns = getattr(self.storage, '_patterns', {}).keys()
+            if modified_files and patterns:
+                # A changed file changes the content of the files referring
+                # to it, so those are always processed again.
+                for prefixed_path, source in found_files.items():
+                    if matches_patterns(prefixed_path, patterns):
+                        modified_files.setdefault(prefixed_path, source)
+            if modified_files:
+                processor = self.storage.post_process(modified_files,
+                                                      dry_run=self.dry_run)
+                for original_path, processed_path, processed in processor:
+                    if processed:
+                        self.log("Post-processed '%s' as '%s'" %
+                                 (original_path, processed_path), level=1)
+                        self.post_processed_files.append(original_path)
+
+        self.save_manifest(entries)
+        return {
+            'modified': self.copied_files + self.symlinked_files,
+            'unmodified': self.unmodified_files,
+            'post_processed': self.post_processed_files,
+        }
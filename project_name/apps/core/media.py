@@ -0,0 +1,72 @@
+"""
+Protected media: Django decides who may download a file, nginx sends it.
+
+Files saved with :data:`protected_storage` land in ``PROTECTED_MEDIA_ROOT``,
+which nginx doesn't serve publicly. Their URLs point to the
+``protected_media`` view, which asks ``PROTECTED_MEDIA_CHECK`` (the dotted
+path of a ``check(request, path)`` function) whether the request may have the
+file. When ``PROTECTED_MEDIA_ACCEL_URL`` is set the view answers with an empty
+response carrying ``X-Accel-Redirect`` and nginx sends the file from its
+``internal`` location of that URL; workers never read a byte of it. Otherwise
+(``runserver``) the view streams the file itself.
+"""
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.http import Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlquote
+from django.utils.importlib import import_module
+from django.views.static import serve
+
+protected_storage = FileSystemStorage(
+    location=settings.PROTECTED_MEDIA_ROOT,
+    base_url=settings.PROTECTED_MEDIA_URL)
+
+_check = None
+
+
+def user_is_authenticated(request, path):
+    """The default ``PROTECTED_MEDIA_CHECK``: any logged in user."""
+    return request.user.is_authenticated()
+
+
+def get_check():
+    global _check
+    if _check is None:
+        module, name = settings.PROTECTED_MEDIA_CHECK.rsplit('.', 1)
+        try:
+            _check = getattr(import_module(module), name)
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured(
+                "Can't import PROTECTED_MEDIA_CHECK %r: %s"
+                % (settings.PROTECTED_MEDIA_CHECK, e))
+    return _check
+
+
+def send_file(request, path):
+    """Return a response sending ``path`` of ``PROTECTED_MEDIA_ROOT``."""
+    try:
+        full_path = safe_join(settings.PROTECTED_MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404
+    accel_url = settings.PROTECTED_MEDIA_ACCEL_URL
+    if not accel_url:
+        response = serve(request, path,
+                         document_root=settings.PROTECTED_MEDIA_ROOT)
+    else:
+        if not os.path.isfile(full_path):
+            raise Http404
+        content_type = mimetypes.guess_type(full_path)[0]
+        response = HttpResponse(
+            content_type=content_type or 'application/octet-stream')
+        relative = os.path.relpath(full_path, settings.PROTECTED_MEDIA_ROOT)
+        response['X-Accel-Redirect'] = urlquote(
+            accel_url + relative.replace(os.sep, '/'))
+    # Proxies must not hand the file to someone else.
+    patch_cache_control(response, private=True)
+    return response
@@ -0,0 +1,313 @@
+"""
+Per-view request metrics aggregated across gunicorn workers.
+
+Each process keeps fixed-bucket histograms and counters (see ``COUNTERS``)
+in memory, and a thread of its own writes a snapshot to
+``METRICS_DIR/<pid>.json`` every ``METRICS_FLUSH_INTERVAL`` seconds (gunicorn's
+``worker_exit`` writes the last one): requests never wait for the disk. Forked
+processes must call ``registry.reset()`` (gunicorn's ``post_fork`` does) not
+to report their parent's counts. :func:`collect` sums the snapshots of every
+worker; those of dead workers are folded into ``archive.json`` so that
+counters never go backwards and the directory doesn't grow with every worker
+restart.
+"""
+import atexit
+import errno
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Name, help and upper bounds of the buckets of each histogram, in the order
+# Registry.observe() takes their values. The last bucket is +Inf.
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Time spent handling the request.',
+     (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    ('db_duration_seconds', 'Time spent in database queries during the request.',
+     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)),
+    ('db_queries', 'Number of database queries made by the request.',
+     (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)),
+    ('response_size_bytes', 'Size of the response body.',
+     (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+)
+
+BUCKETS = tuple(buckets for _, _, buckets in HISTOGRAMS)
+(_DURATION_BUCKETS, _DB_DURATION_BUCKETS, _QUERIES_BUCKETS,
+ _SIZE_BUCKETS) = BUCKETS
+
+# Name, help and label of the counters, see Registry.count().
+COUNTERS = (
+    ('cache_hits_total', 'Cache lookups answered, per tier.', 'tier'),
+    ('cache_misses_total', 'Cache lookups not answered, per tier.', 'tier'),
+    ('db_alias_queries_total', 'Database queries run, per alias.', 'alias'),
+    ('db_alias_writes_total', 'Database queries other than SELECT run, per '
+     'alias.', 'alias'),
+    ('db_replica_dropped_total', 'Times a worker stopped reading from a '
+     'replica, lagging or unreachable.', 'alias'),
+)
+
+ARCHIVE = 'archive.json'
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR',
+                   os.path.join(settings.VAR_ROOT, 'metrics'))
+
+
+class Registry(object):
+    """The histograms of the current process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+        self.reset()
+
+    def reset(self):
+        """Start over, e.g. in a freshly forked worker."""
+        self.pid = os.getpid()
+        # {view: [[bucket counts..., sum, count] for each histogram]}
+        self.series = {}
+        # {counter: {label value: count}}
+        self.counters = {}
+        # Started by the first request of the process.
+        self.flusher = None
+
+    def observe(self, view, duration, db_duration, queries, size):
+        """Record the values of a request to ``view``, see ``HISTOGRAMS``.
+
+        Called on every request: only counts, in memory.
+        """
+        if self.flusher is None:
+            self.start_flusher()
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [
+                    [0] * (len(buckets) + 3) for buckets in BUCKETS]
+            # Unrolled, this is the cost every request pays.
+            histogram = series[0]
+            histogram[bisect_left(_DURATION_BUCKETS, duration)] += 1
+            histogram[-2] += duration
+            histogram[-1] += 1
+            histogram = series[1]
+            histogram[bisect_left(_DB_DURATION_BUCKETS, db_duration)] += 1
+            histogram[-2] += db_duration
+            histogram[-1] += 1
+            histogram = series[2]
+            histogram[bisect_left(_QUERIES_BUCKETS, queries)] += 1
+            histogram[-2] += queries
+            histogram[-1] += 1
+            histogram = series[3]
+            histogram[bisect_left(_SIZE_BUCKETS, size)] += 1
+            histogram[-2] += size
+            histogram[-1] += 1
+
+    def start_flusher(self):
+        """Write the snapshots from a thread, every ``flush_interval``."""
+        self.flusher = threading.Thread(target=self._flush_periodically,
+                                        name='metrics-flush')
+        self.flusher.daemon = True
+        self.flusher.start()
+        # Stop it before the interpreter is torn down under its feet.
+        atexit.register(self.stop_flusher)
+
+    def stop_flusher(self):
+        self.flusher = None
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            # Stopped, or reset() let another thread take over.
+            if self.flusher is not threading.current_thread():
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Can't write the metrics snapshot.")
+
+    def count(self, name, key, value=1):
+        """Add ``value`` to the counter ``name`` (see ``COUNTERS``) of
+        ``key``."""
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = {}
+            counter[key] = counter.get(key, 0) + value
+
+    def histograms(self):
+        """Return the histograms as ``{metric: {view: series}}``."""
+        with self.lock:
+            return dict((name, dict((view, series[i][:]) for view, series
+                                    in self.series.items()))
+                        for i, (name, _, _) in enumerate(HISTOGRAMS))
+
+    def flush(self, gauges=None):
+        """Write the snapshot of this process for :func:`collect`."""
+        with self.lock:
+            counters = dict((name, dict(values))
+                            for name, values in self.counters.items())
+        snapshot = json.dumps({'histograms': self.histograms(),
+                               'counters': counters,
+                               'gauges': gauges or process_gauges()})
+        directory = metrics_dir()
+        path = os.path.join(directory, '%d.json' % self.pid)
+        try:
+            _write(path, snapshot)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            _makedirs(directory)
+            _write(path, snapshot)
+
+
+registry = Registry()
+
+
+def process_gauges():
+    """Gauges of the current process, e.g. its database pools."""
+    from {{ project_name }}.apps.core.db.pool import pool_stats
+    gauges = {}
+    for alias, stats in pool_stats().items():
+        for name in ('open', 'idle', 'in_use', 'waits', 'wait_time'):
+            gauges.setdefault('db_pool_' + name, {})[alias] = stats[name]
+    return gauges
+
+
+def collect():
+    """Return the histograms and gauges summed over every worker.
+
+    Returns ``(histograms, counters, gauges)`` with the same layout as the
+    snapshots.
+    """
+    directory = metrics_dir()
+    _makedirs(directory)
+    histograms = dict((name, {}) for name, _, _ in HISTOGRAMS)
+    counters = {}
+    gauges = {}
+    with open(os.path.join(directory, ARCHIVE + '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = _read(os.path.join(directory, ARCHIVE)) or {}
+        archived = False
+        for filename in os.listdir(directory):
+            pid = filename[:-len('.json')]
+            if not filename.endswith('.json') or not pid.isdigit():
+                continue
+            path = os.path.join(directory, filename)
+            snapshot = _read(path)
+            if snapshot is None:
+                continue
+            if _is_alive(int(pid)):
+                _add(histograms, snapshot['histograms'])
+                _add(counters, snapshot.get('counters', {}))
+                for name, values in snapshot['gauges'].items():
+                    _add(gauges.setdefault(name, {}), values)
+            else:
+                _add(archive.setdefault('histograms', {}),
+                     snapshot['histograms'])
+                _add(archive.setdefault('counters', {}),
+                     snapshot.get('counters', {}))
+                os.remove(path)
+                archived = True
+        if archived:
+            _write(os.path.join(directory, ARCHIVE), json.dumps(archive))
+    _add(histograms, archive.get('histograms', {}))
+    _add(counters, archive.get('counters', {}))
+    return histograms, counters, gauges
+
+
+def render(histograms, counters, gauges, prefix='django_', labels=None):
+    """Render metrics in the Prometheus text exposition format.
+
+    The values of the gauges are labelled ``alias`` unless ``labels`` maps
+    their name to another label.
+    """
+    labels = labels or {}
+    lines = []
+    for name, help_text, buckets in HISTOGRAMS:
+        metric = prefix + name
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s histogram' % metric)
+        for view, series in sorted(histograms.get(name, {}).items()):
+            label = 'view="%s"' % _escape(view)
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(_sample(metric + '_bucket',
+                                     '%s,le="%s"' % (label, bound), cumulative))
+            lines.append(_sample(metric + '_sum', label, series[-2]))
+            lines.append(_sample(metric + '_count', label, series[-1]))
+    for name, help_text, label in COUNTERS:
+        metric = prefix + name
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s counter' % metric)
+        for key, value in sorted(counters.get(name, {}).items()):
+            lines.append(_sample(metric, '%s="%s"' % (label, _escape(key)),
+                                 value))
+    for name, values in sorted(gauges.items()):
+        metric = prefix + name
+        lines.append('# TYPE %s gauge' % metric)
+        label = labels.get(name, 'alias')
+        for key, value in sorted(values.items()):
+            lines.append(_sample(metric, '%s="%s"' % (label, _escape(key)),
+                                 value))
+    return '\n'.join(lines) + '\n'
+
+
+def _sample(metric, labels, value):
+    value = repr(value) if isinstance(value, float) else str(value)
+    return ''.join((metric, '{', labels, '} ', value))
+
+
+def _add(total, other):
+    """Sum nested dicts of numbers or lists of numbers into ``total``."""
+    for key, value in other.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            current = total.setdefault(key, [0] * len(value))
+            for i, item in enumerate(value):
+                current[i] += item
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _write(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
@@ -0,0 +1,79 @@
+"""Middleware of the core app."""
+import threading
+import time
+
+from django.db import connections
+
+from {{ project_name }}.apps.core import metrics
+from {{ project_name }}.apps.core.accesslog import VIEW_KEY
+from {{ project_name }}.apps.core.db import instrument
+
+
+def view_name(request):
+    """Return the name of the URL pattern ``request`` resolved to.
+
+    Falls back to the dotted path of the view for unnamed patterns and to
+    ``'<unresolved>'`` when the request didn't resolve (e.g. a 404).
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    if match.url_name:
+        return match.view_name
+    func = getattr(match.func, 'func', match.func)  # functools.partial
+    return '%s.%s' % (func.__module__, getattr(func, '__name__', 'view'))
+
+
+class _QueryStats(threading.local):
+    instrumented = False
+    duration = 0.0
+    count = 0
+
+_query_stats = _QueryStats()
+
+
+def _count_query(alias, sql, duration):
+    _query_stats.duration += duration
+    _query_stats.count += 1
+
+
+class MetricsMiddleware(object):
+    """Record the time, database time, query count and response size of every
+    request, per URL name, in :mod:`{{ project_name }}.apps.core.metrics`.
+
+    The URL name is also left in the WSGI environ for the access log, see
+    :mod:`{{ project_name }}.apps.core.accesslog`.
+
+    It should come first in ``MIDDLEWARE_CLASSES`` to time the others too.
+    """
+
+    def __init__(self):
+        instrument.add_observer(_count_query)
+
+    def process_request(self, request):
+        if not _query_stats.instrumented:
+            # Connection wrappers are per thread and live as long as it.
+            for connection in connections.all():
+                instrument.install(connection)
+            _query_stats.instrumented = True
+        _query_stats.duration = 0.0
+        _query_stats.count = 0
+        request._metrics_start = time.time()
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is None:
+            # An earlier middleware answered before process_request.
+            return response
+        if response.has_header('Content-Length') or response.streaming:
+            size = int(response.get('Content-Length', 0))
+        else:
+            # response.content would join (and copy) the whole body.
+            size = sum(len(chunk) for chunk in response._container)
+        view = view_name(request)
+        metrics.registry.observe(view, time.time() - start,
+                                 _query_stats.duration, _query_stats.count,
+                                 size)
+        # For the access log (request.META is the WSGI environ).
+        request.META[VIEW_KEY] = view
+        return response
@@ -0,0 +1,5 @@
+"""Models for the core app.
+
+The app has no models of its own, Django just needs this module to consider
+it an installed application.
+"""
@@ -0,0 +1,212 @@
+"""
+Detection of N+1 queries: the same query run again and again, with other
+parameters, from the same place (typically a loop following a foreign key,
+e.g. a changelist with a related field in ``list_display``).
+
+While a :class:`QueryTracker` is active, every query of the thread is
+reduced to its shape (literals replaced by ``?``) and counted per call site:
+the first frame outside the database layer, and the innermost frame of the
+project when it isn't that one. Shapes counted more than ``threshold`` times
+from one site are reported.
+
+:class:`NPlusOneMiddleware` tracks a sample of the requests
+(``NPLUSONE_SAMPLE_RATE``, 0 turns it off) and logs what it finds, or raises
+:class:`NPlusOneError` when ``NPLUSONE_RAISE`` is on (the default under
+``manage.py test``). In tests, :func:`detect_n_plus_one` checks a block::
+
+    with detect_n_plus_one():
+        self.client.get(reverse('admin:auth_user_changelist'))
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.db import connections
+
+from {{ project_name }}.apps.core.db import instrument
+from {{ project_name }}.apps.core.middleware import view_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 5
+
+_strings = re.compile(r"'(?:[^']|'')*'")
+_numbers = re.compile(r'\b\d+(?:\.\d+)?\b')
+_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_spaces = re.compile(r'\s+')
+
+# Frames of these directories are never call sites (templates aren't code,
+# the frame that renders them is reported instead).
+_DATABASE_LAYER = (
+    os.path.join(os.path.dirname(django.__file__), 'db') + os.sep,
+    os.path.join(os.path.dirname(django.__file__), 'template') + os.sep,
+    os.path.dirname(instrument.__file__) + os.sep,
+    os.path.splitext(__file__)[0] + '.py',
+)
+
+
+def query_shape(sql):
+    """Return ``sql`` with its literals replaced, e.g. ``... WHERE id = ?``.
+
+    Parameters are usually passed separately, literals only show up in
+    queries built by hand.
+    """
+    sql = _strings.sub('?', sql)
+    sql = _numbers.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _lists.sub('(...)', sql)
+    return _spaces.sub(' ', sql).strip()
+
+
+def _location(frame):
+    path = frame.f_code.co_filename
+    if path.startswith(settings.PROJECT_DIR + os.sep):
+        path = os.path.relpath(path, settings.PROJECT_DIR)
+    return '%s:%d in %s' % (path, frame.f_lineno, frame.f_code.co_name)
+
+
+def call_site():
+    """Return where the current query comes from, see the module."""
+    frame = sys._getframe(1)
+    site = None
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if not path.startswith(_DATABASE_LAYER):
+            if site is None:
+                site = frame
+            if path.startswith(settings.PROJECT_DIR + os.sep):
+                if frame is site:
+                    return _location(site)
+                return '%s (from %s)' % (_location(site), _location(frame))
+        frame = frame.f_back
+    return _location(site) if site is not None else '<unknown>'
+
+
+class Finding(object):
+
+    def __init__(self, alias, shape, site, count):
+        self.alias = alias
+        self.shape = shape
+        self.site = site
+        self.count = count
+
+    def __str__(self):
+        return '%d x [%s] %s\n    at %s' % (self.count, self.alias,
+                                            self.shape, self.site)
+
+
+class NPlusOneError(AssertionError):
+    """Raised by tracked code that repeated a query, see the module."""
+
+
+class QueryTracker(object):
+    """Count the queries of the thread by shape and call site."""
+
+    def __init__(self, threshold=None):
+        if threshold is None:
+            threshold = getattr(settings, 'NPLUSONE_THRESHOLD',
+                                DEFAULT_THRESHOLD)
+        self.threshold = threshold
+        self.counts = {}
+
+    def observe(self, alias, sql):
+        key = (alias, query_shape(sql), call_site())
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def findings(self):
+        """Return the repeated queries, most repeated first."""
+        found = [Finding(alias, shape, site, count)
+                 for (alias, shape, site), count in self.counts.items()
+                 if count > self.threshold]
+        found.sort(key=lambda finding: -finding.count)
+        return found
+
+    def report(self, where, findings):
+        return '%d repeated queries in %s:\n%s' % (
+            len(findings), where,
+            '\n'.join(str(finding) for finding in findings))
+
+
+class _Trackers(threading.local):
+    def __init__(self):
+        self.active = []
+
+_trackers = _Trackers()
+
+
+def _observe(alias, sql, duration):
+    for tracker in _trackers.active:
+        tracker.observe(alias, sql)
+
+
+def start(threshold=None):
+    """Track the queries of the thread until :func:`stop`."""
+    instrument.add_observer(_observe)
+    # Connection wrappers are per thread; installing again is a no-op.
+    for connection in connections.all():
+        instrument.install(connection)
+    tracker = QueryTracker(threshold)
+    _trackers.active.append(tracker)
+    return tracker
+
+
+def stop(tracker):
+    if tracker in _trackers.active:
+        _trackers.active.remove(tracker)
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None, where='the block'):
+    """Raise :class:`NPlusOneError` when the block repeated a query more than
+    ``threshold`` times (``NPLUSONE_THRESHOLD`` by default).
+    """
+    tracker = start(threshold)
+    try:
+        yield tracker
+    finally:
+        stop(tracker)
+    findings = tracker.findings()
+    if findings:
+        raise NPlusOneError(tracker.report(where, findings))
+
+
+class NPlusOneMiddleware(object):
+    """Track a sample of the requests for repeated queries, see the module.
+
+    Put it early in ``MIDDLEWARE_CLASSES``: only the queries made after its
+    ``process_request`` are tracked.
+    """
+
+    def __init__(self):
+        self.sample_rate = getattr(settings, 'NPLUSONE_SAMPLE_RATE', 0)
+        self.fail = getattr(settings, 'NPLUSONE_RAISE', False)
+
+    def process_request(self, request):
+        if self.fail or random.random() < self.sample_rate:
+            request._nplusone_tracker = start()
+
+    def process_exception(self, request, exception):
+        tracker = getattr(request, '_nplusone_tracker', None)
+        if tracker is not None:
+            stop(tracker)
+            del request._nplusone_tracker
+
+    def process_response(self, request, response):
+        tracker = getattr(request, '_nplusone_tracker', None)
+        if tracker is None:
+            return response
+        stop(tracker)
+        findings = tracker.findings()
+        if findings:
+            report = tracker.report('%s (%s %s)' % (
+                view_name(request), request.method, request.path), findings)
+            if self.fail:
+                raise NPlusOneError(report)
+            logger.warning(report)
+        return response
@@ -0,0 +1,34 @@
+"""
+Find out the deployed git revision without spawning ``git``.
+
+Settings use it to version cache keys, so that a deploy invalidates the
+entries written by the previous code without flushing the cache.
+"""
+import os
+
+
+def get_revision(repo_dir, default='unknown'):
+    """Return the commit ``HEAD`` points to in the repository at ``repo_dir``.
+
+    Reads ``.git/HEAD`` and the ref it points to (loose or packed). Returns
+    ``default`` if it can't be found, e.g. outside a checkout.
+    """
+    git_dir = os.path.join(repo_dir, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head  # detached HEAD
+        ref = head[len('ref: '):]
+        ref_path = os.path.join(git_dir, *ref.split('/'))
+        if os.path.exists(ref_path):
+            with open(ref_path) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except IOError:
+        pass
+    return default
@@ -0,0 +1,174 @@
+"""
+Cached, database-backed sessions with coalesced expiry writes.
+
+Like ``django.contrib.sessions.backends.cached_db``, sessions are read from the
+cache and only fall back to the database on a miss, and every change of their
+data is written to both. What is coalesced are the saves which only push the
+expiry back (``SESSION_SAVE_EVERY_REQUEST``): those reach the database at most
+once every ``SESSION_DB_WRITE_INTERVAL`` seconds, one UPDATE per interval
+instead of one per request. Losing the cached entry then only loses some
+seconds of expiry.
+
+The cache is the one named by ``SESSION_STORE_CACHE``, which must be shared by
+every process of every host and not evict: a local or file-based cache would
+serve other hosts' sessions stale, so it raises ``ImproperlyConfigured``
+unless ``SESSION_STORE_LOCAL_CACHE`` is on (runserver, and the tests, are a
+single process).
+
+Expired sessions are deleted by :func:`clear_expired` a bounded batch at a
+time (``manage.py prunesessions``, ``fab clearsessions``).
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+KEY_PREFIX = '{{ project_name }}.sessions.'
+
+# Caches each process (or host) has its own of.
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+    '{{ project_name }}.apps.core.cache.TieredCache',
+)
+
+_cache = None
+
+
+def session_cache():
+    """Return the ``SESSION_STORE_CACHE`` cache, checking it's shared."""
+    global _cache
+    if _cache is None:
+        alias = getattr(settings, 'SESSION_STORE_CACHE', 'sessions')
+        if alias not in settings.CACHES:
+            raise ImproperlyConfigured(
+                "SESSION_STORE_CACHE %r isn't in CACHES." % alias)
+        backend = settings.CACHES[alias]['BACKEND']
+        if (backend in LOCAL_CACHES and
+                not getattr(settings, 'SESSION_STORE_LOCAL_CACHE', False)):
+            raise ImproperlyConfigured(
+                "The %r sessions cache is a %s: sessions need a cache shared "
+                "by every host which doesn't evict them, e.g. memcached." % (
+                    alias, backend.rsplit('.', 1)[-1]))
+        _cache = get_cache(alias)
+    return _cache
+
+
+class SessionStore(DBStore):
+
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(session_key)
+        self._cache = session_cache()
+        # When this session was last written to the database, as far as we
+        # know.
+        self._db_saved = None
+
+    @property
+    def cache_key(self):
+        return KEY_PREFIX + self._get_or_create_session_key()
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys. If this happens, reset the session.
+            entry = None
+        if entry is not None:
+            data, self._db_saved = entry
+            return data
+        try:
+            s = Session.objects.get(session_key=self.session_key,
+                                    expire_date__gt=timezone.now())
+            data = self.decode(s.session_data)
+        except (Session.DoesNotExist, SuspiciousOperation):
+            self.create()
+            return {}
+        self._db_saved = time.time()
+        self._cache.set(self.cache_key, (data, self._db_saved),
+                        self.get_expiry_age(expiry=s.expire_date))
+        return data
+
+    def exists(self, session_key):
+        if (KEY_PREFIX + session_key) in self._cache:
+            return True
+        return super(SessionStore, self).exists(session_key)
+
+    def save(self, must_create=False):
+        now = time.time()
+        interval = getattr(settings, 'SESSION_DB_WRITE_INTERVAL', 60)
+        # Changed data (new sessions, logins, ...) is written through; only
+        # the saves pushing the expiry back wait for the interval.
+        if (must_create or self.modified or self._db_saved is None or
+                now - self._db_saved >= interval):
+            super(SessionStore, self).save(must_create)
+            self._db_saved = now
+        self._cache.set(self.cache_key,
+                        (self._get_session(no_load=must_create),
+                         self._db_saved),
+                        self.get_expiry_age())
+
+    def delete(self, session_key=None):
+        super(SessionStore, self).delete(session_key)
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(KEY_PREFIX + session_key)
+
+    def flush(self):
+        self.clear()
+        self.delete(self.session_key)
+        self.create()
+
+    @classmethod
+    def clear_expired(cls):
+        clear_expired()
+
+
+def clear_expired(batch_size=1000, pause=0.1):
+    """Delete the expired sessions of the database, ``batch_size`` at a time.
+
+    Each batch is its own short transaction, locking only the rows it
+    deletes; ``pause`` seconds between them let other writers (and
+    replication) keep up. Returns the number of sessions deleted.
+    """
+    using = router.db_for_write(Session)
+    sessions = Session.objects.using(using)
+    deleted = 0
+    while True:
+        now = timezone.now()
+        keys = list(sessions.filter(expire_date__lt=now)
+                    .values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            break
+        deleted += _delete_expired(using, keys, now)
+        transaction.commit_unless_managed(using=using)
+        if len(keys) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+
+def _delete_expired(using, keys, now):
+    """Delete the sessions ``keys`` still expired at ``now`` (one may have been
+    extended since it was selected). Returns the number deleted.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    expire_date = Session._meta.get_field('expire_date')
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s) AND %s < %%s' % (
+        qn(Session._meta.db_table), qn(Session._meta.pk.column),
+        ', '.join(['%s'] * len(keys)), qn(expire_date.column)),
+        list(keys) + [expire_date.get_db_prep_value(now, connection)])
+    return cursor.rowcount
+
+
+# At bottom to avoid circular import
+from django.contrib.sessions.models import Session
@@ -0,0 +1,181 @@
+"""
+Static files storage with content-hashed names, a manifest and precompressed
+siblings.
+
+Like Django's ``CachedStaticFilesStorage``, post-processing saves a copy of
+every file as ``name.<hash>.ext`` and rewrites the references inside CSS files
+to those copies. The mapping is kept in ``STATIC_ROOT/manifest.json`` rather
+than in a cache: every process loads it once, lookups never touch the cache
+and deploying a new revision can't be mixed up with an old one's names.
+
+Text files are also saved gzipped (and brotli compressed when the ``brotli``
+package is installed) next to the original, for nginx's ``gzip_static``.
+Since a hashed name never changes content, it can be cached for a year.
+"""
+import gzip
+import json
+import logging
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (CachedFilesMixin,
+                                                StaticFilesStorage)
+from django.contrib.staticfiles.utils import matches_patterns
+from django.core.files.base import ContentFile
+from django.utils.encoding import force_bytes, force_text
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def gzip_compress(data):
+    buf = BytesIO()
+    # A fixed mtime keeps the output identical from one deploy to the next.
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+COMPRESSORS = [('.gz', gzip_compress)]
+if brotli is not None:
+    COMPRESSORS.append(('.br', brotli.compress))
+
+
+class ManifestStaticFilesStorage(CachedFilesMixin, StaticFilesStorage):
+    manifest_name = 'manifest.json'
+    compress_patterns = ('*.css', '*.js', '*.json', '*.map', '*.svg', '*.txt',
+                         '*.xml', '*.html', '*.ico', '*.eot', '*.otf', '*.ttf')
+    # Below this many bytes compression costs more than it saves.
+    compress_min_size = 256
+
+    def __init__(self, *args, **kwargs):
+        super(ManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        # CachedFilesMixin keeps name -> hashed name in self.cache, by
+        # cache_key(name): a dict with the cache methods it uses does.
+        self.cache = Manifest(self.load_manifest())
+        # Only while post-processing: the CSS files still to process, and
+        # what was done with each file.
+        self._pending = None
+        self._processed = {}
+
+    def cache_key(self, name):
+        return name
+
+    def load_manifest(self):
+        try:
+            with self.open(self.manifest_name) as f:
+                manifest = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest['paths']
+
+    def save_manifest(self):
+        content = json.dumps({'version': MANIFEST_VERSION,
+                              'paths': self.cache}, indent=0, sort_keys=True,
+                             separators=(',', ': '))
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        self._save(self.manifest_name, ContentFile(force_bytes(content)))
+
+    def url(self, name, force=False):
+        if self._pending is not None:
+            # While post-processing, a CSS file must be processed before
+            # another one can refer to its hashed name.
+            pending = self._pending.pop(name.split('?')[0].split('#')[0], None)
+            if pending is not None:
+                self._process(*pending)
+        try:
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        except ValueError:
+            if self._pending is not None:
+                raise
+            # Not collected (yet), e.g. when running the tests: a broken page
+            # would be worse than an unversioned URL.
+            logger.warning("Static file %r isn't collected.", name)
+            return super(CachedFilesMixin, self).url(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        """Save hashed (and compressed) copies of ``paths``.
+
+        ``paths`` maps names to ``(storage, path)`` like in ``collectstatic``.
+        CSS files referring to a file of ``paths`` must be part of it too:
+        their content, thus their hash, depends on its hashed name.
+        """
+        if dry_run:
+            return
+        for name in paths:
+            # Computed again from the new content.
+            self.cache.pop(name.replace('\\', '/'), None)
+        adjustable = [name for name in paths
+                      if matches_patterns(name, self._patterns.keys())]
+        self._pending = dict((name, (name, paths[name], True))
+                             for name in adjustable)
+        self._processed = {}
+        try:
+            for name in sorted(paths):
+                if name not in self._processed:
+                    self._pending.pop(name, None)
+                    self._process(name, paths[name], name in adjustable)
+                hashed_name, processed = self._processed[name]
+                yield name, hashed_name, processed
+        finally:
+            self._pending = None
+        self.save_manifest()
+
+    def _process(self, name, source, adjustable):
+        storage, path = source
+        with storage.open(path) as original:
+            if adjustable:
+                content = original.read().decode(settings.FILE_CHARSET)
+                for patterns in self._patterns.values():
+                    for pattern, template in patterns:
+                        converter = self.url_converter(name, template)
+                        content = pattern.sub(converter, content)
+                # Hash the rewritten content: it changes when a file it
+                # refers to does.
+                original = ContentFile(force_bytes(content))
+            hashed_name = self.hashed_name(name, original)
+            processed = not self.exists(hashed_name)
+            if processed:
+                original.seek(0)
+                hashed_name = self._save(hashed_name, original)
+                self.compress(hashed_name)
+        hashed_name = force_text(hashed_name).replace('\\', '/')
+        self.compress(name)
+        self.cache[name.replace('\\', '/')] = hashed_name
+        self._processed[name] = (hashed_name, processed)
+
+    def compress(self, name):
+        """Save compressed copies of ``name`` next to it, if worth it."""
+        if not matches_patterns(name, self.compress_patterns):
+            return
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < self.compress_min_size:
+            return
+        for suffix, compress in COMPRESSORS:
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+
+class Manifest(dict):
+    """The subset of the cache API used by CachedFilesMixin."""
+
+    def set(self, key, value):
+        self[key] = value
+
+    def set_many(self, data):
+        self.update(data)
@@ -0,0 +1,790 @@
+"""
+Tests of the core app.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles import storage as staticfiles
+from django.core import mail
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.functional import empty
+
+from {{ project_name }}.apps.core import cache as tiered
+from {{ project_name }}.apps.core import log, metrics, nplusone, sessions
+from {{ project_name }}.apps.core.db import pool, router
+from {{ project_name }}.apps.core.management.commands import (perfcheck,
+                                                             updatestatic)
+from {{ project_name }}.apps.core.metrics import registry
+from {{ project_name }}.apps.core.nplusone import detect_n_plus_one
+from {{ project_name }}.apps.core.storage import ManifestStaticFilesStorage
+
+CSS = 'body { background: url("../img/bg.png"); }\n' + '/* padding */\n' * 30
+
+
+class StaticFilesTest(TestCase):
+    """Collects ``css/site.css`` and ``img/bg.png`` from a temporary
+    directory into another."""
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.var = tempfile.mkdtemp()
+        self.write('css/site.css', CSS)
+        self.write('img/bg.png', 'png')
+        self.override = override_settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_DIRS=(self.source,),
+            STATICFILES_FINDERS=(
+                'django.contrib.staticfiles.finders.FileSystemFinder',),
+            STATICFILES_STORAGE=
+                '{{ project_name }}.apps.core.storage.ManifestStaticFilesStorage',
+            STATICFILES_MANIFEST=os.path.join(self.var, 'staticfiles.json'))
+        self.override.enable()
+        self.reset()
+
+    def tearDown(self):
+        self.override.disable()
+        self.reset()
+        for path in (self.source, self.root, self.var):
+            shutil.rmtree(path)
+
+    def reset(self):
+        # Both are built once from the settings.
+        finders._finders.clear()
+        staticfiles.staticfiles_storage._wrapped = empty
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.source, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def read(self, name):
+        with open(os.path.join(self.root, name)) as f:
+            return f.read()
+
+    def collect(self):
+        self.reset()
+        command = updatestatic.Command()
+        command.set_options(interactive=False, verbosity=0, link=False,
+                            clear=False, dry_run=False, ignore_patterns=[],
+                            use_default_ignore_patterns=True,
+                            post_process=True)
+        return command.collect()
+
+    def test_hashed_names(self):
+        self.collect()
+        storage = ManifestStaticFilesStorage()
+        css, png = storage.url('css/site.css'), storage.url('img/bg.png')
+        self.assertRegexpMatches(css, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        self.assertRegexpMatches(png, r'^/static/img/bg\.[0-9a-f]{12}\.png$')
+        hashed_css = css[len('/static/'):]
+        self.assertIn(os.path.basename(png), self.read(hashed_css))
+        # Compressed copies of text files only.
+        self.assertTrue(os.path.exists(os.path.join(self.root,
+                                                    hashed_css + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.root,
+                                                     'img/bg.png.gz')))
+
+    def test_uncollected_file(self):
+        self.assertEqual(ManifestStaticFilesStorage().url('img/new.png'),
+                         '/static/img/new.png')
+
+    def test_unchanged_files_are_skipped(self):
+        first = self.collect()
+        self.assertEqual(sorted(first['modified']),
+                         ['css/site.css', 'img/bg.png'])
+        second = self.collect()
+        self.assertEqual(second['modified'], [])
+        self.assertEqual(sorted(second['unmodified']),
+                         ['css/site.css', 'img/bg.png'])
+
+    def test_touched_file_is_skipped(self):
+        self.collect()
+        self.write('img/bg.png', 'png', mtime=1)
+        self.assertEqual(self.collect()['modified'], [])
+
+    def test_changed_file_updates_the_css_referring_to_it(self):
+        self.collect()
+        old_png = ManifestStaticFilesStorage().url('img/bg.png')
+        self.write('img/bg.png', 'a new png', mtime=1)
+        result = self.collect()
+        self.assertEqual(result['modified'], ['img/bg.png'])
+        self.assertIn('css/site.css', result['post_processed'])
+        storage = ManifestStaticFilesStorage()
+        new_png = storage.url('img/bg.png')
+        self.assertNotEqual(new_png, old_png)
+        css = self.read(storage.url('css/site.css')[len('/static/'):])
+        self.assertIn(os.path.basename(new_png), css)
+
+    def test_removed_file_is_deleted(self):
+        self.collect()
+        os.remove(os.path.join(self.source, 'img/bg.png'))
+        self.write('css/site.css', 'body {}', mtime=1)
+        self.collect()
+        self.assertFalse(os.path.exists(os.path.join(self.root,
+                                                     'img/bg.png')))
+
+
+def counted(name, key):
+    """The value of a counter of this process's metrics."""
+    return registry.counters.get(name, {}).get(key, 0)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-tests',
+    },
+    'tiered': {
+        'BACKEND': '{{ project_name }}.apps.core.cache.TieredCache',
+        'OPTIONS': {'SHARED_CACHE': 'shared', 'MAX_ENTRIES': 2},
+    },
+})
+class TieredCacheTest(TestCase):
+
+    def setUp(self):
+        tiered._tiers.clear()
+        self.shared = get_cache('shared')
+        self.shared.clear()
+        self.cache = get_cache('tiered')
+
+    def assertCounted(self, name, tier, expected, before):
+        self.assertEqual(counted(name, tier) - before[(name, tier)], expected)
+
+    def counts(self):
+        return dict(((name, tier), counted(name, tier))
+                    for name in ('cache_hits_total', 'cache_misses_total')
+                    for tier in ('local', 'shared'))
+
+    def test_set_fills_both_tiers(self):
+        before = self.counts()
+        self.cache.set('key', 'value')
+        self.assertEqual(self.shared.get('key'), 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertCounted('cache_hits_total', 'local', 1, before)
+        self.assertCounted('cache_misses_total', 'local', 0, before)
+
+    def test_shared_hit_fills_the_local_tier(self):
+        self.shared.set('key', 'value')
+        before = self.counts()
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertCounted('cache_misses_total', 'local', 1, before)
+        self.assertCounted('cache_hits_total', 'shared', 1, before)
+        self.shared.delete('key')
+        # Served from the process until LOCAL_TIMEOUT.
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertCounted('cache_hits_total', 'local', 1, before)
+
+    def test_miss(self):
+        before = self.counts()
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.assertCounted('cache_misses_total', 'local', 1, before)
+        self.assertCounted('cache_misses_total', 'shared', 1, before)
+
+    def test_local_tier_is_shared_by_the_process(self):
+        self.cache.set('key', 'value')
+        self.shared.delete('key')
+        self.assertEqual(get_cache('tiered').get('key'), 'value')
+
+    def test_values_are_copies(self):
+        value = ['a']
+        self.cache.set('key', value)
+        value.append('b')
+        self.cache.get('key').append('c')
+        self.assertEqual(self.cache.get('key'), ['a'])
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.shared.clear()
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'c': 3})
+
+    def test_delete(self):
+        self.cache.set('key', 'value')
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertIsNone(self.shared.get('key'))
+
+    def test_incr_is_never_answered_locally(self):
+        self.cache.set('counter', 1)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+
+
+class FakeConnection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+
+    def make_pool(self, max_size=2, max_age=600, max_uses=1000, timeout=0.01,
+                  check_interval=30, is_usable=None):
+        return pool.ConnectionPool(max_size, max_age, max_uses, timeout,
+                                   check_interval, is_usable)
+
+    def connect(self, connection_pool):
+        self.assertIsNone(connection_pool.acquire())
+        return connection_pool.register(FakeConnection())
+
+    def test_reuse(self):
+        connection_pool = self.make_pool()
+        pooled = self.connect(connection_pool)
+        connection_pool.release(pooled)
+        self.assertIs(connection_pool.acquire(), pooled)
+        self.assertEqual(pooled.uses, 2)
+        stats = connection_pool.stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['open'],
+                          stats['in_use']), (1, 1, 1, 1))
+
+    def test_timeout(self):
+        connection_pool = self.make_pool(max_size=1)
+        self.connect(connection_pool)
+        self.assertRaises(pool.PoolTimeout, connection_pool.acquire)
+        self.assertEqual(connection_pool.stats()['waits'], 1)
+
+    def test_cancel(self):
+        connection_pool = self.make_pool(max_size=1)
+        self.assertIsNone(connection_pool.acquire())
+        connection_pool.cancel()
+        self.assertIsNone(connection_pool.acquire())
+
+    def test_recycle(self):
+        connection_pool = self.make_pool(max_uses=1)
+        pooled = self.connect(connection_pool)
+        connection_pool.release(pooled)
+        self.assertTrue(pooled.raw.closed)
+        stats = connection_pool.stats()
+        self.assertEqual((stats['recycled'], stats['open']), (1, 0))
+
+    def test_failed_check(self):
+        connection_pool = self.make_pool(check_interval=-1,
+                                         is_usable=lambda raw: False)
+        pooled = self.connect(connection_pool)
+        connection_pool.release(pooled)
+        self.assertIsNone(connection_pool.acquire())
+        self.assertTrue(pooled.raw.closed)
+        self.assertEqual(connection_pool.stats()['failed_checks'], 1)
+
+    def test_parent_connections_are_left_open(self):
+        connection_pool = self.make_pool(max_size=1)
+        in_use = self.connect(connection_pool)
+        connection_pool._pid = -1  # as if forked
+        connection_pool.release(in_use)
+        self.assertFalse(in_use.raw.closed)
+        self.assertIn(in_use.raw, pool._abandoned)
+        self.assertIsNone(connection_pool.acquire())
+        self.assertEqual(connection_pool.stats()['idle'], 0)
+
+    def test_forked_pool_forgets_idle_connections(self):
+        connection_pool = self.make_pool()
+        pooled = self.connect(connection_pool)
+        connection_pool.release(pooled)
+        connection_pool._pid = -1  # as if forked
+        connection_pool.reset_after_fork()
+        self.assertFalse(pooled.raw.closed)
+        self.assertIn(pooled.raw, pool._abandoned)
+        self.assertEqual(connection_pool.stats()['open'], 0)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.registry.flusher = False  # no thread
+        self.directory = tempfile.mkdtemp()
+        self.override = override_settings(METRICS_DIR=self.directory)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_observe(self):
+        self.registry.observe('home', 0.02, 0.002, 3, 2000)
+        self.registry.observe('home', 20, 0, 0, 0)
+        duration = self.registry.histograms()['request_duration_seconds']
+        self.assertEqual(duration['home'],
+                         [0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 20.02, 2])
+        queries = self.registry.histograms()['db_queries']['home']
+        self.assertEqual(queries[-2:], [3, 2])
+
+    def test_render(self):
+        self.registry.observe('home', 0.02, 0.002, 3, 2000)
+        self.registry.count('cache_hits_total', 'local', 2)
+        text = metrics.render(self.registry.histograms(),
+                              self.registry.counters,
+                              {'db_pool_open': {'default': 1}})
+        lines = text.splitlines()
+        self.assertIn('django_request_duration_seconds_bucket'
+                      '{view="home",le="0.01"} 0', lines)
+        self.assertIn('django_request_duration_seconds_bucket'
+                      '{view="home",le="0.025"} 1', lines)
+        self.assertIn('django_request_duration_seconds_bucket'
+                      '{view="home",le="+Inf"} 1', lines)
+        self.assertIn('django_request_duration_seconds_count'
+                      '{view="home"} 1', lines)
+        self.assertIn('django_cache_hits_total{tier="local"} 2', lines)
+        self.assertIn('django_db_pool_open{alias="default"} 1', lines)
+        types = [line.split()[2] for line in lines
+                 if line.startswith('# TYPE')]
+        self.assertEqual(len(types), len(set(types)))
+        self.assertIn('django_cache_misses_total', types)
+
+    def test_render_escapes_labels(self):
+        self.registry.observe('say "hi"\\n', 0, 0, 0, 0)
+        text = metrics.render(self.registry.histograms(), {}, {})
+        self.assertIn('view="say \\"hi\\"\\\\n"', text)
+
+    def test_collect(self):
+        self.registry.observe('home', 0.02, 0.002, 3, 2000)
+        self.registry.count('cache_hits_total', 'local')
+        self.registry.flush(gauges={'db_pool_open': {'default': 1}})
+        # A worker which exited since its last snapshot.
+        worker = subprocess.Popen(['true'])
+        worker.wait()
+        dead = os.path.join(self.directory, '%d.json' % worker.pid)
+        shutil.copy(os.path.join(self.directory, '%d.json' % os.getpid()),
+                    dead)
+
+        histograms, counters, gauges = metrics.collect()
+        self.assertEqual(histograms['db_queries']['home'][-1], 2)
+        self.assertEqual(counters['cache_hits_total'], {'local': 2})
+        # Only the live workers' gauges.
+        self.assertEqual(gauges, {'db_pool_open': {'default': 1}})
+        self.assertFalse(os.path.exists(dead))
+        with open(os.path.join(self.directory, metrics.ARCHIVE)) as f:
+            archive = json.load(f)
+        self.assertEqual(archive['counters'], {'cache_hits_total':
+                                               {'local': 1}})
+
+        # The archived counts are kept.
+        histograms, counters, gauges = metrics.collect()
+        self.assertEqual(counters['cache_hits_total'], {'local': 2})
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sessions-tests',
+        },
+    },
+    SESSION_STORE_CACHE='sessions', SESSION_STORE_LOCAL_CACHE=True,
+    SESSION_DB_WRITE_INTERVAL=60)
+class SessionStoreTest(TestCase):
+
+    def setUp(self):
+        sessions._cache = None
+        get_cache('sessions').clear()
+        self.session = sessions.SessionStore()
+        self.session['user'] = 1
+        self.session.save()
+
+    def tearDown(self):
+        sessions._cache = None
+
+    def in_database(self):
+        return Session.objects.filter(
+            session_key=self.session.session_key).exists()
+
+    def reload(self):
+        session = sessions.SessionStore(self.session.session_key)
+        self.assertEqual(session['user'], 1)
+        return session
+
+    def test_new_session_is_written_through(self):
+        self.assertTrue(self.in_database())
+
+    def test_unchanged_session_waits_for_the_interval(self):
+        session = self.reload()
+        Session.objects.all().delete()
+        session.save()
+        self.assertFalse(self.in_database())
+        session._db_saved -= 60
+        session.save()
+        self.assertTrue(self.in_database())
+
+    def test_changed_session_is_written_through(self):
+        session = self.reload()
+        session['user'] = 2
+        session.save()
+        stored = Session.objects.get(session_key=session.session_key)
+        self.assertEqual(stored.get_decoded(), {'user': 2})
+
+    def test_load_from_the_database(self):
+        get_cache('sessions').clear()
+        self.reload()
+
+    def test_delete(self):
+        self.session.delete()
+        self.assertFalse(self.in_database())
+        self.assertFalse(self.session.exists(self.session.session_key))
+
+    def test_clear_expired(self):
+        # Some of Django's tests leave theirs.
+        Session.objects.exclude(session_key=self.session.session_key).delete()
+        expired = timezone.now() - timedelta(seconds=1)
+        for i in range(5):
+            Session.objects.create(session_key='expired%d' % i,
+                                   session_data='', expire_date=expired)
+        self.assertEqual(sessions.clear_expired(batch_size=2, pause=0), 5)
+        self.assertEqual(list(Session.objects.values_list('session_key',
+                                                          flat=True)),
+                         [self.session.session_key])
+
+    @override_settings(SESSION_STORE_LOCAL_CACHE=False)
+    def test_local_cache(self):
+        sessions._cache = None
+        self.assertRaises(ImproperlyConfigured, sessions.session_cache)
+
+    @override_settings(SESSION_STORE_CACHE='missing')
+    def test_missing_cache(self):
+        sessions._cache = None
+        self.assertRaises(ImproperlyConfigured, sessions.session_cache)
+
+
+def make_record(msg='Boom %s', args=(1,), exc_info=None, lineno=10):
+    return logging.LogRecord('{{ project_name }}.tests', logging.ERROR,
+                             __file__, lineno, msg, args, exc_info)
+
+
+def failure(exception):
+    try:
+        raise exception
+    except Exception:
+        return sys.exc_info()
+
+
+@override_settings(ADMINS=(('Admin', 'admin@example.com'),),
+                   EMAIL_SUBJECT_PREFIX='')
+class ErrorEmailTest(TestCase):
+
+    def setUp(self):
+        self.handler = log.QueuedAdminEmailHandler(window=60)
+        self.addCleanup(self.handler.close)
+
+    def test_fingerprint(self):
+        key = log.fingerprint(make_record())
+        self.assertEqual(log.fingerprint(make_record(args=(2,))), key)
+        self.assertNotEqual(log.fingerprint(make_record('Bang %s')), key)
+        error = log.fingerprint(make_record(exc_info=failure(ValueError())))
+        self.assertNotEqual(error, key)
+        self.assertEqual(
+            log.fingerprint(make_record(exc_info=failure(ValueError('x')))),
+            error)
+        self.assertNotEqual(
+            log.fingerprint(make_record(exc_info=failure(KeyError()))), error)
+
+    def test_single_record(self):
+        self.handler.emit(make_record())
+        self.handler.close()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'ERROR: Boom 1')
+
+    def test_digest(self):
+        for i in range(3):
+            self.handler.emit(make_record(args=(i,)))
+        self.handler.emit(make_record('Bang', ()))
+        self.handler.close()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject,
+                         '4 errors (2 distinct): ERROR: Boom 0')
+        self.assertIn('3 x ERROR: Boom 0', mail.outbox[0].body)
+        self.assertIn('1 x ERROR: Bang', mail.outbox[0].body)
+
+    def pend(self):
+        now = time.time()
+        self.handler._pending = {'key': [1, 'ERROR: Boom', '', now, now]}
+
+    def test_rate_limit(self):
+        self.handler.max_per_minute = 1
+        self.handler._start()  # idle: nothing else touches its state
+        self.pend()
+        self.assertTrue(self.handler._send_digest())
+        self.pend()
+        self.assertFalse(self.handler._send_digest())
+        self.assertTrue(self.handler._send_digest(force=True))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_dropped_records(self):
+        self.handler._start()
+        self.pend()
+        self.handler._dropped = 2
+        self.handler._send_digest()
+        self.assertIn('2 more records were dropped', mail.outbox[0].body)
+        self.assertEqual(self.handler._dropped, 0)
+
+
+MEMCACHED = {
+    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    'LOCATION': '127.0.0.1:11211',
+}
+
+
+# What perfcheck expects of a production site.
+@override_settings(
+    DEBUG=False, TEMPLATE_DEBUG=False,
+    TEMPLATE_LOADERS=(
+        ('django.template.loaders.cached.Loader', (
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        )),
+    ),
+    CACHES={
+        'default': {
+            'BACKEND': '{{ project_name }}.apps.core.cache.TieredCache',
+            'OPTIONS': {'SHARED_CACHE': 'shared'},
+        },
+        'shared': MEMCACHED,
+        'sessions': MEMCACHED,
+    },
+    SESSION_ENGINE='{{ project_name }}.apps.core.sessions',
+    SESSION_STORE_CACHE='sessions',
+    DATABASES={
+        'default': {'ENGINE': perfcheck.POOLED_ENGINES[0], 'NAME': 'db'},
+    },
+    DATABASE_REPLICAS=(), JOBS_EAGER=False,
+    LOGGING={'version': 1, 'loggers': {}})
+class PerfCheckTest(TestCase):
+
+    def findings(self):
+        return [finding for check in perfcheck.CHECKS for finding in check()]
+
+    def assertFinding(self, level, text):
+        for found_level, message in self.findings():
+            if found_level == level and text in message:
+                return
+        self.fail('No %s about %r in %r.' % (level, text, self.findings()))
+
+    def handle(self, strict=False):
+        perfcheck.Command().handle_noargs(verbosity=0, strict=strict)
+
+    def test_production(self):
+        self.assertEqual(self.findings(), [])
+        self.handle(strict=True)
+
+    @override_settings(DEBUG=True)
+    def test_debug(self):
+        self.assertFinding(perfcheck.ERROR, 'DEBUG is on')
+        self.assertRaises(CommandError, self.handle)
+
+    @override_settings(TEMPLATE_LOADERS=(
+        'django.template.loaders.filesystem.Loader',))
+    def test_templates(self):
+        self.assertFinding(perfcheck.ERROR, 'no cached loader')
+
+    def test_caches(self):
+        with override_settings(CACHES={'shared': MEMCACHED}):
+            self.assertFinding(perfcheck.ERROR, "no 'default' cache")
+        with override_settings(CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'OPTIONS': {'SHARED_CACHE': 'missing'},
+                },
+                'sessions': MEMCACHED}):
+            self.assertFinding(perfcheck.WARNING, "'default' cache is a "
+                                                  "LocMemCache")
+            self.assertFinding(perfcheck.ERROR, "reads through 'missing'")
+
+    @override_settings(SESSION_STORE_CACHE='default')
+    def test_local_sessions_cache(self):
+        self.assertFinding(perfcheck.ERROR, "sessions cache ('default')")
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_database_sessions(self):
+        self.assertFinding(perfcheck.WARNING, 'reads it from the database')
+
+    def test_databases(self):
+        with override_settings(DATABASES={
+                'default': {'ENGINE': 'django.db.backends.sqlite3'}}):
+            self.assertFinding(perfcheck.ERROR, 'SQLite')
+        with override_settings(DATABASES={'default': {
+                'ENGINE': 'django.db.backends.postgresql_psycopg2'}}):
+            self.assertFinding(perfcheck.ERROR, 'connects on every request')
+
+    @override_settings(DATABASE_REPLICAS=('replica',),
+                       DATABASE_PIN_SECONDS=5, DATABASE_REPLICA_MAX_LAG=5)
+    def test_replicas(self):
+        self.assertFinding(perfcheck.ERROR, "replica 'replica' isn't in")
+        self.assertFinding(perfcheck.WARNING, 'DATABASE_PIN_SECONDS')
+
+    @override_settings(JOBS_EAGER=True)
+    def test_warnings_fail_when_strict(self):
+        self.assertFinding(perfcheck.WARNING, 'JOBS_EAGER')
+        self.handle()
+        self.assertRaises(CommandError, self.handle, strict=True)
+
+    @override_settings(STATICFILES_STORAGE=
+                       'django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_static(self):
+        self.assertFinding(perfcheck.WARNING, "doesn't hash the names")
+
+    @override_settings(LOGGING={'version': 1, 'loggers': {
+        'django.db.backends': {'level': 'DEBUG'}}})
+    def test_logging(self):
+        self.assertFinding(perfcheck.WARNING, 'django.db.backends logger')
+
+
+class NPlusOneTest(TestCase):
+
+    def test_query_shape(self):
+        self.assertEqual(
+            nplusone.query_shape("SELECT *  FROM t WHERE id IN (1, 2, 3)\n"
+                                 " AND name = 'O''Brien' AND x = %s"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND x = ?')
+
+    def test_repeated_query(self):
+        def lookup(pks):
+            for pk in pks:
+                User.objects.filter(pk=pk).exists()
+        with detect_n_plus_one(threshold=3):
+            lookup(range(3))
+        with self.assertRaises(nplusone.NPlusOneError) as raised:
+            with detect_n_plus_one(threshold=3, where='lookup'):
+                lookup(range(4))
+        message = str(raised.exception)
+        self.assertIn('1 repeated queries in lookup', message)
+        self.assertIn('4 x [default] SELECT', message)
+        self.assertIn('in lookup', message)
+
+    def test_other_call_sites(self):
+        with detect_n_plus_one(threshold=1):
+            User.objects.filter(pk=1).exists()
+            User.objects.filter(pk=2).exists()
+
+    def test_user_changelist(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        for i in range(10):
+            User.objects.create_user('user%d' % i)
+        self.client.login(username='admin', password='admin')
+        with detect_n_plus_one(where='the user changelist'):
+            response = self.client.get(reverse('admin:auth_user_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+# Not a TestCase: its transaction would send every read to the primary.
+@override_settings(DATABASE_REPLICAS=('replica',), DATABASE_PIN_SECONDS=10)
+class ReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.reset()
+        self.addCleanup(self.reset)
+        # Checked a moment ago.
+        router._replicas['replica'] = {'checked': time.time(),
+                                       'healthy': True}
+        self.router = router.ReplicaRouter()
+
+    def reset(self):
+        router._replicas.clear()
+        router.ReplicaPinMiddleware().process_response(None, HttpResponse())
+
+    def test_reads_go_to_the_replicas(self):
+        self.assertEqual(self.router.db_for_read(User), 'replica')
+
+    def test_writes_pin_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(User), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertTrue(router._state.wrote)
+
+    @override_settings(DATABASE_REPLICAS=())
+    def test_no_replicas_no_pin(self):
+        no_replicas = router.ReplicaRouter()
+        self.assertEqual(no_replicas.db_for_write(User), 'default')
+        self.assertEqual(no_replicas.db_for_read(User), 'default')
+        self.assertFalse(router._state.wrote)
+        self.assertEqual(router._state.pinned_until, 0)
+
+    def test_unreachable_replica_is_left_out(self):
+        router._replicas['replica']['checked'] = 0
+        dropped = counted('db_replica_dropped_total', 'replica')
+        # 'replica' isn't in DATABASES.
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertEqual(counted('db_replica_dropped_total', 'replica'),
+                         dropped + 1)
+        self.assertFalse(router._replicas['replica']['healthy'])
+
+    def test_replicas_are_not_synced(self):
+        self.assertFalse(self.router.allow_syncdb('replica', User))
+        self.assertIsNone(self.router.allow_syncdb('default', User))
+
+
+@override_settings(DATABASE_REPLICAS=('replica',), DATABASE_PIN_SECONDS=10)
+class ReplicaPinMiddlewareTest(SimpleTestCase):
+
+    def setUp(self):
+        self.middleware = router.ReplicaPinMiddleware()
+        self.factory = RequestFactory()
+        router._replicas['replica'] = {'checked': time.time(),
+                                       'healthy': True}
+        self.addCleanup(router._replicas.clear)
+
+    def request(self, pinned_until=None):
+        request = self.factory.get('/')
+        if pinned_until is not None:
+            request.COOKIES[router.PIN_COOKIE] = str(pinned_until)
+        self.middleware.process_request(request)
+        return request
+
+    def test_write_sets_the_cookie(self):
+        request = self.request()
+        router.pin()
+        response = self.middleware.process_response(request, HttpResponse())
+        cookie = response.cookies[router.PIN_COOKIE]
+        self.assertAlmostEqual(float(cookie.value), time.time() + 10,
+                               delta=1)
+        self.assertIn(cookie['max-age'], (10, 11))
+        self.assertEqual(router._state.pinned_until, 0)
+
+    def test_read_only_request_sets_no_cookie(self):
+        response = self.middleware.process_response(self.request(),
+                                                    HttpResponse())
+        self.assertNotIn(router.PIN_COOKIE, response.cookies)
+
+    def test_cookie_pins_the_next_requests(self):
+        request = self.request(time.time() + 5)
+        self.assertEqual(router.ReplicaRouter().db_for_read(User), 'default')
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertNotIn(router.PIN_COOKIE, response.cookies)
+        self.request(time.time() - 1)
+        self.assertEqual(router.ReplicaRouter().db_for_read(User), 'replica')
+        self.middleware.process_response(request, HttpResponse())
+
+    def test_cookie_is_bounded(self):
+        request = self.request(time.time() + 3600)
+        self.assertTrue(router._state.pinned_until <= time.time() + 10)
+        self.request('garbage')
+        self.assertEqual(router._state.pinned_until, 0)
+        self.middleware.process_response(request, HttpResponse())
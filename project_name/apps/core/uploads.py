@@ -0,0 +1,28 @@
+"""
+Upload handler streaming uploaded files to disk under ``VAR_ROOT``.
+
+Django's handlers keep uploads of up to ``FILE_UPLOAD_MAX_MEMORY_SIZE`` in
+memory and write bigger ones to a temporary file in ``FILE_UPLOAD_TEMP_DIR``,
+64 KB at a time. The settings lower that size to nginx's
+``client_body_buffer_size`` and put the temporary files under ``VAR_ROOT``:
+on the same file system as ``MEDIA_ROOT``, saving an upload with the default
+storage then moves the file instead of copying it.
+"""
+import errno
+import os
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    """``TemporaryFileUploadHandler`` creating ``FILE_UPLOAD_TEMP_DIR``."""
+
+    def new_file(self, *args, **kwargs):
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            try:
+                os.makedirs(settings.FILE_UPLOAD_TEMP_DIR)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        super(StreamingUploadHandler, self).new_file(*args, **kwargs)
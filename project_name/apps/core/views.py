@@ -0,0 +1,45 @@
+"""Views of the core app."""
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+
+from {{ project_name }}.apps.core import media, metrics as metrics_registry
+
+
+@never_cache
+def metrics(request):
+    """Expose the request metrics in the Prometheus text format.
+
+    Requires ``Authorization: Bearer <METRICS_TOKEN>``, or a staff user. The
+    view pretends not to exist otherwise.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = (
+        (token and constant_time_compare(authorization, 'Bearer ' + token)) or
+        (hasattr(request, 'user') and request.user.is_staff))
+    if not authorized:
+        raise Http404
+    histograms, counters, gauges = metrics_registry.collect()
+    labels = {}
+    if '{{ project_name }}.apps.jobs' in settings.INSTALLED_APPS:
+        from {{ project_name }}.apps.jobs import queue
+        gauges.update(queue.gauges())
+        labels.update(queue.GAUGE_LABELS)
+    return HttpResponse(
+        metrics_registry.render(histograms, counters, gauges, labels=labels),
+        content_type='text/plain; version=0.0.4')
+
+
+def protected_media(request, path):
+    """Send a file of ``PROTECTED_MEDIA_ROOT`` if ``PROTECTED_MEDIA_CHECK``
+    allows it, see :mod:`{{ project_name }}.apps.core.media`.
+    """
+    if not media.get_check()(request, path):
+        if not request.user.is_authenticated():
+            return redirect_to_login(request.get_full_path())
+        raise PermissionDenied
+    return media.send_file(request, path)
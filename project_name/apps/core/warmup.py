@@ -0,0 +1,71 @@
+"""
+Warm-up helpers run once in the gunicorn master before it forks its workers.
+
+With ``preload`` on, whatever is loaded here is shared copy-on-write by every
+worker instead of being built again by each one of them on its first
+requests.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.template.base import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.template.loaders.app_directories import app_template_dirs
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt', '.xml')
+
+
+def template_names(dirs=None):
+    """Yield the name of every template found in ``dirs``.
+
+    Defaults to ``TEMPLATE_DIRS`` plus the ``templates`` directory of every
+    installed app, in the order the loaders look them up.
+    """
+    if dirs is None:
+        dirs = tuple(settings.TEMPLATE_DIRS) + app_template_dirs
+    seen = set()
+    for template_dir in dirs:
+        for root, _, files in os.walk(template_dir):
+            for filename in files:
+                if not filename.endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, template_dir).replace(os.sep, '/')
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+
+def warm_templates(dirs=None):
+    """Load, and thus compile, every template so the cached loader keeps it.
+
+    Returns the number of templates compiled. Templates that can't be compiled
+    (e.g. they use a tag library of an app that isn't installed) are skipped.
+    """
+    count = 0
+    for name in template_names(dirs):
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            logger.debug("Skipped template %s: %s", name, e)
+        else:
+            count += 1
+    return count
+
+
+def warm_urls():
+    """Load the URLconf and every module it refers to.
+
+    With ``ADMIN_LAZY_AUTODISCOVER`` on, only the URLconf itself: building
+    the reverse lookup table would discover the admin modules, which the
+    setting defers to the first request under ``/admin/``. Returns the number
+    of top-level patterns, or the size of the reverse lookup table.
+    """
+    from django.core.urlresolvers import get_resolver
+    resolver = get_resolver(None)
+    if getattr(settings, 'ADMIN_LAZY_AUTODISCOVER', False):
+        return len(resolver.url_patterns)
+    return len(resolver.reverse_dict)
@@ -0,0 +1,9 @@
+"""
+Background jobs.
+
+Functions decorated with :func:`{{ project_name }}.apps.jobs.queue.job` get a
+``delay()`` method which stores a call in the database instead of making it.
+``manage.py runjobs`` (run by supervisord) makes the calls, see
+:mod:`{{ project_name }}.apps.jobs.queue` and
+:mod:`{{ project_name }}.apps.jobs.worker`.
+"""
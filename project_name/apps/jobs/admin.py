@@ -0,0 +1,20 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from {{ project_name }}.apps.jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'queue', 'status', 'attempts', 'run_at',
+                    'locked_by')
+    list_filter = ('status', 'queue')
+    search_fields = ('name',)
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        count = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, attempts=0, run_at=timezone.now())
+        self.message_user(request, "%d job(s) queued again." % count)
+    retry.short_description = "Retry the selected failed jobs"
+
+admin.site.register(Job, JobAdmin)
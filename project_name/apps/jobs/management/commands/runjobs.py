@@ -0,0 +1,32 @@
+"""
+Run the background jobs, see :mod:`{{ project_name }}.apps.jobs.worker`.
+"""
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from {{ project_name }}.apps.jobs.worker import Master
+
+
+class Command(NoArgsCommand):
+    help = "Run the queued background jobs until stopped."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', default=2,
+            help="Worker processes (default: 2)."),
+        make_option('--queues', default='default',
+            help="Comma separated queues to take jobs from "
+                 "(default: default)."),
+        make_option('--poll', type='float', default=5.0,
+            help="Most seconds between two looks at an empty queue "
+                 "(default: 5)."),
+        make_option('--max-jobs', type='int', default=1000,
+            help="Jobs a worker runs before it is replaced, 0 for no limit "
+                 "(default: 1000)."),
+    )
+
+    def handle_noargs(self, **options):
+        Master(processes=options['processes'],
+               queues=[q.strip() for q in options['queues'].split(',')
+                       if q.strip()],
+               poll=options['poll'],
+               max_jobs=options['max_jobs']).run()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'Job'
+        db.create_table(u'jobs_job', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('queue', self.gf('django.db.models.fields.CharField')(default='default', max_length=50)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('arguments', self.gf('django.db.models.fields.TextField')(default='[[], {}]')),
+            ('status', self.gf('django.db.models.fields.CharField')(default='queued', max_length=10)),
+            ('attempts', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('max_attempts', self.gf('django.db.models.fields.PositiveIntegerField')(default=5)),
+            ('backoff', self.gf('django.db.models.fields.PositiveIntegerField')(default=30)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('run_at', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('locked_by', self.gf('django.db.models.fields.CharField')(max_length=100, blank=True)),
+            ('locked_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('last_error', self.gf('django.db.models.fields.TextField')(blank=True)),
+        ))
+        db.send_create_signal(u'jobs', ['Job'])
+
+        # Adding index on 'Job', fields ['status', 'queue', 'run_at']
+        db.create_index(u'jobs_job', ['status', 'queue', 'run_at'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Job', fields ['status', 'queue', 'run_at']
+        db.delete_index(u'jobs_job', ['status', 'queue', 'run_at'])
+
+        # Deleting model 'Job'
+        db.delete_table(u'jobs_job')
+
+
+    models = {
+        u'jobs.job': {
+            'Meta': {'object_name': 'Job', 'index_together': "[('status', 'queue', 'run_at')]"},
+            'arguments': ('django.db.models.fields.TextField', [], {'default': "'[[], {}]'"}),
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'backoff': ('django.db.models.fields.PositiveIntegerField', [], {'default': '30'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'locked_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'locked_by': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'max_attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '5'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'queue': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '50'}),
+            'run_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'queued'", 'max_length': '10'})
+        }
+    }
+
+    complete_apps = ['jobs']
\ No newline at end of file
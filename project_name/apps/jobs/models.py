@@ -0,0 +1,41 @@
+"""Models of the jobs app."""
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """A call of a function waiting to be made (or that failed for good).
+
+    Jobs are deleted once they succeeded.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    queue = models.CharField(max_length=50, default='default')
+    # Dotted path of the function and its arguments as JSON [args, kwargs].
+    name = models.CharField(max_length=255)
+    arguments = models.TextField(default='[[], {}]')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Seconds before the first retry, doubled after each failure.
+    backoff = models.PositiveIntegerField(default=30)
+    created = models.DateTimeField(default=timezone.now)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # What workers look for: the oldest due job of their queues.
+        index_together = [('status', 'queue', 'run_at')]
+
+    def __unicode__(self):
+        return u'%s #%s' % (self.name, self.pk)
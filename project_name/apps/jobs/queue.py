@@ -0,0 +1,204 @@
+"""
+The job queue: enqueueing, claiming and finishing jobs.
+
+Decorate a function with :func:`job` to run it in the background::
+
+    @job(queue='mail', max_attempts=3)
+    def send_welcome_email(user_id):
+        ...
+
+    send_welcome_email.delay(user.pk)
+
+The arguments are stored as JSON, so pass ids rather than model instances.
+The job only becomes visible to the workers once the transaction that stored
+it is committed. With ``JOBS_EAGER`` on (e.g. in tests) ``delay()`` makes the
+call right away.
+
+Workers claim the oldest due job of their queues. On PostgreSQL this is a
+single ``UPDATE ... FOR UPDATE SKIP LOCKED`` statement, so workers never wait
+for each other; elsewhere (SQLite) a job is claimed by a conditional
+``UPDATE`` which only one worker can win. A failed job is retried after
+``backoff`` seconds, doubled after each attempt, until ``max_attempts``.
+"""
+import json
+import logging
+import os
+import random
+import socket
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+# Gauges of :func:`gauges` and the label of their values.
+GAUGE_LABELS = {
+    'jobs_queued': 'queue',
+    'jobs_running': 'queue',
+    'jobs_failed': 'queue',
+    'jobs_wait_seconds': 'queue',
+}
+
+
+def job(func=None, queue='default', max_attempts=5, backoff=30):
+    """Give ``func`` a ``delay(*args, **kwargs)`` method enqueueing a call.
+
+    Usable with or without arguments. ``func`` itself is left as it is.
+    """
+    def decorator(func):
+        @wraps(func)
+        def delay(*args, **kwargs):
+            return enqueue(func, args, kwargs, queue=queue,
+                           max_attempts=max_attempts, backoff=backoff)
+        func.delay = delay
+        return func
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def enqueue(func, args=(), kwargs=None, queue='default', max_attempts=5,
+            backoff=30, delay=0):
+    """Store a call of ``func``, to be made in ``delay`` seconds at the
+    earliest. Returns the :class:`Job`, or ``None`` with ``JOBS_EAGER``.
+    """
+    kwargs = kwargs or {}
+    if getattr(settings, 'JOBS_EAGER', False):
+        func(*args, **kwargs)
+        return None
+    from {{ project_name }}.apps.jobs.models import Job
+    now = timezone.now()
+    return Job.objects.create(
+        queue=queue, name='%s.%s' % (func.__module__, func.__name__),
+        arguments=json.dumps([list(args), kwargs]),
+        max_attempts=max_attempts, backoff=backoff, created=now,
+        run_at=now + timedelta(seconds=delay))
+
+
+def get_function(name):
+    module, attr = name.rsplit('.', 1)
+    return getattr(import_module(module), attr)
+
+
+def worker_name(pid=None):
+    """The ``locked_by`` of the jobs claimed by process ``pid``."""
+    return '%s:%d' % (socket.gethostname(), pid or os.getpid())
+
+
+def claim(queues, locked_by):
+    """Mark the oldest due job of ``queues`` as running and return it.
+
+    Returns ``None`` when there is none.
+    """
+    from {{ project_name }}.apps.jobs.models import Job
+    using = router.db_for_write(Job)
+    if connections[using].vendor == 'postgresql':
+        job_id = _claim_skip_locked(using, queues, locked_by)
+        return Job.objects.using(using).get(pk=job_id) if job_id else None
+    while True:
+        now = timezone.now()
+        candidates = list(Job.objects.using(using)
+                          .filter(status=Job.QUEUED, queue__in=queues,
+                                  run_at__lte=now)
+                          .order_by('run_at', 'id')
+                          .values_list('id', flat=True)[:1])
+        if not candidates:
+            return None
+        # Only one worker can turn the job from queued to running; the
+        # others look for the next one.
+        claimed = (Job.objects.using(using)
+                   .filter(pk=candidates[0], status=Job.QUEUED)
+                   .update(status=Job.RUNNING, locked_by=locked_by,
+                           locked_at=now, attempts=F('attempts') + 1))
+        if claimed:
+            return Job.objects.using(using).get(pk=candidates[0])
+
+
+def _claim_skip_locked(using, queues, locked_by):
+    from {{ project_name }}.apps.jobs.models import Job
+    connection = connections[using]
+    table = connection.ops.quote_name(Job._meta.db_table)
+    now = timezone.now()
+    with transaction.commit_on_success(using=using):
+        cursor = connection.cursor()
+        cursor.execute(
+            'UPDATE ' + table + ' SET status = %s, locked_by = %s, '
+            'locked_at = %s, attempts = attempts + 1 '
+            'WHERE id = ('
+            ' SELECT id FROM ' + table +
+            ' WHERE status = %s AND queue IN (' +
+            ', '.join(['%s'] * len(queues)) + ') AND run_at <= %s'
+            ' ORDER BY run_at, id LIMIT 1 FOR UPDATE SKIP LOCKED) '
+            'RETURNING id',
+            [Job.RUNNING, locked_by, now, Job.QUEUED] + list(queues) + [now])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def complete(job):
+    job.delete()
+
+
+def fail(job, error):
+    """Schedule ``job`` to be retried, or mark it as failed for good."""
+    from {{ project_name }}.apps.jobs.models import Job
+    if job.attempts >= job.max_attempts:
+        status, run_at = Job.FAILED, job.run_at
+        logger.error("Job %s failed for good after %d attempts:\n%s",
+                     job, job.attempts, error)
+    else:
+        wait = job.backoff * 2 ** (job.attempts - 1)
+        # A little jitter keeps jobs which failed together from retrying
+        # together.
+        wait += random.uniform(0, wait / 10.0)
+        status, run_at = Job.QUEUED, timezone.now() + timedelta(seconds=wait)
+        logger.warning("Job %s failed (attempt %d of %d), retrying in %ds:\n%s",
+                       job, job.attempts, job.max_attempts, wait, error)
+    Job.objects.filter(pk=job.pk).update(
+        status=status, run_at=run_at, locked_by='', locked_at=None,
+        last_error=error)
+
+
+def requeue(locked_by=None, older_than=None):
+    """Queue running jobs again: those of a worker that died (``locked_by``)
+    or those running for more than ``older_than`` seconds.
+
+    Their attempt counts, so a job that kills its worker ends up failed.
+    Returns the number of jobs queued again.
+    """
+    from {{ project_name }}.apps.jobs.models import Job
+    jobs = Job.objects.filter(status=Job.RUNNING)
+    if locked_by is not None:
+        jobs = jobs.filter(locked_by=locked_by)
+    if older_than is not None:
+        jobs = jobs.filter(
+            locked_at__lt=timezone.now() - timedelta(seconds=older_than))
+    failed = jobs.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_by='', locked_at=None,
+        last_error='The worker running the job died.')
+    queued = jobs.update(status=Job.QUEUED, locked_by='', locked_at=None)
+    return failed + queued
+
+
+def gauges():
+    """Return the depth and wait time of each queue, as metric gauges.
+
+    ``jobs_wait_seconds`` is how long the oldest due job has been waiting:
+    it grows when the workers don't keep up.
+    """
+    from {{ project_name }}.apps.jobs.models import Job
+    now = timezone.now()
+    gauges = dict((name, {}) for name in GAUGE_LABELS)
+    for row in (Job.objects.values('queue', 'status')
+                .annotate(count=Count('id'))):
+        gauges['jobs_' + row['status']][row['queue']] = row['count']
+    for row in (Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+                .values('queue').annotate(oldest=Min('run_at'))):
+        gauges['jobs_wait_seconds'][row['queue']] = \
+            (now - row['oldest']).total_seconds()
+    return gauges
@@ -0,0 +1,105 @@
+"""
+Tests of the jobs app.
+"""
+import json
+from datetime import timedelta
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from {{ project_name }}.apps.jobs import queue
+from {{ project_name }}.apps.jobs.models import Job
+
+calls = []
+
+
+@queue.job(queue='tests', max_attempts=2, backoff=10)
+def record(value, twice=False):
+    calls.append(value)
+    if twice:
+        calls.append(value)
+
+
+class QueueTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        # Failures are logged as errors, mailed to the admins.
+        queue.logger.disabled = True
+        self.addCleanup(setattr, queue.logger, 'disabled', False)
+
+    def enqueue(self, delay=0, queue_name='tests'):
+        return queue.enqueue(record, [1], queue=queue_name, max_attempts=2,
+                             backoff=10, delay=delay)
+
+    def test_delay(self):
+        job = record.delay(1, twice=True)
+        self.assertEqual(calls, [])
+        self.assertEqual((job.queue, job.max_attempts, job.backoff),
+                         ('tests', 2, 10))
+        args, kwargs = json.loads(job.arguments)
+        queue.get_function(job.name)(*args, **kwargs)
+        self.assertEqual(calls, [1, 1])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        self.assertIsNone(record.delay(1))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_oldest_due_job(self):
+        self.enqueue(delay=60)
+        self.enqueue(queue_name='other')
+        first, second = self.enqueue(), self.enqueue()
+        job = queue.claim(['tests'], 'host:1')
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual((job.status, job.locked_by, job.attempts),
+                         (Job.RUNNING, 'host:1', 1))
+        self.assertEqual(queue.claim(['tests'], 'host:2').pk, second.pk)
+        self.assertIsNone(queue.claim(['tests'], 'host:3'))
+
+    def test_backoff(self):
+        self.enqueue()
+        job = queue.claim(['tests'], 'host:1')
+        queue.fail(job, 'error')
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.locked_by, job.last_error),
+                         (Job.QUEUED, '', 'error'))
+        wait = (job.run_at - timezone.now()).total_seconds()
+        self.assertTrue(9 < wait <= 11, wait)
+        self.assertIsNone(queue.claim(['tests'], 'host:1'))
+
+        Job.objects.update(run_at=timezone.now())
+        job = queue.claim(['tests'], 'host:1')
+        queue.fail(job, 'error')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+
+    def test_complete(self):
+        self.enqueue()
+        queue.complete(queue.claim(['tests'], 'host:1'))
+        self.assertFalse(Job.objects.exists())
+
+    def test_requeue(self):
+        self.enqueue()
+        self.enqueue()
+        job = queue.claim(['tests'], 'host:1')
+        Job.objects.filter(pk=job.pk).update(attempts=2)
+        queue.claim(['tests'], 'host:2')
+        self.assertEqual(queue.requeue(locked_by='host:1'), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        self.assertEqual(queue.requeue(older_than=60), 0)
+        Job.objects.filter(status=Job.RUNNING).update(
+            locked_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(queue.requeue(older_than=60), 1)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_gauges(self):
+        self.enqueue()
+        self.enqueue(delay=60)
+        Job.objects.filter(pk=self.enqueue().pk).update(
+            run_at=timezone.now() - timedelta(seconds=30))
+        gauges = queue.gauges()
+        self.assertEqual(gauges['jobs_queued'], {'tests': 3})
+        self.assertEqual(gauges['jobs_running'], {})
+        self.assertTrue(30 <= gauges['jobs_wait_seconds']['tests'] < 40)
@@ -0,0 +1,205 @@
+"""
+The worker processes of ``manage.py runjobs``.
+
+A master process forks ``processes`` children which claim and run jobs, one
+at a time each, and forks a new one whenever a child exits: after
+``max_jobs`` jobs (to bound leaks), or because it crashed, in which case the
+jobs it was running are queued again. The master also queues again, every
+minute, jobs running for more than ``JOBS_LEASE`` seconds.
+
+Signals, sent to the master:
+
+``TERM``, ``INT``
+    Stop: every child finishes its current job and exits, then the master.
+``HUP``
+    Reload: like ``TERM``, then the master starts over with the new code.
+"""
+import errno
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import traceback
+
+from django.conf import settings
+from django.db import connections
+
+from {{ project_name }}.apps.core.db.pool import (close_connections,
+                                             reset_after_fork)
+from {{ project_name }}.apps.jobs import queue
+
+logger = logging.getLogger(__name__)
+
+REQUEUE_INTERVAL = 60
+
+
+def close_job_connections():
+    # Nothing is left in a transaction between jobs, and a connection that
+    # broke during a job isn't handed to the next one.
+    for connection in connections.all():
+        connection.close()
+
+
+class Master(object):
+
+    def __init__(self, processes=2, queues=('default',), poll=5.0,
+                 max_jobs=1000):
+        self.processes = processes
+        self.queues = list(queues)
+        self.poll = poll
+        self.max_jobs = max_jobs
+        self.children = {}
+        self.stopping = False
+        self.reloading = False
+        self.last_requeue = 0
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+        logger.info("Master %d running jobs of %s with %d processes.",
+                    os.getpid(), ', '.join(self.queues), self.processes)
+        while not self.stopping:
+            self.reap()
+            if self.stopping:
+                break
+            self.requeue_expired()
+            while len(self.children) < self.processes:
+                self.spawn()
+            # Cut short by TERM and HUP.
+            time.sleep(1)
+        for pid in self.children:
+            self.kill(pid, signal.SIGTERM)
+        while self.children:
+            self.reap(block=True)
+        close_connections()
+        if self.reloading:
+            logger.info("Master %d reloading.", os.getpid())
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reload(self, signum, frame):
+        self.stopping = self.reloading = True
+
+    def spawn(self):
+        # The children mustn't share the master's database connections.
+        close_connections()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return
+        status = 1
+        try:
+            reset_after_fork()
+            Worker(self.queues, self.poll, self.max_jobs).run()
+            status = 0
+        except Exception:
+            logger.exception("Worker %d crashed.", os.getpid())
+        finally:
+            # Skip the master's exit handlers.
+            os._exit(status)
+
+    def reap(self, block=False):
+        """Forget exited children, queue their jobs again if they crashed."""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    self.children.clear()
+                    return
+                raise
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            if status:
+                requeued = queue.requeue(locked_by=queue.worker_name(pid))
+                logger.error("Worker %d died (status %d), %d jobs queued "
+                             "again.", pid, status, requeued)
+                if time.time() - started < 1 and not self.stopping:
+                    # Don't fork in a tight loop when children die at once
+                    # (e.g. the database is down).
+                    time.sleep(1)
+            if block:
+                return
+
+    def requeue_expired(self):
+        lease = getattr(settings, 'JOBS_LEASE', None)
+        if not lease or time.time() - self.last_requeue < REQUEUE_INTERVAL:
+            return
+        self.last_requeue = time.time()
+        try:
+            requeued = queue.requeue(older_than=lease)
+        except Exception:
+            logger.exception("Can't queue expired jobs again.")
+            return
+        if requeued:
+            logger.warning("%d jobs running for more than %ds queued again.",
+                           requeued, lease)
+
+    def kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+class Worker(object):
+    """Claim and run jobs until stopped or after ``max_jobs`` of them."""
+
+    def __init__(self, queues, poll, max_jobs):
+        self.queues = queues
+        self.poll = poll
+        self.max_jobs = max_jobs
+        self.name = queue.worker_name()
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        done = 0
+        idle = 0
+        while not self.stopping and (not self.max_jobs or
+                                     done < self.max_jobs):
+            try:
+                job = queue.claim(self.queues, self.name)
+            except Exception:
+                logger.exception("Worker %s can't claim a job.", self.name)
+                close_job_connections()
+                job = None
+            if job is None:
+                # Poll quickly after a job, less and less while idle.
+                idle = min(idle * 2 or 0.1, self.poll)
+                time.sleep(idle)
+                continue
+            idle = 0
+            self.perform(job)
+            done += 1
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def perform(self, job):
+        start = time.time()
+        try:
+            args, kwargs = json.loads(job.arguments)
+            queue.get_function(job.name)(*args, **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            # Roll back whatever the job left in its transaction.
+            close_job_connections()
+            queue.fail(job, error)
+        else:
+            logger.info("Job %s done in %.3fs.", job, time.time() - start)
+            queue.complete(job)
+        close_job_connections()
@@ -1,13 +1,16 @@
 """Base settings shared by all environments"""
 # Import global settings to make it easier to extend settings.
 import os
+import sys
 from django.conf.global_settings import *   # pylint: disable=W0614,W0401
 
 #==============================================================================
 # Generic Django project settings
 #==============================================================================
 
-DEBUG = True
+# Each environment turns it on if needed: with DEBUG, every SQL query of a
+# request is kept in memory (see ``manage.py perfcheck``).
+DEBUG = False
 TEMPLATE_DEBUG = DEBUG
 
 SITE_ID = 1
@@ -43,17 +46,42 @@ if not os.path.exists(VAR_ROOT):
 #==============================================================================
 
 ROOT_URLCONF = '{{ project_name }}.urls'
+# Used by runserver too, so that it answers the health checks of wsgi.py.
+WSGI_APPLICATION = '{{ project_name }}.wsgi.application'
 
 LOGIN_URL = '/login/'
 LOGOUT_URL = '/logout/'
 LOGIN_REDIRECT_URL = '/'
 
+# Import the admin modules of the apps on the first request to /admin/ rather
+# than when the URLconf is loaded (see {{ project_name }}.apps.core.admin_urls),
+# in the gunicorn master too.
+ADMIN_LAZY_AUTODISCOVER = False
+
 STATIC_URL = '/static/'
 MEDIA_URL = '/uploads/'
 
 STATIC_ROOT = os.path.join(VAR_ROOT, 'static')
 MEDIA_ROOT = os.path.join(VAR_ROOT, 'uploads')
 
+# Files only sent to the users PROTECTED_MEDIA_CHECK(request, path) allows, see
+# {{ project_name }}.apps.core.media. Behind nginx, set
+# PROTECTED_MEDIA_ACCEL_URL to its internal location of PROTECTED_MEDIA_ROOT.
+PROTECTED_MEDIA_ROOT = os.path.join(VAR_ROOT, 'protected')
+PROTECTED_MEDIA_URL = '/protected/'
+PROTECTED_MEDIA_CHECK = \
+    '{{ project_name }}.apps.core.media.user_is_authenticated'
+PROTECTED_MEDIA_ACCEL_URL = None
+
+# Uploads bigger than nginx's client_body_buffer_size are streamed to disk,
+# next to MEDIA_ROOT so that saving them is a rename.
+FILE_UPLOAD_HANDLERS = (
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    '{{ project_name }}.apps.core.uploads.StreamingUploadHandler',
+)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 128 * 1024
+FILE_UPLOAD_TEMP_DIR = os.path.join(VAR_ROOT, 'tmp', 'uploads')
+
 STATICFILES_DIRS = (
     os.path.join(PROJECT_DIR, 'static'),
 )
@@ -63,6 +91,73 @@ STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
 )
 
+# Where ``manage.py updatestatic`` remembers what it already collected.
+STATICFILES_MANIFEST = os.path.join(VAR_ROOT, 'staticfiles.json')
+
+# Collected files get content-hashed names (used when DEBUG is off) and
+# gzipped copies, so that nginx can serve them compressed and cache them for
+# good.
+STATICFILES_STORAGE = \
+    '{{ project_name }}.apps.core.storage.ManifestStaticFilesStorage'
+
+#==============================================================================
+# Databases
+#==============================================================================
+
+# Reads go to the DATABASE_REPLICAS aliases of DATABASES, writes and
+# transactions to 'default' (see {{ project_name }}.apps.core.db.router). A
+# client that wrote reads from 'default' for DATABASE_PIN_SECONDS, and
+# replicas more than DATABASE_REPLICA_MAX_LAG seconds behind are left out
+# until they catch up.
+DATABASE_ROUTERS = ['{{ project_name }}.apps.core.db.router.ReplicaRouter']
+DATABASE_REPLICAS = ()
+DATABASE_PIN_SECONDS = 10
+DATABASE_REPLICA_MAX_LAG = 5
+DATABASE_REPLICA_CHECK_INTERVAL = 5
+
+#==============================================================================
+# Cache
+#==============================================================================
+
+from {{ project_name }}.apps.core.revision import get_revision
+
+# Each process keeps the hottest entries in front of the shared cache, a
+# memcached every web host uses (point LOCATION at it). Keys are prefixed
+# with the deployed revision, so a deploy doesn't see the entries cached by
+# the previous code.
+CACHES = {
+    'default': {
+        'BACKEND': '{{ project_name }}.apps.core.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': get_revision(os.path.join(PROJECT_DIR, '..'))[:12],
+    },
+    # Sessions must be seen at once by every host and survive deploys: no
+    # local tier, no revision prefix.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 'sessions',
+    },
+}
+
+# Sessions are read from the SESSION_STORE_CACHE cache and written through to
+# the database, except for the saves which only refresh their expiry: those
+# reach it at most once every SESSION_DB_WRITE_INTERVAL seconds, see
+# {{ project_name }}.apps.core.sessions. ``fab clearsessions`` deletes the
+# expired ones.
+SESSION_ENGINE = '{{ project_name }}.apps.core.sessions'
+SESSION_STORE_CACHE = 'sessions'
+SESSION_STORE_LOCAL_CACHE = False
+SESSION_DB_WRITE_INTERVAL = 60
+
 #==============================================================================
 # Templates
 #==============================================================================
@@ -92,6 +187,12 @@ TEMPLATE_DIRS = (
 #==============================================================================
 
 MIDDLEWARE_CLASSES = (
+    # Per view timings, first so that it times the other middleware too.
+    '{{ project_name }}.apps.core.middleware.MetricsMiddleware',
+    # Repeated queries of a sample of the requests, see NPLUSONE_SAMPLE_RATE.
+    '{{ project_name }}.apps.core.nplusone.NPlusOneMiddleware',
+    # Before any middleware that writes, see DATABASE_PIN_SECONDS.
+    '{{ project_name }}.apps.core.db.router.ReplicaPinMiddleware',
     # Default Django middleware.
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -118,6 +219,11 @@ AUTHENTICATION_BACKENDS += (
 # the site admins on every HTTP 500 error when DEBUG=False.
 # See http://docs.djangoproject.com/en/dev/topics/logging for
 # more details on how to customize your logging configuration.
+#
+# The emails are sent from a background thread: errors logged within `window`
+# seconds of each other make a single digest, at most `max_per_minute` are
+# sent and records past `queue_size` are dropped (see
+# {{ project_name }}.apps.core.log).
 
 LOGGING = {
     'version': 1,
@@ -131,8 +237,15 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
-            'class': 'django.utils.log.AdminEmailHandler'
-        }
+            'class': '{{ project_name }}.apps.core.log.QueuedAdminEmailHandler',
+            'window': 10,
+            'max_per_minute': 5,
+            'queue_size': 1000,
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -140,6 +253,18 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # Repeated queries found in sampled requests, in gunicorn's error log.
+        '{{ project_name }}.apps.core.nplusone': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
+        # The job workers log to supervisord, failures are mailed too.
+        '{{ project_name }}.apps.jobs': {
+            'handlers': ['console', 'mail_admins'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     }
 }
 
@@ -147,6 +272,29 @@ LOGGING = {
 # Miscellaneous project settings
 #==============================================================================
 
+# Request metrics (see {{ project_name }}.apps.core.metrics), served at
+# /_metrics/ to staff users and to requests bearing this token.
+METRICS_DIR = os.path.join(VAR_ROOT, 'metrics')
+METRICS_FLUSH_INTERVAL = 10
+METRICS_TOKEN = ''
+
+# Content hashes of the compiled sources, see ``manage.py precompile``.
+PRECOMPILE_MANIFEST = os.path.join(VAR_ROOT, 'bytecode.json')
+
+# N+1 queries (see {{ project_name }}.apps.core.nplusone): the fraction of the
+# requests checked for a query repeated more than NPLUSONE_THRESHOLD times
+# from the same place, which gets logged. Under ``manage.py test`` every
+# request is checked and fails with NPlusOneError instead.
+NPLUSONE_SAMPLE_RATE = 0
+NPLUSONE_THRESHOLD = 5
+NPLUSONE_RAISE = sys.argv[1:2] == ['test']
+
+# Background jobs (see {{ project_name }}.apps.jobs). Jobs still running after
+# JOBS_LEASE seconds are considered lost and queued again. JOBS_EAGER runs
+# them at once instead of queueing them, e.g. in tests.
+JOBS_EAGER = False
+JOBS_LEASE = 3600
+
 
 #==============================================================================
 # App settings
@@ -175,6 +323,8 @@ THIRD_PARTY_APPS = (
 
 # Apps specific for this project go here.
 LOCAL_APPS = (
+    '{{ project_name }}.apps.core',
+    '{{ project_name }}.apps.jobs',
 )
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
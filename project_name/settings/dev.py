@@ -6,11 +6,24 @@ TEMPLATE_DEBUG = DEBUG
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': '{{ project_name }}.apps.core.db.postgresql_pool',
         'NAME': '{{ project_name }}',
 #        'USER': 'dbuser',
 #        'PASSWORD': 'dbpassword',
+        'POOL': {
+            'MAX_SIZE': 4,
+            'MAX_AGE': 600,
+            'MAX_USES': 1000,
+        },
     }
 }
 
+# South doesn't know the pooled backend, it is PostgreSQL underneath.
+SOUTH_DATABASE_ADAPTERS = {
+    'default': 'south.db.postgresql_psycopg2',
+}
+
+# nginx sends the protected files (see server/dev/nginx.conf).
+PROTECTED_MEDIA_ACCEL_URL = '/_protected/'
+
 # WSGI_APPLICATION = '{{ project_name }}.wsgi.dev.application'
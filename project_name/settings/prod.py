@@ -0,0 +1,50 @@
+"""Settings for Production Server"""
+from {{ project_name }}.settings.base import *   # pylint: disable=W0614,W0401
+
+DEBUG = False
+TEMPLATE_DEBUG = DEBUG
+
+ALLOWED_HOSTS = ['{{ project_name }}.com']
+
+DATABASES = {
+    'default': {
+        'ENGINE': '{{ project_name }}.apps.core.db.postgresql_pool',
+        'NAME': '{{ project_name }}',
+#        'USER': 'dbuser',
+#        'PASSWORD': 'dbpassword',
+        'POOL': {
+            'MAX_SIZE': 4,
+            'MAX_AGE': 600,
+            'MAX_USES': 1000,
+        },
+    },
+#    'replica': {
+#        'ENGINE': '{{ project_name }}.apps.core.db.postgresql_pool',
+#        'NAME': '{{ project_name }}',
+#        'HOST': 'replica.{{ project_name }}.com',
+#        'POOL': {'MAX_SIZE': 4, 'MAX_AGE': 600, 'MAX_USES': 1000},
+#    },
+}
+
+# Read from these aliases of DATABASES (see the base settings).
+# DATABASE_REPLICAS = ('replica',)
+
+# South doesn't know the pooled backend, it is PostgreSQL underneath.
+SOUTH_DATABASE_ADAPTERS = {
+    'default': 'south.db.postgresql_psycopg2',
+}
+
+# Keep compiled templates in memory instead of reading and parsing them from
+# disk on every render. gunicorn compiles them all before forking its workers
+# (see ``when_ready`` in its configuration).
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+)
+
+# Check one request in a hundred for N+1 queries.
+NPLUSONE_SAMPLE_RATE = 0.01
+
+# nginx sends the protected files (see server/dev/nginx.conf).
+PROTECTED_MEDIA_ACCEL_URL = '/_protected/'
+
+# WSGI_APPLICATION = '{{ project_name }}.wsgi.prod.application'
@@ -4,12 +4,22 @@ from django.conf.urls.static import static
 
 from django.contrib import admin
 
-admin.autodiscover()
+if settings.ADMIN_LAZY_AUTODISCOVER:
+    from {{ project_name }}.apps.core.admin_urls import lazy_admin_urls
+    admin_urls = lazy_admin_urls()
+else:
+    admin.autodiscover()
+    admin_urls = admin.site.urls
 
 urlpatterns = patterns('',
    # (r'', include('{{ project_name }}.apps.')),
     (r'^admin/doc/', include('django.contrib.admindocs.urls')),
-    (r'^admin/', include(admin.site.urls)),
+    (r'^admin/', include(admin_urls)),
+    url(r'^_metrics/$', '{{ project_name }}.apps.core.views.metrics',
+        name='metrics'),
+    url(r'^%s(?P<path>.+)$' % settings.PROTECTED_MEDIA_URL.lstrip('/'),
+        '{{ project_name }}.apps.core.views.protected_media',
+        name='protected_media'),
 )
 
 if settings.DEBUG and settings.MEDIA_ROOT:
@@ -24,6 +24,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE",
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Answer /_health/live and /_health/ready before Django's handler: no
+# middleware, sessions or URL resolving for load balancers and deploys.
+from {{ project_name }}.apps.core.health import HealthCheck
+application = HealthCheck(application)
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
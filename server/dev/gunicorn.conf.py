@@ -1,17 +1,134 @@
+# Rendered from server/templates by `fab dev render_configs`, edit the template
+# instead.
 import os
+import random
+
+# Estimated resident memory of one worker, used to avoid forking more workers
+# than the container can hold.
+WORKER_MEMORY = int(os.environ.get('GUNICORN_WORKER_MEMORY_MB', 150)) * 1024 ** 2
+UNLIMITED = 2 ** 60
+
+
+def read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except IOError:
+        return None
 
 def num_cpus():
+    """Return the number of CPUs we may use, honouring cgroup CPU quotas."""
     if not hasattr(os, "sysconf"):
         raise RuntimeError("No sysconf detected.")
-    return os.sysconf("SC_NPROCESSORS_ONLN")
+    cpus = os.sysconf("SC_NPROCESSORS_ONLN")
+
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    quota = read_first_line('/sys/fs/cgroup/cpu.max')
+    if quota and not quota.startswith('max'):
+        quota, period = quota.split()
+    else:
+        # cgroup v1: quota is -1 when there is none
+        quota = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        cpus = min(cpus, max(1, int(round(float(quota) / int(period)))))
+    return cpus
+
+def available_memory():
+    """Return the memory we may use, in bytes, honouring cgroup limits."""
+    limit = UNLIMITED
+    for path in ('/sys/fs/cgroup/memory.max',                      # v2
+                 '/sys/fs/cgroup/memory/memory.limit_in_bytes'):   # v1
+        value = read_first_line(path)
+        if value and value.isdigit():
+            limit = min(limit, int(value))
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    limit = min(limit, int(line.split()[1]) * 1024)
+    except IOError:
+        pass
+    return limit
+
+# sync (default), gevent or eventlet; gthread needs gunicorn >= 19.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+cpus = num_cpus()
+if worker_class == 'sync':
+    # Sync workers block on I/O, have a few more than CPUs.
+    cpu_workers = cpus * 2 + 1
+else:
+    # A single async or threaded worker keeps a CPU busy.
+    cpu_workers = cpus + 1
+    worker_connections = 1000
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+memory_workers = max(1, available_memory() // WORKER_MEMORY)
+workers = int(os.environ.get('GUNICORN_WORKERS', 0)) or \
+          min(cpu_workers, memory_workers)
+
+# Recycle workers after a number of requests to bound memory growth. Each
+# worker gets some jitter so that they don't all restart at the same time.
+max_requests = 1000
+max_requests_jitter = 100
 
 preload = True
-workers = num_cpus() * 2 + 1
-bind = '127.0.0.1:11000'
+# Shared with nginx, which keeps connections to it open (see the upstream of
+# nginx.conf).
+bind = 'unix:/home/{{ project_name }}/{{ project_name }}/var/gunicorn.sock'
 pid = '/home/{{ project_name }}/{{ project_name }}/var/gunicorn.pid'
 django_settings = '{{ project_name }}.settings.dev'
 
 # log files
 accesslog = '/home/{{ project_name }}/{{ project_name }}/server/dev/logs/gunicorn-access.log'
 errorlog  = '/home/{{ project_name }}/{{ project_name }}/server/dev/logs/gunicorn-error.log'
-loglevel  = 'debug'
+# 'debug' logs every request line to the error log too.
+loglevel  = 'info'
+# One JSON object per request, with its duration and view; see
+# ``manage.py analyzelogs``.
+logger_class = '{{ project_name }}.apps.core.accesslog.JSONLogger'
+
+def on_starting(server):
+    server.log.info("Starting %d %s workers (%d CPUs allow %d, memory allows "
+                    "%d).", workers, worker_class, cpus, cpu_workers,
+                    memory_workers)
+
+def when_ready(server):
+    # The application is preloaded: compile every template once in the master
+    # so the workers share them (only useful with the cached template loader).
+    from {{ project_name }}.apps.core.warmup import warm_templates, warm_urls
+    server.log.info("Compiled %d templates before forking.", warm_templates())
+    # Same for the URLconf, and the admin modules unless they are discovered
+    # lazily (ADMIN_LAZY_AUTODISCOVER), which only the workers serving
+    # /admin/ then pay for.
+    server.log.info("Loaded the URLconf before forking (%d entries).",
+                    warm_urls())
+
+def pre_exec(server):
+    # USR2 re-executes the interpreter the master was started with, i.e. the
+    # virtualenv of the previous requirements (pip writes its real path in
+    # the scripts). Go through the link ``fab restart`` switched instead.
+    python = '/home/{{ project_name }}/.virtualenvs/{{ project_name }}/bin/python'
+    server.START_CTX[0] = python
+    server.START_CTX['args'][0] = python
+
+def pre_fork(server, worker):
+    # Workers must not inherit the master's database connections.
+    from {{ project_name }}.apps.core.db.pool import close_connections
+    close_connections()
+
+def post_fork(server, worker):
+    worker.max_requests = max_requests + random.randint(0, max_requests_jitter)
+    from {{ project_name }}.apps.core.db.pool import reset_after_fork
+    from {{ project_name }}.apps.core.metrics import registry
+    reset_after_fork()
+    registry.reset()
+
+def worker_exit(server, worker):
+    # Leave the final request metrics of this worker behind. The master calls
+    # this hook too, for a worker it found already gone: it has nothing of
+    # its own to write (worker.pid is always the current pid in gunicorn
+    # 0.17, compare with the master's).
+    if os.getpid() == server.pid:
+        return
+    from {{ project_name }}.apps.core.metrics import registry
+    registry.flush()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Keep supervisord attached to a gunicorn master that re-executes itself.
+
+On ``USR2`` gunicorn starts a new master (with the new code) next to the old
+one and rewrites its pidfile; the old master exits when it receives ``QUIT``.
+If supervisord ran gunicorn directly it would see its child exit at that point
+and try to start a second server on the same address.
+
+This script starts the given command, forwards every signal it gets to the pid
+currently written in the pidfile and only exits once that process is gone.
+
+Usage::
+
+    pidfollow.py <pidfile> <command> [<arg> ...]
+
+"""
+import errno
+import os
+import signal
+import subprocess
+import sys
+import time
+
+FORWARDED_SIGNALS = ('SIGHUP', 'SIGINT', 'SIGQUIT', 'SIGTERM', 'SIGUSR1',
+                     'SIGUSR2', 'SIGTTIN', 'SIGTTOU', 'SIGWINCH')
+
+
+def read_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip() or 0) or None
+    except (IOError, ValueError):
+        return None
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def main(pidfile, command):
+    child = subprocess.Popen(command)
+    state = {'pid': child.pid}
+
+    def forward(signum, frame):
+        try:
+            os.kill(state['pid'], signum)
+        except OSError:
+            pass
+
+    for name in FORWARDED_SIGNALS:
+        signal.signal(getattr(signal, name), forward)
+
+    while True:
+        # The pidfile briefly disappears while gunicorn renames it to
+        # ``.oldbin``, keep following the last known master meanwhile.
+        pid = read_pid(pidfile)
+        if pid and is_alive(pid):
+            state['pid'] = pid
+        child_running = child.poll() is None
+        if not child_running and not is_alive(state['pid']):
+            return child.returncode or 0
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+    sys.exit(main(sys.argv[1], sys.argv[2:]))